@@ -20,11 +20,13 @@ if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
 # Подключаем модели
-from app.main import Base
+from app.main import Base, SQLALCHEMY_DATABASE_URL
 target_metadata = Base.metadata
 
 def get_url():
-    return os.getenv("DATABASE_URL")
+    # Миграции всегда выполняются через синхронный драйвер,
+    # даже если DATABASE_URL указывает асинхронный
+    return SQLALCHEMY_DATABASE_URL
 
 def run_migrations_offline():
     """Run migrations in 'offline' mode."""
@@ -52,7 +54,10 @@ def run_migrations_online():
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            # Заполнение данных порциями фиксирует транзакцию посреди миграции,
+            # поэтому каждая ревизия выполняется в своей транзакции
+            transaction_per_migration=True,
         )
 
         with context.begin_transaction():
@@ -0,0 +1,27 @@
+"""add code_sequences table
+
+Revision ID: 3c1f7a9e2b64
+Revises: 798d9a2c6a2e
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3c1f7a9e2b64'
+down_revision = '798d9a2c6a2e'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Счетчик для выделения коротких кодов блоками (SequenceCodeAllocator)
+    op.create_table(
+        'code_sequences',
+        sa.Column('name', sa.String(32), nullable=False),
+        sa.Column('next_value', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+def downgrade():
+    op.drop_table('code_sequences')
@@ -0,0 +1,143 @@
+"""store full SHA-256 url_hash
+
+Revision ID: 9b4e2d7c5a18
+Revises: 3c1f7a9e2b64
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9b4e2d7c5a18'
+down_revision = '3c1f7a9e2b64'
+branch_labels = None
+depends_on = None
+
+# Сколько строк пересчитываем за одну короткую транзакцию
+BATCH_SIZE = 1000
+
+
+def _sha256(url):
+    return hashlib.sha256(str(url).encode()).digest()
+
+
+def _legacy_hash(url):
+    full_hash = hashlib.md5(str(url).encode()).hexdigest()
+    return str(int(full_hash[:8], 16))[-10:].zfill(10)
+
+
+def _backfill_batch(bind, urls, column, hash_func, last_id):
+    """Заполняет одну порцию незаполненных строк; возвращает последний id или None, если строк не осталось"""
+    rows = bind.execute(
+        sa.select(urls.c.id, urls.c.original_url)
+        .where(urls.c.id > last_id, urls.c[column].is_(None))
+        .order_by(urls.c.id)
+        .limit(BATCH_SIZE)
+    ).fetchall()
+    if not rows:
+        return None
+    bind.execute(
+        urls.update().where(urls.c.id == sa.bindparam('row_id')).values({column: sa.bindparam('value')}),
+        [{'row_id': row.id, 'value': hash_func(row.original_url)} for row in rows],
+    )
+    return rows[-1].id
+
+
+def _backfill(column, column_type, hash_func):
+    """Заполняет колонку хешами порциями по id.
+
+    Основной проход идёт вне транзакции миграции: каждая порция фиксируется
+    своей короткой транзакцией, и приложение может писать между порциями.
+    Заполняются только пустые строки, поэтому прерванную миграцию можно
+    просто запустить заново. Строки, вставленные приложением за время прохода,
+    добираются уже в транзакции миграции — вместе с последующей сменой схемы.
+    """
+    urls = sa.table(
+        'urls',
+        sa.column('id', sa.Integer),
+        sa.column('original_url', sa.String),
+        sa.column(column, column_type),
+    )
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last_id = 0
+        while last_id is not None:
+            bind.exec_driver_sql('BEGIN')
+            try:
+                last_id = _backfill_batch(bind, urls, column, hash_func, last_id)
+            except BaseException:
+                bind.exec_driver_sql('ROLLBACK')
+                raise
+            bind.exec_driver_sql('COMMIT')
+
+    bind = op.get_bind()
+    last_id = 0
+    while last_id is not None:
+        last_id = _backfill_batch(bind, urls, column, hash_func, last_id)
+
+
+def _existing_columns():
+    return {column['name']: column for column in sa.inspect(op.get_bind()).get_columns('urls')}
+
+
+def _existing_indexes():
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('urls')}
+
+
+def upgrade():
+    # Колонка остаётся от прерванного запуска: заполнение продолжается с пустых строк
+    if 'url_hash_sha256' not in _existing_columns():
+        with op.batch_alter_table('urls') as batch_op:
+            batch_op.add_column(sa.Column('url_hash_sha256', sa.LargeBinary(length=32), nullable=True))
+
+    _backfill('url_hash_sha256', sa.LargeBinary, _sha256)
+
+    indexes = _existing_indexes()
+    with op.batch_alter_table('urls') as batch_op:
+        # Индекс по полному URL больше не нужен: дубликаты ищутся по компактному хешу.
+        # Индексы создает 001_initial; в базах, созданных старыми версиями приложения
+        # через Base.metadata.create_all, их нет
+        if 'ix_urls_original_url' in indexes:
+            batch_op.drop_index('ix_urls_original_url')
+        if 'ix_urls_url_hash' in indexes:
+            batch_op.drop_index('ix_urls_url_hash')
+        batch_op.drop_column('url_hash')
+
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.alter_column(
+            'url_hash_sha256',
+            new_column_name='url_hash',
+            existing_type=sa.LargeBinary(length=32),
+            nullable=False,
+        )
+
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.create_unique_constraint('uq_urls_url_hash', ['url_hash'])
+
+
+def downgrade():
+    if 'url_hash_legacy' not in _existing_columns():
+        with op.batch_alter_table('urls') as batch_op:
+            batch_op.add_column(sa.Column('url_hash_legacy', sa.String(length=64), nullable=True))
+
+    _backfill('url_hash_legacy', sa.String, _legacy_hash)
+
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.drop_constraint('uq_urls_url_hash', type_='unique')
+        batch_op.drop_column('url_hash')
+
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.alter_column(
+            'url_hash_legacy',
+            new_column_name='url_hash',
+            existing_type=sa.String(length=64),
+            nullable=False,
+        )
+
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.create_unique_constraint('uq_urls_url_hash', ['url_hash'])
+        batch_op.create_index('ix_urls_url_hash', ['url_hash'])
+        batch_op.create_index('ix_urls_original_url', ['original_url'])
@@ -0,0 +1,203 @@
+"""drop duplicate indexes, store created_at as timestamp
+
+Revision ID: a3c8e5f1b207
+Revises: f2b7c1d4e839
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+import os
+from datetime import datetime, timezone
+from functools import partial
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a3c8e5f1b207'
+down_revision = 'f2b7c1d4e839'
+branch_labels = None
+depends_on = None
+
+# Сколько строк пересчитываем за одну короткую транзакцию
+BATCH_SIZE = 1000
+
+# Индексы, которые дублируют первичный ключ или уникальные ограничения
+# (ix_*_id создавал Base.metadata.create_all старых версий приложения из-за index=True на первичном ключе)
+DUPLICATE_INDEXES = {
+    'urls': ['ix_urls_id', 'ix_urls_short_code', 'ix_urls_url_hash', 'ix_urls_original_url'],
+    'domains': ['ix_domains_id'],
+}
+
+# Колонки, заполненные у небольшой доли ссылок: индекс строится только по непустым значениям
+PARTIAL_INDEXES = {
+    'ix_urls_expires_at': 'expires_at',
+    'ix_urls_deactivated_at': 'deactivated_at',
+}
+
+# Таблицы с created_at, нужен ли индекс по нему и в какой зоне приложение писало время без зоны:
+# ссылки — datetime.now() (локальное время сервера), домены — datetime.utcnow()
+CREATED_AT_TABLES = {
+    'urls': ('ix_urls_created_at', 'local'),
+    'domains': (None, 'utc'),
+    'urls_archive': (None, 'local'),
+}
+
+# Зона сервера, который писал ссылки (например, Europe/Moscow или UTC). Обязательна, если в таблицах
+# с локальным временем есть строки: зона машины, на которой запущена миграция, не обязательно совпадает
+# с зоной сервера приложения (например, миграция запускается в контейнере с TZ=UTC)
+LEGACY_TZ = os.getenv('CREATED_AT_LEGACY_TZ', '')
+
+
+def _source_tz(zone):
+    if zone == 'utc':
+        return timezone.utc
+    return ZoneInfo(LEGACY_TZ)
+
+
+def _require_legacy_tz(tables):
+    """Останавливает миграцию до изменения схемы, если зона для локального времени не задана"""
+    if LEGACY_TZ:
+        ZoneInfo(LEGACY_TZ)
+        return
+    bind = op.get_bind()
+    for table_name in tables:
+        if bind.execute(sa.select(sa.literal(1)).select_from(sa.table(table_name)).limit(1)).first():
+            raise RuntimeError(
+                'CREATED_AT_LEGACY_TZ is not set: table %s stores created_at in the server local time. '
+                'Set it to the zone of the server that wrote the rows (e.g. Europe/Moscow or UTC)' % table_name
+            )
+
+
+def _to_timestamp(value, zone):
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=_source_tz(zone))
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _to_string(value, zone):
+    return value.replace(tzinfo=timezone.utc).astimezone(_source_tz(zone)).replace(tzinfo=None).isoformat()
+
+
+def _backfill_batch(bind, table, source, target, convert, last_id):
+    """Заполняет одну порцию незаполненных строк; возвращает последний id или None, если строк не осталось"""
+    rows = bind.execute(
+        sa.select(table.c.id, table.c[source])
+        .where(table.c.id > last_id, table.c[target].is_(None))
+        .order_by(table.c.id)
+        .limit(BATCH_SIZE)
+    ).fetchall()
+    if not rows:
+        return None
+    bind.execute(
+        table.update().where(table.c.id == sa.bindparam('row_id')).values({target: sa.bindparam('value')}),
+        [{'row_id': row[0], 'value': convert(row[1])} for row in rows],
+    )
+    return rows[-1][0]
+
+
+def _backfill(table_name, source, source_type, target, target_type, convert):
+    """Переносит created_at в новую колонку порциями по id.
+
+    Основной проход идёт вне транзакции миграции, каждая порция — отдельной
+    короткой транзакцией; заполняются только пустые строки, так что прерванную
+    миграцию можно запустить заново. Строки, добавленные за время прохода,
+    добираются в транзакции миграции вместе с заменой колонки.
+    """
+    table = sa.table(
+        table_name,
+        sa.column('id', sa.Integer),
+        sa.column(source, source_type),
+        sa.column(target, target_type),
+    )
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        last_id = 0
+        while last_id is not None:
+            bind.exec_driver_sql('BEGIN')
+            try:
+                last_id = _backfill_batch(bind, table, source, target, convert, last_id)
+            except BaseException:
+                bind.exec_driver_sql('ROLLBACK')
+                raise
+            bind.exec_driver_sql('COMMIT')
+
+    bind = op.get_bind()
+    last_id = 0
+    while last_id is not None:
+        last_id = _backfill_batch(bind, table, source, target, convert, last_id)
+
+
+def _convert_created_at(table_name, old_type, new_type, convert, index_name):
+    """Заменяет колонку created_at колонкой нового типа: добавить, заполнить, удалить старую, переименовать"""
+    inspector = sa.inspect(op.get_bind())
+    indexes = {index['name'] for index in inspector.get_indexes(table_name)}
+    # Колонка остаётся от прерванного запуска: заполнение продолжается с пустых строк
+    if 'created_at_new' not in {column['name'] for column in inspector.get_columns(table_name)}:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.add_column(sa.Column('created_at_new', new_type, nullable=True))
+
+    _backfill(table_name, 'created_at', old_type, 'created_at_new', new_type, convert)
+
+    with op.batch_alter_table(table_name) as batch_op:
+        if 'ix_%s_created_at' % table_name in indexes:
+            batch_op.drop_index('ix_%s_created_at' % table_name)
+        batch_op.drop_column('created_at')
+
+    with op.batch_alter_table(table_name) as batch_op:
+        batch_op.alter_column('created_at_new', new_column_name='created_at', existing_type=new_type, nullable=False)
+
+    if index_name:
+        op.create_index(index_name, table_name, ['created_at'])
+
+
+def _has_timestamp_created_at(inspector, table_name):
+    columns = {column['name']: column for column in inspector.get_columns(table_name)}
+    return isinstance(columns['created_at']['type'], sa.DateTime)
+
+
+def _create_partial_index(name, column):
+    condition = sa.column(column).isnot(None)
+    op.create_index(name, 'urls', [column], postgresql_where=condition, sqlite_where=condition)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    _require_legacy_tz([
+        table_name for table_name, (index_name, zone) in CREATED_AT_TABLES.items()
+        if zone == 'local' and not _has_timestamp_created_at(inspector, table_name)
+    ])
+
+    for table_name, index_names in DUPLICATE_INDEXES.items():
+        existing = {index['name'] for index in inspector.get_indexes(table_name)}
+        drop = [name for name in index_names if name in existing]
+        if drop:
+            with op.batch_alter_table(table_name) as batch_op:
+                for name in drop:
+                    batch_op.drop_index(name)
+
+    for name, column in PARTIAL_INDEXES.items():
+        op.drop_index(name, 'urls')
+        _create_partial_index(name, column)
+
+    for table_name, (index_name, zone) in CREATED_AT_TABLES.items():
+        # Таблицу уже перевел прерванный запуск: ее замена колонки зафиксирована
+        # вместе с началом заполнения следующей таблицы
+        if _has_timestamp_created_at(inspector, table_name):
+            continue
+        _convert_created_at(table_name, sa.String(length=30), sa.DateTime(), partial(_to_timestamp, zone=zone),
+                            index_name)
+
+
+def downgrade():
+    _require_legacy_tz([table_name for table_name, (index_name, zone) in CREATED_AT_TABLES.items() if zone == 'local'])
+    for table_name, (index_name, zone) in CREATED_AT_TABLES.items():
+        _convert_created_at(table_name, sa.DateTime(), sa.String(length=30), partial(_to_string, zone=zone), None)
+
+    for name, column in PARTIAL_INDEXES.items():
+        op.drop_index(name, 'urls')
+        op.create_index(name, 'urls', [column])
+
+    # Возвращаем только индекс из 001_initial; ix_*_id создавался не миграциями
+    op.create_index('ix_urls_short_code', 'urls', ['short_code'])
@@ -0,0 +1,30 @@
+"""per-link and per-domain redirect status
+
+Revision ID: c4e1f7a2d915
+Revises: a3c8e5f1b207
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c4e1f7a2d915'
+down_revision = 'a3c8e5f1b207'
+branch_labels = None
+depends_on = None
+
+# NULL — код редиректа по умолчанию (REDIRECT_DEFAULT_STATUS)
+TABLES = ('urls', 'domains', 'urls_archive')
+
+
+def upgrade():
+    for table_name in TABLES:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.add_column(sa.Column('redirect_status', sa.SmallInteger(), nullable=True))
+
+
+def downgrade():
+    for table_name in TABLES:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('redirect_status')
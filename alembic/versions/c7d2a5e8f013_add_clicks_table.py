@@ -0,0 +1,31 @@
+"""add clicks table
+
+Revision ID: c7d2a5e8f013
+Revises: 9b4e2d7c5a18
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c7d2a5e8f013'
+down_revision = '9b4e2d7c5a18'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Агрегированные счетчики переходов по временным интервалам
+    op.create_table(
+        'clicks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(10), nullable=False),
+        sa.Column('key', sa.String(255), nullable=False),
+        sa.Column('bucket_start', sa.BigInteger(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('kind', 'key', 'bucket_start', name='uq_clicks_kind_key_bucket')
+    )
+
+def downgrade():
+    op.drop_table('clicks')
@@ -0,0 +1,44 @@
+"""link health status for urls and domains
+
+Revision ID: d5f2a8c3e146
+Revises: c4e1f7a2d915
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd5f2a8c3e146'
+down_revision = 'c4e1f7a2d915'
+branch_labels = None
+depends_on = None
+
+# HTTP-статус последней проверки (0 — нет ответа) и время проверки; NULL — не проверялась.
+# health_claimed_until — аренда проверки процессом, который забрал строку
+TABLES = ('urls', 'domains')
+
+
+def _broken():
+    health_status = sa.column('health_status')
+    return (health_status == 0) | (health_status >= 400)
+
+
+def upgrade():
+    for table_name in TABLES:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.add_column(sa.Column('health_status', sa.SmallInteger(), nullable=True))
+            batch_op.add_column(sa.Column('health_checked_at', sa.DateTime(), nullable=True))
+            batch_op.add_column(sa.Column('health_claimed_until', sa.DateTime(), nullable=True))
+
+    # Нерабочих ссылок мало — частичный индекс для отчета GET /links/broken
+    op.create_index('ix_urls_health_broken', 'urls', ['id'], postgresql_where=_broken(), sqlite_where=_broken())
+
+
+def downgrade():
+    op.drop_index('ix_urls_health_broken', 'urls')
+    for table_name in TABLES:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_column('health_claimed_until')
+            batch_op.drop_column('health_checked_at')
+            batch_op.drop_column('health_status')
@@ -0,0 +1,31 @@
+"""add cache_invalidations table
+
+Revision ID: e1a4b6c9d027
+Revises: c7d2a5e8f013
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e1a4b6c9d027'
+down_revision = 'c7d2a5e8f013'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Журнал изменений для сброса кэшей во всех воркерах
+    op.create_table(
+        'cache_invalidations',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(10), nullable=False),
+        sa.Column('key', sa.String(255), nullable=False),
+        sa.Column('created_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_cache_invalidations_created_at', 'cache_invalidations', ['created_at'])
+
+def downgrade():
+    op.drop_index('ix_cache_invalidations_created_at', 'cache_invalidations')
+    op.drop_table('cache_invalidations')
@@ -0,0 +1,61 @@
+"""link expiry and urls_archive table
+
+Revision ID: f2b7c1d4e839
+Revises: e1a4b6c9d027
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7c1d4e839'
+down_revision = 'e1a4b6c9d027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('deactivated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_urls_expires_at', ['expires_at'])
+        batch_op.create_index('ix_urls_deactivated_at', ['deactivated_at'])
+
+    # Для уже отключенных ссылок время отключения неизвестно — отсчитываем срок архивации с момента миграции
+    urls = sa.table('urls', sa.column('is_active', sa.Boolean), sa.column('deactivated_at', sa.DateTime))
+    op.execute(
+        urls.update()
+        .where(urls.c.is_active == sa.false())
+        .values(deactivated_at=sa.func.current_timestamp())
+    )
+
+    # Ссылки, перенесенные из urls фоновой очисткой
+    op.create_table(
+        'urls_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('url_id', sa.Integer(), nullable=False),
+        sa.Column('original_url', sa.String(length=2048), nullable=False),
+        sa.Column('url_hash', sa.LargeBinary(length=32), nullable=False),
+        sa.Column('short_code', sa.String(length=6), nullable=False),
+        sa.Column('created_at', sa.String(length=30), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('deactivated_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.Column('reason', sa.String(length=10), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_urls_archive_short_code', 'urls_archive', ['short_code'])
+    op.create_index('ix_urls_archive_archived_at', 'urls_archive', ['archived_at'])
+
+
+def downgrade():
+    op.drop_index('ix_urls_archive_archived_at', 'urls_archive')
+    op.drop_index('ix_urls_archive_short_code', 'urls_archive')
+    op.drop_table('urls_archive')
+    with op.batch_alter_table('urls') as batch_op:
+        batch_op.drop_index('ix_urls_deactivated_at')
+        batch_op.drop_index('ix_urls_expires_at')
+        batch_op.drop_column('deactivated_at')
+        batch_op.drop_column('expires_at')
@@ -1,40 +1,92 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, Request
+from fastapi import FastAPI, HTTPException, Depends, Security, Request, Query
 from fastapi.security import APIKeyHeader
-from fastapi.responses import RedirectResponse, JSONResponse
-from pydantic import BaseModel, HttpUrl
-from sqlalchemy import create_engine, Column, String, Integer, Boolean, event
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, HttpUrl, ValidationError, field_validator
+from sqlalchemy import create_engine, Column, String, Integer, BigInteger, SmallInteger, Boolean, Float, DateTime, LargeBinary, Index, UniqueConstraint, event, select, insert, update, delete, func, literal, case, bindparam, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 import string
 import random
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 import secrets
 import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from dotenv import load_dotenv
 import hashlib
-import requests
-from requests.exceptions import RequestException
+import ipaddress
+import json
+import math
+import re
+import csv
+import mmap
+import struct
+import zlib
+import fcntl
+import shutil
+import tempfile
+import asyncio
+import httpx
+from urllib.parse import urlsplit
 import logging
-from typing import List, Optional
-from sqlalchemy.pool import Pool
-from sqlalchemy.exc import IntegrityError
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Literal, Optional, Tuple, Union
+from functools import lru_cache
+from abc import ABC, abstractmethod
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from bisect import bisect_left
+from sqlalchemy.exc import IntegrityError, DatabaseError, DBAPIError, TimeoutError as PoolTimeoutError
 
 # Загружаем переменные окружения
 load_dotenv()
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Доля запросов, для которых middleware пишет лог начала и завершения
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Слушатели пула соединений — отладочная инструментация, по умолчанию выключены
+DB_POOL_DEBUG = os.getenv("DB_POOL_DEBUG", "false").lower() in ("1", "true", "yes")
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь без форматирования: сообщение собирается
+    и выводится в потоке QueueListener, а не в потоке обработки запроса.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+log_queue = queue.SimpleQueue()
+_log_output = logging.StreamHandler()
+_log_output.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+log_listener = QueueListener(log_queue, _log_output, respect_handler_level=True)
+logging.basicConfig(level=LOG_LEVEL, handlers=[DeferredQueueHandler(log_queue)])
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 
+def log_sampled() -> bool:
+    """Нужно ли логировать текущий запрос с учетом LOG_SAMPLE_RATE"""
+    return LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE and logger.isEnabledFor(logging.INFO)
+
+
 # Мониторинг соединений с базой данных
 def on_checkout(dbapi_conn, connection_record, connection_proxy):
-    logger.info("Database connection checked out.")
+    logger.debug("Database connection checked out.")
 
 
-@event.listens_for(Pool, "checkin")
 def on_checkin(dbapi_conn, connection_record):
-    logger.info("Database connection checked in.")
+    logger.debug("Database connection checked in.")
 
 
 # Настройки безопасности
@@ -52,8 +104,174 @@ if not API_KEY:
 if not CREATE_ONLY_API_KEY:
     logger.warning("CREATE_ONLY_API_KEY not set in environment variables. Create-only API access will be disabled.")
 
-# База данных
-SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/shortener.db")
+class Counter:
+    """Счетчик в формате Prometheus с метками"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _labels(self, labels: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{self._labels(labels)} {value}" for labels, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """Значение, вычисляемое в момент сбора метрик"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), callback=None,
+                 type_name: Optional[str] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        if type_name is not None:
+            # Для уже накопленных где-то счетчиков (кэш, аллокатор) тип — counter
+            self.type_name = type_name
+
+    def collect(self) -> List[str]:
+        if self.callback is not None:
+            self._values = {labels: value for labels, value in self.callback()}
+        return super().collect()
+
+
+class Histogram(Counter):
+    """Гистограмма в формате Prometheus: счетчики по корзинам, сумма и количество"""
+
+    type_name = "histogram"
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = {labels: (list(state[0]), state[1]) for labels, state in self._values.items()}
+        lines = []
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self._labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(labels)} {total}")
+            lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+http_requests_total = metrics.register(Counter(
+    "shortener_http_requests_total", "HTTP requests by route group and status", ("route", "method", "status")))
+http_request_duration = metrics.register(Histogram(
+    "shortener_http_request_duration_seconds", "HTTP request latency by route group", ("route",)))
+db_query_duration = metrics.register(Histogram(
+    "shortener_db_query_duration_seconds", "Database statement execution time", ("engine",)))
+db_pool_checkout_duration = metrics.register(Histogram(
+    "shortener_db_pool_checkout_seconds", "Time a pooled connection stays checked out", ("engine",)))
+
+
+def instrument_engine(sync_engine, label: str) -> None:
+    """Измеряет время выполнения запросов к БД и время, на которое соединения берутся из пула"""
+
+    @event.listens_for(sync_engine, "checkout")
+    def checkout(dbapi_conn, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "checkin")
+    def checkin(dbapi_conn, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            db_pool_checkout_duration.observe(time.perf_counter() - checked_out_at, label)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_query_duration.observe(time.perf_counter() - conn.info["query_started"].pop(), label)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+# Синхронные и асинхронные драйверы для поддерживаемых СУБД
+SYNC_DRIVERS = {"postgresql": "postgresql+psycopg2", "sqlite": "sqlite"}
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def _with_driver(url: str, drivers: dict) -> str:
+    """Подменяет драйвер в URL базы данных, сохраняя остальные параметры"""
+    parsed = make_url(url)
+    drivername = drivers.get(parsed.get_backend_name())
+    if drivername is None:
+        return url
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def get_sync_database_url(url: str) -> str:
+    """URL для синхронного движка (миграции и управляющие эндпоинты)"""
+    return _with_driver(url, SYNC_DRIVERS)
+
+
+def get_async_database_url(url: str) -> str:
+    """URL для асинхронного движка (горячие обработчики чтения)"""
+    return _with_driver(url, ASYNC_DRIVERS)
+
+
+# База данных. DATABASE_URL может указывать как синхронный (psycopg2, pysqlite),
+# так и асинхронный (asyncpg, aiosqlite) драйвер — второй движок получается заменой драйвера
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/shortener.db")
+SQLALCHEMY_DATABASE_URL = get_sync_database_url(DATABASE_URL)
+ASYNC_SQLALCHEMY_DATABASE_URL = get_async_database_url(DATABASE_URL)
+
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     pool_size=20,  # увеличиваем размер пула
@@ -62,11 +280,176 @@ engine = create_engine(
     pool_recycle=3600,  # переиспользуем соединения каждый час
 )
 
-# Добавляем слушатели событий пула соединений
-event.listen(engine.pool, 'checkout', on_checkout)
-event.listen(engine.pool, 'checkin', on_checkin)
+# Добавляем слушатели событий пула соединений только в отладочном режиме
+if DB_POOL_DEBUG:
+    event.listen(engine.pool, 'checkout', on_checkout)
+    event.listen(engine.pool, 'checkin', on_checkin)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Асинхронный движок для обработчиков редиректов: запросы к БД не блокируют event loop.
+# aiosqlite по умолчанию использует NullPool, поэтому пул задаем явно
+async_engine = create_async_engine(
+    ASYNC_SQLALCHEMY_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=30,
+    pool_timeout=60,
+    pool_recycle=3600,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+
+# Профиль SQLite: применяется к каждому новому соединению обоих движков
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+
+
+def set_sqlite_pragmas(dbapi_conn, connection_record):
+    # В режиме WAL читатели не блокируют фиксацию записи. Без него синхронная запись
+    # в обработчике ждет блокировку, пока чтение aiosqlite ждет освобождения event loop.
+    # synchronous=NORMAL в WAL не теряет целостность, лишь последние транзакции при сбое ОС
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    # Отрицательное значение — размер кэша страниц в килобайтах
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+
+db_reads_total = metrics.register(Counter(
+    "shortener_db_reads_total", "Read queries by target database", ("target",)))
+
+
+class ReadReplicas:
+    """
+    Асинхронные движки реплик для чтения на горячем пути (редиректы, список доменов).
+    Реплики выбираются по кругу; при ошибке соединения или таймауте реплика исключается на
+    retry_interval секунд, а запрос повторяется на основной БД. Ключи, измененные или
+    созданные недавно (за max_lag секунд), читаются с основной БД, чтобы не получить
+    устаревшее значение из отстающей реплики.
+    """
+
+    def __init__(self, urls: List[str], retry_interval: float, max_lag: float):
+        self.retry_interval = retry_interval
+        self.max_lag = max_lag
+        self.replicas = []
+        for index, url in enumerate(urls):
+            replica_engine = create_async_engine(
+                get_async_database_url(url),
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=20,
+                max_overflow=30,
+                pool_timeout=60,
+                pool_recycle=3600,
+            )
+            label = f"replica-{index}"
+            instrument_engine(replica_engine.sync_engine, label)
+            if replica_engine.dialect.name == "sqlite":
+                event.listen(replica_engine.sync_engine, "connect", set_sqlite_pragmas)
+            self.replicas.append({
+                "label": label,
+                "engine": replica_engine,
+                "sessionmaker": async_sessionmaker(replica_engine, expire_on_commit=False, autoflush=False),
+                "down_until": 0.0,
+            })
+        self._next = 0
+        self._pins: dict = {}
+        self.failovers = 0
+
+    def pin(self, kind: str, *keys: Optional[str]) -> None:
+        """Отправляет чтение этих ключей (и списка kind целиком) на основную БД на max_lag секунд"""
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        until = now + self.max_lag
+        pins = {key: expires for key, expires in self._pins.items() if expires > now}
+        pins[(kind, None)] = until
+        for key in keys:
+            if key is not None:
+                pins[(kind, key)] = until
+        self._pins = pins
+
+    def pinned(self, kind: str, key: Optional[str] = None) -> bool:
+        return self._pins.get((kind, key), 0.0) > time.monotonic()
+
+    def _pick(self) -> Optional[dict]:
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica["down_until"] <= now:
+                return replica
+        return None
+
+    async def run(self, fn, *args, kind: str, key: Optional[str] = None, primary_on_none: bool = False):
+        """
+        Выполняет чтение fn(session, *args) на реплике, а при ее недоступности или
+        недавней записи ключа — на основной БД. С primary_on_none пустой результат
+        перепроверяется на основной БД, только если записи kind были в последние max_lag секунд:
+        иначе каждый несуществующий ключ читался бы дважды
+        """
+        replica = None if self.pinned(kind, key) else self._pick()
+        if replica is not None:
+            try:
+                async with replica["sessionmaker"]() as db:
+                    result = await fn(db, *args)
+                db_reads_total.inc(replica["label"])
+                if result is not None or not primary_on_none or not self.pinned(kind):
+                    return result
+            except (DBAPIError, OSError, PoolTimeoutError, asyncio.TimeoutError) as e:
+                replica["down_until"] = time.monotonic() + self.retry_interval
+                self.failovers += 1
+                logger.warning("Реплика %s недоступна, чтение переключено на основную БД: %s", replica["label"], e)
+
+        async with AsyncSessionLocal() as db:
+            result = await fn(db, *args)
+        db_reads_total.inc("primary")
+        return result
+
+    def healthy(self):
+        now = time.monotonic()
+        for replica in self.replicas:
+            yield (replica["label"],), 1 if replica["down_until"] <= now else 0
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica["engine"].dispose()
+
+
+# DATABASE_READ_URL — одна или несколько реплик через запятую; без нее все читается с основной БД
+read_replicas = ReadReplicas(
+    urls=[url.strip() for url in os.getenv("DATABASE_READ_URL", "").split(",") if url.strip()],
+    retry_interval=float(os.getenv("DATABASE_READ_RETRY_INTERVAL", "30")),
+    max_lag=float(os.getenv("DATABASE_READ_MAX_LAG", "5")),
+)
+metrics.register(Gauge(
+    "shortener_db_replica_up", "Whether a read replica is currently used", ("replica",),
+    callback=read_replicas.healthy))
+
+
+def _pool_stats():
+    pools = [("sync", engine.pool), ("async", async_engine.pool)]
+    pools += [(replica["label"], replica["engine"].pool) for replica in read_replicas.replicas]
+    for label, pool in pools:
+        yield (label, "size"), pool.size()
+        yield (label, "checked_out"), pool.checkedout()
+        yield (label, "overflow"), max(pool.overflow(), 0)
+
+
+metrics.register(Gauge(
+    "shortener_db_pool_connections", "Connection pool state", ("engine", "state"), callback=_pool_stats))
 Base = declarative_base()
 
 
@@ -74,47 +457,206 @@ Base = declarative_base()
 class URL(Base):
     __tablename__ = "urls"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Первичный ключ и уникальные ограничения уже индексированы — отдельные индексы не нужны
+    id = Column(Integer, primary_key=True)
     original_url = Column(String(2048), nullable=False)
-    url_hash = Column(String(10), nullable=False, unique=True)
+    # Полный SHA-256 от original_url в бинарном виде (32 байта)
+    url_hash = Column(LargeBinary(32), nullable=False, unique=True)
     short_code = Column(String(6), nullable=False, unique=True)
-    created_at = Column(String(30), nullable=False)
+    # Время в UTC; индекс нужен для выборок по диапазону в GET /urls и экспорте
+    created_at = Column(DateTime, nullable=False, index=True)
     is_active = Column(Boolean, nullable=False, default=True)
+    # Время в UTC: после expires_at ссылка не работает, а после deactivated_at + срок хранения
+    # неактивная ссылка переносится в архив
+    expires_at = Column(DateTime, nullable=True)
+    deactivated_at = Column(DateTime, nullable=True)
+    # HTTP-код редиректа (301/302/307/308); NULL — REDIRECT_DEFAULT_STATUS
+    redirect_status = Column(SmallInteger, nullable=True)
+    # Результат фоновой проверки целевого URL: HTTP-статус (0 — нет ответа) и время проверки в UTC;
+    # NULL — ссылка еще не проверялась
+    health_status = Column(SmallInteger, nullable=True)
+    health_checked_at = Column(DateTime, nullable=True)
+    # До какого времени (UTC) ссылку проверяет забравший ее процесс; после — ее может забрать другой
+    health_claimed_until = Column(DateTime, nullable=True)
+
+    # У большинства ссылок эти колонки пустые, а нерабочих ссылок мало — индексируем только нужные строки
+    __table_args__ = (
+        Index("ix_urls_expires_at", expires_at,
+              postgresql_where=expires_at.isnot(None), sqlite_where=expires_at.isnot(None)),
+        Index("ix_urls_deactivated_at", deactivated_at,
+              postgresql_where=deactivated_at.isnot(None), sqlite_where=deactivated_at.isnot(None)),
+        Index("ix_urls_health_broken", id,
+              postgresql_where=(health_status == 0) | (health_status >= 400),
+              sqlite_where=(health_status == 0) | (health_status >= 400)),
+    )
+
+
+class URLArchive(Base):
+    """Ссылки, перенесенные из urls фоновой очисткой (истекшие и давно неактивные)"""
+    __tablename__ = "urls_archive"
+
+    id = Column(Integer, primary_key=True)
+    url_id = Column(Integer, nullable=False)
+    original_url = Column(String(2048), nullable=False)
+    url_hash = Column(LargeBinary(32), nullable=False)
+    short_code = Column(String(6), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    is_active = Column(Boolean, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    deactivated_at = Column(DateTime, nullable=True)
+    redirect_status = Column(SmallInteger, nullable=True)
+    archived_at = Column(DateTime, nullable=False, index=True)
+    reason = Column(String(10), nullable=False)
 
 
 class Domain(Base):
     __tablename__ = "domains"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     domain = Column(String(255), nullable=False, unique=True)
     redirect_url = Column(String(2048), nullable=False)
-    created_at = Column(String(30), nullable=False)
+    created_at = Column(DateTime, nullable=False)
     is_active = Column(Boolean, nullable=False, default=True)
+    # HTTP-код редиректа с корня домена; NULL — REDIRECT_DEFAULT_STATUS
+    redirect_status = Column(SmallInteger, nullable=True)
+    # Результат фоновой проверки redirect_url, как у URL
+    health_status = Column(SmallInteger, nullable=True)
+    health_checked_at = Column(DateTime, nullable=True)
+    health_claimed_until = Column(DateTime, nullable=True)
+
+
+class CodeSequence(Base):
+    __tablename__ = "code_sequences"
+
+    name = Column(String(32), primary_key=True)
+    next_value = Column(BigInteger, nullable=False, default=0)
+
+
+class Click(Base):
+    __tablename__ = "clicks"
+    __table_args__ = (
+        UniqueConstraint("kind", "key", "bucket_start", name="uq_clicks_kind_key_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # "url" — переход по короткому коду, "domain" — редирект с корня домена,
+    # "archived" — переходы ссылки, перенесенной в urls_archive (key — ее url_id)
+    kind = Column(String(10), nullable=False)
+    key = Column(String(255), nullable=False)
+    # Начало временного интервала (unix time, секунды)
+    bucket_start = Column(BigInteger, nullable=False)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+class CacheInvalidation(Base):
+    """Журнал изменений ссылок и доменов для сброса кэшей во всех процессах"""
+    __tablename__ = "cache_invalidations"
+
+    id = Column(Integer, primary_key=True)
+    # "url" — short_code, "domain" — имя домена
+    kind = Column(String(10), nullable=False)
+    key = Column(String(255), nullable=False)
+    # unix time записи; по нему воркеры читают журнал и чистят старые записи
+    created_at = Column(Float, nullable=False, index=True)
 
 
-Base.metadata.create_all(bind=engine)
+def create_tables() -> None:
+    """
+    Создает таблицы по моделям в базе без миграций (локальный запуск, тесты). Схему базы,
+    которой управляет alembic (есть таблица alembic_version), меняют только миграции
+    """
+    if inspect(engine).has_table("alembic_version"):
+        return
+    # Несколько воркеров на пустой базе выполняют create_all одновременно:
+    # проигравший получает ошибку "таблица уже существует" и просто повторяет проверку
+    for attempt in range(3):
+        try:
+            Base.metadata.create_all(bind=engine)
+            return
+        except DatabaseError:
+            if attempt == 2:
+                raise
+            time.sleep(0.5)
 
 
 # Pydantic модели
+# Форма кодов, которые выдает сервис: буквы, цифры, "-" и "_", не длиннее колонки short_code.
+# Пользовательские коды по ней не проверяются; фильтр коротких кодов отсекает строки
+# другой формы, кроме тех, что есть в БД
+SHORT_CODE_MAX_LENGTH = 6
+SHORT_CODE_PATTERN = rf"^[A-Za-z0-9_-]{{1,{SHORT_CODE_MAX_LENGTH}}}$"
+SHORT_CODE_RE = re.compile(SHORT_CODE_PATTERN)
+
+# Постоянные редиректы (301/308) браузеры и CDN кэшируют, временные (302/307) — только с явным max-age;
+# 307/308 в отличие от 301/302 сохраняют метод запроса
+RedirectStatus = Literal[301, 302, 307, 308]
+PERMANENT_REDIRECT_STATUSES = (301, 308)
+
+
 class URLBase(BaseModel):
     target_url: HttpUrl
 
 
+def require_future_expiry(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and to_utc(value) <= utc_now():
+        raise ValueError("expires_at must be in the future")
+    return value
+
+
 class URLCreate(URLBase):
     custom_code: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    redirect_status: Optional[RedirectStatus] = None
+
+    @field_validator("expires_at")
+    @classmethod
+    def expires_in_future(cls, value: Optional[datetime]) -> Optional[datetime]:
+        return require_future_expiry(value)
+
+
+class URLImportRecord(URLCreate):
+    created_at: Optional[datetime] = None
+    is_active: bool = True
+
+    @field_validator("expires_at")
+    @classmethod
+    def expires_in_future(cls, value: Optional[datetime]) -> Optional[datetime]:
+        # Импорт переносит и уже истекшие ссылки: их уберет в архив фоновая очистка
+        return value
 
 
 class URLUpdate(BaseModel):
     target_url: Optional[HttpUrl] = None
     is_active: Optional[bool] = None
     short_code: Optional[str] = None
+    # Явный null снимает срок действия, а для redirect_status — возвращает код по умолчанию
+    expires_at: Optional[datetime] = None
+    redirect_status: Optional[RedirectStatus] = None
+
+    @field_validator("expires_at")
+    @classmethod
+    def expires_in_future(cls, value: Optional[datetime]) -> Optional[datetime]:
+        return require_future_expiry(value)
 
 
 class URLResponse(BaseModel):
     target_url: HttpUrl
     short_code: str
-    created_at: str
+    created_at: datetime
     is_active: bool
+    expires_at: Optional[datetime] = None
+    redirect_status: Optional[int] = None
+
+
+class URLBatchResult(BaseModel):
+    index: int
+    target_url: str
+    short_code: Optional[str] = None
+    created_at: Optional[datetime] = None
+    is_active: Optional[bool] = None
+    expires_at: Optional[datetime] = None
+    redirect_status: Optional[int] = None
+    error: Optional[str] = None
 
 
 class DomainBase(BaseModel):
@@ -123,18 +665,64 @@ class DomainBase(BaseModel):
 
 
 class DomainCreate(DomainBase):
-    pass
+    redirect_status: Optional[RedirectStatus] = None
 
 
 class DomainUpdate(BaseModel):
     redirect_url: Optional[HttpUrl] = None
     is_active: Optional[bool] = None
+    # Явный null возвращает код по умолчанию
+    redirect_status: Optional[RedirectStatus] = None
 
 
 class DomainResponse(DomainBase):
     id: int
-    created_at: str
+    created_at: datetime
+    is_active: bool
+    redirect_status: Optional[int] = None
+
+
+class URLListItem(BaseModel):
+    id: int
+    target_url: str
+    short_code: str
+    created_at: datetime
     is_active: bool
+    expires_at: Optional[datetime] = None
+    redirect_status: Optional[int] = None
+
+
+class URLListResponse(BaseModel):
+    items: List[URLListItem]
+    # Передается как after_id для следующей страницы; None — страниц больше нет
+    next_after_id: Optional[int] = None
+
+
+class BrokenLinkItem(BaseModel):
+    id: int
+    # Короткий код ссылки или домен
+    key: str
+    target_url: str
+    # HTTP-статус последней проверки; 0 — ответа нет
+    health_status: int
+    health_checked_at: datetime
+
+
+class BrokenLinkListResponse(BaseModel):
+    items: List[BrokenLinkItem]
+    # Передается как after_id для следующей страницы; None — страниц больше нет
+    next_after_id: Optional[int] = None
+
+
+class ClickBucket(BaseModel):
+    bucket_start: str
+    count: int
+
+
+class URLStatsResponse(BaseModel):
+    short_code: str
+    total_clicks: int
+    buckets: List[ClickBucket]
 
 
 def get_db():
@@ -145,6 +733,197 @@ def get_db():
         db.close()
 
 
+class SQLiteWriter:
+    """
+    Единственный писатель для SQLite. Обработчики изменений ставят задания в очередь,
+    а поток writer выполняет накопившиеся задания на своем соединении в одной транзакции
+    (BEGIN IMMEDIATE ... COMMIT), каждое — в собственном SAVEPOINT. Так запись не борется
+    за блокировку файла, а одна фиксация на диск приходится на целую группу изменений.
+    Вызовы db.commit()/db.rollback() внутри задания работают с его SAVEPOINT.
+    """
+
+    def __init__(self, max_batch: int, max_delay: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.jobs = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            # Задания, поставленные фоновыми задачами уже после остановки, не должны зависать
+            while not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job is not None:
+                    job[0].set_exception(RuntimeError("SQLite writer is stopped"))
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        if self._thread is None:
+            future.set_exception(RuntimeError("SQLite writer is stopped"))
+            return future
+        self._queue.put((future, fn, args))
+        return future
+
+    def _collect(self, first) -> Tuple[list, bool]:
+        """Добирает задания из очереди для групповой фиксации"""
+        jobs = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(jobs) < self.max_batch:
+            try:
+                job = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if job is None:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+
+    def _loop(self) -> None:
+        conn = engine.connect()
+        # Транзакциями управляем сами: иначе pysqlite мешает SAVEPOINT
+        conn.connection.dbapi_connection.isolation_level = None
+        try:
+            stopping = False
+            while not stopping:
+                job = self._queue.get()
+                if job is None:
+                    break
+                jobs, stopping = self._collect(job)
+                self._run_batch(conn, jobs)
+        finally:
+            conn.connection.dbapi_connection.isolation_level = ""
+            conn.close()
+
+    def _run_batch(self, conn, jobs: list) -> None:
+        results = []
+        try:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            for future, fn, args in jobs:
+                session = Session(
+                    bind=conn, join_transaction_mode="create_savepoint", autoflush=False, info={"writer": True})
+                try:
+                    results.append((future, fn(session, *args), None))
+                except BaseException as e:
+                    session.rollback()
+                    results.append((future, None, e))
+                finally:
+                    session.close()
+                # Блок кодов, зарезервированный заданием, не должен откатиться вместе с его SAVEPOINT
+                code_allocator.persist(conn)
+            conn.commit()
+        except Exception as e:
+            logger.error("Ошибка групповой фиксации SQLite: %s", e)
+            conn.rollback()
+            # Номера кодов, выданные в откатанной транзакции, не записаны в счетчик
+            code_allocator.reset()
+            for future, fn, args in jobs:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.jobs += len(jobs)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+db_writer: Optional[SQLiteWriter] = None
+if engine.dialect.name == "sqlite" and os.getenv("SQLITE_WRITER", "true").lower() in ("1", "true", "yes"):
+    db_writer = SQLiteWriter(
+        max_batch=int(os.getenv("SQLITE_WRITER_MAX_BATCH", "256")),
+        max_delay=float(os.getenv("SQLITE_WRITER_MAX_DELAY", "0.002")),
+    )
+
+
+async def run_write(db: Session, fn, *args, offload: bool = False):
+    """
+    Выполняет изменяющее задание fn(session, *args): через SQLite writer, если он запущен,
+    иначе на сессии запроса. offload=True для долгих заданий (пакеты, импорт): без writer
+    они выполняются в отдельном потоке, чтобы не останавливать event loop
+    """
+    if db_writer is not None and db_writer.running:
+        return await asyncio.wrap_future(db_writer.submit(fn, *args))
+    if offload:
+        return await asyncio.to_thread(fn, db, *args)
+    return fn(db, *args)
+
+
+async def run_write_in_session(fn, *args):
+    """
+    run_write на собственной сессии: для заданий, результат которых делят несколько запросов
+    (SingleFlight), — сессия первого запроса закрывается вместе с ним и не должна достаться остальным
+    """
+    if db_writer is not None and db_writer.running:
+        return await run_write(None, fn, *args)
+    db = SessionLocal()
+    try:
+        return await run_write(db, fn, *args)
+    finally:
+        db.close()
+
+
+def run_write_sync(fn, *args):
+    """
+    Выполняет изменяющее задание fn(session, *args) из фонового потока (вне event loop):
+    через SQLite writer, если он запущен, иначе на собственной сессии
+    """
+    if db_writer is not None and db_writer.running:
+        return db_writer.submit(fn, *args).result()
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые вызовы внутри процесса: по ключу выполняется
+    один вызов, остальные ждут его результат (или исключение). Вызов идет отдельной
+    задачей, поэтому отмена первого запроса не обрывает его для остальных.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self.coalesced = 0
+
+    def _done(self, key, task: asyncio.Task) -> None:
+        self._calls.pop(key, None)
+        # Исключение забирают ожидающие; если их не осталось, asyncio не должен ругаться в лог
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, fn, *args):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._done(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def verify_api_key(api_key: str = Security(api_key_header), require_full_access: bool = False) -> bool:
     if not api_key:
         raise HTTPException(
@@ -179,108 +958,2076 @@ def create_random_code() -> str:
     return ''.join(random.choice(letters) for _ in range(code_length))
 
 
-def get_url_hash(url: str) -> str:
-    """Создает числовой хеш для URL длиной 10 символов"""
-    # Используем первые 10 цифр от MD5 хеша, преобразованного в число
-    full_hash = hashlib.md5(str(url).encode()).hexdigest()
-    # Преобразуем первые 8 символов хеша в число и берем последние 10 цифр
-    numeric_hash = str(int(full_hash[:8], 16))[-10:].zfill(10)
-    return numeric_hash
+CODE_ALPHABET = string.ascii_letters
+CODE_LENGTH = 6
+# Размер пространства кодов: 52^6 ≈ 19.7 млрд
+CODE_SPACE = len(CODE_ALPHABET) ** CODE_LENGTH
+# Половина кода (3 символа) — домен одной ветви сети Фейстеля
+CODE_HALF_SPACE = len(CODE_ALPHABET) ** (CODE_LENGTH // 2)
+
 
+def encode_code(value: int) -> str:
+    """Кодирует число из [0, CODE_SPACE) в строку из 6 английских букв"""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(CODE_ALPHABET))
+        chars.append(CODE_ALPHABET[digit])
+    return ''.join(reversed(chars))
 
-def verify_url(url: str) -> bool:
+
+def scramble_code_index(value: int, key: bytes, rounds: int = 4) -> int:
     """
-    Проверяет доступность URL
-    Возвращает True если URL доступен, False если нет
+    Биективно перемешивает номер кода внутри [0, CODE_SPACE).
+    Сбалансированная сеть Фейстеля по двум половинам из 52^3 значений:
+    соседние номера счетчика дают непохожие коды, а совпадений не бывает.
     """
-    logger.info(f"Проверка доступности URL: {url}")
-    try:
-        # Делаем HEAD запрос с таймаутом в 5 секунд
-        response = requests.head(url, timeout=5, allow_redirects=True)
-        status_code = response.status_code
-        logger.info(f"Ответ от URL {url}: статус {status_code}")
-        return status_code < 400
-    except RequestException as e:
-        logger.error(f"Ошибка при проверке URL {url}: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(f"Неожиданная ошибка при проверке URL {url}: {str(e)}")
-        # Возвращаем True, чтобы не блокировать создание короткой ссылки
-        # при неожиданных ошибках проверки
-        return True
+    left, right = divmod(value, CODE_HALF_SPACE)
+    for i in range(rounds):
+        digest = hashlib.blake2b(f"{i}:{right}".encode(), key=key, digest_size=8).digest()
+        left, right = right, (left + int.from_bytes(digest, "big")) % CODE_HALF_SPACE
+    return left * CODE_HALF_SPACE + right
 
 
-# Константа для разрешенного домена
-ALLOWED_DOCS_DOMAIN = "services.investingindigital.com"
+class CodeAllocator(ABC):
+    """Базовый класс выделения коротких кодов"""
 
-app = FastAPI(
-    title="URL Shortener API",
-    redoc_url=None,  # Отключаем ReDoc полностью
-    docs_url="/docs",  # Swagger UI будет доступен по /docs
-    openapi_url="/api/openapi.json",
-    root_path=os.getenv("ROOT_PATH", ""),
-)
+    def __init__(self):
+        self.retries = 0
 
+    def allocate(self, db: Session) -> str:
+        return self.allocate_many(db, 1)[0]
 
-# Middleware для проверки доступа к документации
-@app.middleware("http")
-async def check_docs_access(request: Request, call_next):
-    # Добавляем логирование состояния пула в начале запроса
-    logger.info(f"Request to {request.url.path}.")
-
-    if request.url.path in ["/docs", "/docs/oauth2-redirect", "/api/openapi.json"]:
-        host = request.headers.get('host', '').split(':')[0]
-        if host != ALLOWED_DOCS_DOMAIN:
-            return JSONResponse(
-                status_code=403,
-                content={"detail": "Access to API documentation is not allowed from this domain"}
-            )
-    response = await call_next(request)
+    @abstractmethod
+    def allocate_many(self, db: Session, count: int) -> List[str]:
+        """count свободных кодов, которых еще нет в таблице urls"""
 
-    # Логируем состояние пула после обработки запроса
-    logger.info(f"Completed request to {request.url.path}.")
+    def reset(self) -> None:
+        """Сбрасывает зарезервированные, но не выданные коды"""
 
-    return response
+    def release(self, code: str) -> None:
+        """Возвращает выданный, но не записанный в БД код для повторной выдачи"""
 
+    def persist(self, connection) -> None:
+        """Закрепляет в БД резерв, сделанный внутри задания SQLite writer (см. SequenceCodeAllocator)"""
 
-# Настройка CORS
-from fastapi.middleware.cors import CORSMiddleware
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=os.getenv("ALLOWED_ORIGINS", "*").split(","),
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+class RandomCodeAllocator(CodeAllocator):
+    """Прежняя схема: случайный код с проверкой занятости запросом к БД"""
 
-# Константа для разрешенного домена
-ALLOWED_DOMAIN = "services.investingindigital.com"
+    def allocate_many(self, db: Session, count: int) -> List[str]:
+        codes: List[str] = []
+        while len(codes) < count:
+            candidates = set()
+            while len(candidates) < count - len(codes):
+                code = create_random_code()
+                if code not in codes:
+                    candidates.add(code)
+            taken = set()
+            for part in chunked(list(candidates), BATCH_QUERY_CHUNK):
+                taken.update(db.execute(select(URL.short_code).where(URL.short_code.in_(part))).scalars())
+            self.retries += len(taken)
+            codes.extend(code for code in candidates if code not in taken)
+        return codes
 
 
-@app.get("/")
-async def root(request: Request, db: Session = Depends(get_db)):
-    # Получаем домен из заголовка Host
-    host = request.headers.get('host', '').split(':')[0]
+class SequenceCodeAllocator(CodeAllocator):
+    """
+    Коды из общего счетчика, пропущенного через перестановку scramble_code_index.
+    Каждый процесс резервирует у таблицы code_sequences блок номеров и раздает его
+    из памяти, так что новый код не требует проверочного запроса.
+    Ключ перестановки нельзя менять после запуска, иначе новые коды
+    могут совпасть с уже выданными.
+    """
 
-    # Ищем домен в базе данных
-    domain = db.query(Domain).filter(
-        Domain.domain == host,
-        Domain.is_active == True
-    ).first()
+    SEQUENCE_NAME = "urls"
 
-    # Если домен найден, делаем редирект
-    if domain:
-        return RedirectResponse(url=domain.redirect_url, status_code=302)
+    def __init__(self, key: bytes, block_size: int):
+        super().__init__()
+        self.key = key
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._released: List[str] = []
+        # Конец блока, зарезервированного внутри задания SQLite writer и еще не закрепленного persist()
+        self._unsaved_end = 0
+        self._lock = threading.Lock()
 
-    # Если домен не найден, показываем приветственное сообщение
-    return {"message": "Welcome to URL Shortener API"}
+    def reset(self) -> None:
+        with self._lock:
+            self._next = self._end = self._unsaved_end = 0
+            self._released.clear()
+
+    def release(self, code: str) -> None:
+        # Повторная отправка уже сокращенного URL не должна расходовать номера счетчика
+        with self._lock:
+            if len(self._released) < self.block_size:
+                self._released.append(code)
+
+    def _advance(self, session: Session, size: int) -> int:
+        """
+        Сдвигает счетчик на size и возвращает новое значение. Счетчик не опускается ниже конца
+        текущего блока: если его сдвиг откатился вместе с заданием writer, номера блока уже выдавались
+        """
+        floor = self._end
+        updated = session.execute(
+            update(CodeSequence)
+            .where(CodeSequence.name == self.SEQUENCE_NAME)
+            .values(next_value=case((CodeSequence.next_value < floor, floor), else_=CodeSequence.next_value) + size)
+        ).rowcount
+        if not updated:
+            session.add(CodeSequence(name=self.SEQUENCE_NAME, next_value=floor + size))
+            session.flush()
+        return session.execute(
+            select(CodeSequence.next_value).where(CodeSequence.name == self.SEQUENCE_NAME)
+        ).scalar_one()
+
+    def _reserve(self, size: int, db: Session) -> None:
+        """Резервирует блок номеров отдельной короткой транзакцией"""
+        if db.info.get("writer"):
+            # В SQLite writer вторая транзакция ждала бы блокировку, которую держит он сам,
+            # поэтому счетчик сдвигается в SAVEPOINT задания. Задание может откатиться
+            # (повтор вставки, ошибка), и сдвиг пропадет, а номера блока уже выдаются —
+            # поэтому после задания writer закрепляет блок через persist() вне его SAVEPOINT
+            end = self._advance(db, size)
+            self._unsaved_end = end
+        else:
+            reserve_db = SessionLocal()
+            try:
+                end = self._advance(reserve_db, size)
+                reserve_db.commit()
+            except IntegrityError:
+                # Строку счетчика одновременно создал другой процесс — повторяем через UPDATE
+                reserve_db.rollback()
+                return self._reserve(size, db)
+            finally:
+                reserve_db.close()
+        if end > CODE_SPACE:
+            raise RuntimeError("Short code space is exhausted")
+        self._next, self._end = end - size, end
+
+    def persist(self, connection) -> None:
+        with self._lock:
+            end, self._unsaved_end = self._unsaved_end, 0
+        if not end:
+            return
+        statement = dialect_insert(engine)(CodeSequence).values(name=self.SEQUENCE_NAME, next_value=end)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[CodeSequence.name],
+            set_={"next_value": statement.excluded.next_value},
+            where=CodeSequence.next_value < statement.excluded.next_value,
+        ))
+
+    def allocate_many(self, db: Session, count: int) -> List[str]:
+        codes = []
+        with self._lock:
+            while self._released and len(codes) < count:
+                codes.append(self._released.pop())
+            while len(codes) < count:
+                if self._next >= self._end:
+                    self._reserve(max(self.block_size, count - len(codes)), db)
+                take = min(self._end - self._next, count - len(codes))
+                codes.extend(
+                    encode_code(scramble_code_index(value, self.key))
+                    for value in range(self._next, self._next + take)
+                )
+                self._next += take
+        return codes
+
+
+def create_code_allocator() -> CodeAllocator:
+    kind = os.getenv("CODE_ALLOCATOR", "sequence")
+    if kind == "random":
+        return RandomCodeAllocator()
+    if kind != "sequence":
+        raise ValueError(f"Unknown CODE_ALLOCATOR: {kind}")
+    key = os.getenv("CODE_ALLOCATOR_KEY", "shorter").encode()
+    return SequenceCodeAllocator(key=key, block_size=int(os.getenv("CODE_BLOCK_SIZE", "100")))
+
+
+# Размер порции для IN (...) запросов — SQLite ограничивает число параметров
+BATCH_QUERY_CHUNK = 500
+# Сколько раз пробуем другой код, если выданный уже занят старой или пользовательской ссылкой
+CODE_INSERT_ATTEMPTS = 5
+
+code_allocator = create_code_allocator()
+
+
+def chunked(items: list, size: int):
+    """Делит список на части, чтобы не упираться в лимит параметров запроса"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def to_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Приводит время к наивному UTC, в котором хранятся expires_at и deactivated_at"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def utc_timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.replace(tzinfo=timezone.utc).timestamp() if value is not None else None
+
+
+def isoformat_or_none(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def get_url_hash(url: str) -> bytes:
+    """Создает SHA-256 хеш URL для поиска дубликатов (32 байта)"""
+    return hashlib.sha256(str(url).encode()).digest()
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш с временем жизни записей.
+    Считает попадания, промахи и вытеснения для подбора размера.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        """Возвращает значение или None, если записи нет или она устарела"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            # Вытесняем самые давно использованные записи
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys: Optional[str]) -> None:
+        with self._lock:
+            for key in keys:
+                if key is not None:
+                    self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# Кэш short_code -> (original_url, is_active, expires_at) для пути редиректа
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", "10000"))
+URL_CACHE_TTL = float(os.getenv("URL_CACHE_TTL", "300"))
+url_cache = TTLCache(max_size=URL_CACHE_SIZE, ttl=URL_CACHE_TTL)
+
+
+class RedirectTable:
+    """
+    Скомпилированная таблица short_code -> original_url активных ссылок в бинарном файле,
+    который все процессы отображают в память только для чтения: страницы файла
+    разделяются через page cache, а процесс стартует сразу «теплым».
+
+    Формат: заголовок, затем хеш-таблица с открытой адресацией (слот — код, дополненный
+    нулями до 6 байт, и смещение URL в блоке строк), затем блок строк (длина u16, код
+    редиректа u16 или 0 — по умолчанию, время истечения в секундах UTC или 0, URL в UTF-8).
+    Поиск — crc32 от кода и линейное пробирование, то есть O(1) без разбора файла.
+
+    Снимок не знает об изменениях после сборки: коды, измененные позже (локально или
+    в других процессах через cache_invalidations), помечаются грязными и читаются из БД,
+    пока их не накроет более свежий снимок.
+    """
+
+    MAGIC = b"SHRTMAP3"
+    HEADER = struct.Struct("<8sQQdQ")  # magic, число слотов, число ссылок, время сборки, смещение блока строк
+    SLOT = struct.Struct("<6sI")
+    ENTRY = struct.Struct("<HHd")
+    CODE_SIZE = 6
+    EMPTY = bytes(CODE_SIZE)
+    LOAD_FACTOR = 0.7
+
+    def __init__(self, path: str, margin: float):
+        self.path = path
+        # Запас по времени: изменение, опубликованное незадолго до сборки, могло зафиксироваться после нее
+        self.margin = margin
+        # (mmap, memoryview поверх него, число слотов, смещение блока строк, время сборки)
+        self._state: Optional[tuple] = None
+        self._signature = None
+        self._dirty: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def built_at(self) -> Optional[float]:
+        return self._state[4] if self._state is not None else None
+
+    def get(self, short_code: str) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        (URL, код редиректа или None) активной ссылки из снимка или None,
+        если кода нет в снимке или он изменился после сборки
+        """
+        state = self._state
+        if state is None or short_code in self._dirty:
+            return None
+        key = short_code.encode("utf-8")
+        if len(key) > self.CODE_SIZE:
+            return None
+        key = key.ljust(self.CODE_SIZE, b"\0")
+        _, view, slots, blob_offset, _ = state
+        index = zlib.crc32(key) % slots
+        while True:
+            position = self.HEADER.size + index * self.SLOT.size
+            # Срез memoryview сравнивается с ключом на месте, без копирования байтов слота
+            slot_code = view[position:position + self.CODE_SIZE]
+            if slot_code == key:
+                offset = blob_offset + self.SLOT.unpack_from(view, position)[1]
+                length, status, expires_at = self.ENTRY.unpack_from(view, offset)
+                if expires_at and expires_at <= time.time():
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                start = offset + self.ENTRY.size
+                return str(view[start:start + length], "utf-8"), status or None
+            if slot_code == self.EMPTY:
+                self.misses += 1
+                return None
+            index = (index + 1) % slots
+
+    def invalidate(self, *codes: Optional[str]) -> None:
+        """Помечает коды, измененные после сборки снимка"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            for code in codes:
+                if code is not None:
+                    self._dirty[code] = now
+
+    def reload(self) -> bool:
+        """Отображает файл заново, если его подменили; вызывается из event loop"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+
+        with open(self.path, "rb") as table_file:
+            mm = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, slots, count, built_at, blob_offset = self.HEADER.unpack_from(mm, 0)
+        if magic != self.MAGIC or slots == 0:
+            mm.close()
+            logger.error("Файл %s не является таблицей редиректов", self.path)
+            return False
+
+        previous = self._state
+        self._state = (mm, memoryview(mm), slots, blob_offset, built_at)
+        self._signature = signature
+        with self._lock:
+            horizon = built_at - self.margin
+            self._dirty = {code: changed for code, changed in self._dirty.items() if changed >= horizon}
+        if previous is not None:
+            self._unmap(previous)
+        logger.info("Загружена таблица редиректов %s: %s ссылок", self.path, count)
+        return True
+
+    @staticmethod
+    def _unmap(state: tuple) -> None:
+        # mmap нельзя закрыть, пока на него есть memoryview
+        state[1].release()
+        state[0].close()
+
+    def close(self) -> None:
+        if self._state is not None:
+            self._unmap(self._state)
+            self._state = None
+            self._signature = None
+
+    @classmethod
+    def compile(cls, path: str, batch_size: int = 10000) -> int:
+        """
+        Собирает таблицу из активных ссылок и атомарно подменяет файл.
+        Строки читаются потоком; в памяти держится только массив слотов
+        """
+        built_at = time.time()
+        db = SessionLocal()
+        try:
+            # Уже истекшие ссылки в таблицу не попадают; истекающие позже проверяются при поиске
+            servable = (URL.is_active == True) & ((URL.expires_at == None) | (URL.expires_at > utc_now()))
+            count = db.scalar(select(func.count()).select_from(URL).where(servable)) or 0
+            slots = max(int(count / cls.LOAD_FACTOR) + 1, 1)
+            table = bytearray(slots * cls.SLOT.size)
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            stored = 0
+            with tempfile.TemporaryFile(dir=directory) as blob:
+                blob_size = 0
+                rows = db.execute(
+                    select(URL.short_code, URL.original_url, URL.expires_at, URL.redirect_status).where(servable)
+                    .execution_options(yield_per=batch_size)
+                )
+                for short_code, original_url, expires_at, redirect_status in rows:
+                    key = short_code.encode("utf-8")
+                    # Коды длиннее слота и ссылки, появившиеся после подсчета, обслуживает БД
+                    if len(key) > cls.CODE_SIZE or stored >= count:
+                        continue
+                    url = original_url.encode("utf-8")
+                    if blob_size + cls.ENTRY.size + len(url) > 0xFFFFFFFF:
+                        raise ValueError("Redirect table exceeds 4 GiB of URLs")
+                    key = key.ljust(cls.CODE_SIZE, b"\0")
+                    index = zlib.crc32(key) % slots
+                    while table[index * cls.SLOT.size:index * cls.SLOT.size + cls.CODE_SIZE] != cls.EMPTY:
+                        index = (index + 1) % slots
+                    cls.SLOT.pack_into(table, index * cls.SLOT.size, key, blob_size)
+                    blob.write(cls.ENTRY.pack(len(url), redirect_status or 0, utc_timestamp(expires_at) or 0.0) + url)
+                    blob_size += cls.ENTRY.size + len(url)
+                    stored += 1
+
+                blob.seek(0)
+                temporary_path = f"{path}.{os.getpid()}.tmp"
+                with open(temporary_path, "wb") as output:
+                    blob_offset = cls.HEADER.size + len(table)
+                    output.write(cls.HEADER.pack(cls.MAGIC, slots, stored, built_at, blob_offset))
+                    output.write(table)
+                    shutil.copyfileobj(blob, output)
+                os.replace(temporary_path, path)
+        finally:
+            db.close()
+        logger.info("Таблица редиректов %s собрана: %s ссылок за %.1f с", path, stored, time.time() - built_at)
+        return stored
+
+    def try_compile(self, max_age: float) -> bool:
+        """
+        Пересобирает таблицу, если она старше max_age секунд. Блокировка файла
+        гарантирует, что из нескольких процессов таблицу собирает только один
+        """
+        with open(self.path + ".lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                if os.path.exists(self.path) and time.time() - os.stat(self.path).st_mtime < max_age:
+                    return False
+                self.compile(self.path)
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "loaded": self._state is not None,
+            "built_at": datetime.utcfromtimestamp(self.built_at).isoformat() if self.built_at else None,
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class ShortCodeFilter:
+    """
+    Фильтр Блума по всем существующим коротким кодам (активным и нет).
+    Если фильтр говорит «нет», кода точно нет в БД и 404 отдается без запроса;
+    «да» может быть ложным с вероятностью около fp_rate — тогда запрос идет в БД как обычно.
+
+    Строки другой формы, чем SHORT_CODE_PATTERN, отсекаются еще до фильтра, если их нет
+    среди немногих кодов такой формы в БД (старые и пользовательские коды хранятся точным множеством).
+
+    Коды добавляются при создании и переименовании ссылок в этом процессе, а коды,
+    созданные другими процессами (включая импорт из командной строки), подтягиваются
+    фоновым запросом по id и журналом CacheSync. Удаление из фильтра Блума невозможно:
+    удаленные коды лишь увеличивают долю ложных срабатываний, и при ее росте фильтр пересобирается
+    """
+
+    def __init__(self, enabled: bool, fp_rate: float, capacity: int, sync_interval: float, lookback: float):
+        self.enabled = enabled
+        self.fp_rate = fp_rate
+        # 0 — емкость подбирается при сборке: вдвое больше текущего числа кодов
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        # Строки с id меньше уже прочитанных могут зафиксироваться позже, поэтому
+        # синхронизация перечитывает id, появившиеся за последние lookback секунд
+        self.lookback = lookback
+        self._bits: Optional[bytearray] = None
+        self._size = 0
+        self._hashes = 0
+        self._lock = threading.Lock()
+        self._watermarks: List[Tuple[float, int]] = []
+        self._pending: Optional[list] = None
+        self._task: Optional[asyncio.Task] = None
+        # Коды в БД, не подходящие под SHORT_CODE_PATTERN: для них проверка формы не годится
+        self._irregular: set = set()
+        self.count = 0
+        self.rejected_shape = 0
+        self.rejected_filter = 0
+        self.passed = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._bits is not None
+
+    def _positions(self, code: str, size: int, hashes: int):
+        # Двойное хеширование: k позиций из двух 64-битных половин одного дайджеста
+        digest = hashlib.blake2b(code.encode("utf-8"), digest_size=16).digest()
+        position = int.from_bytes(digest[:8], "little") % size
+        step = int.from_bytes(digest[8:], "little") % size or 1
+        for _ in range(hashes):
+            yield position
+            position = (position + step) % size
+
+    def might_exist(self, code: str) -> bool:
+        """False — кода точно нет; True — код есть или фильтр не готов"""
+        if not self.enabled:
+            return True
+        bits = self._bits
+        if bits is None:
+            return True
+        if SHORT_CODE_RE.fullmatch(code) is None and code not in self._irregular:
+            self.rejected_shape += 1
+            return False
+        for position in self._positions(code, self._size, self._hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                self.rejected_filter += 1
+                return False
+        self.passed += 1
+        return True
+
+    def add(self, *codes: Optional[str]) -> None:
+        # Новые коды могут еще не дойти до реплик
+        read_replicas.pin("url", *codes)
+        if not self.enabled:
+            return
+        codes = [code for code in codes if code]
+        with self._lock:
+            self._note_irregular(self._irregular, codes)
+            if self._pending is not None:
+                # Идет пересборка: эти коды попадут и в новый фильтр
+                self._pending.extend(codes)
+            if self._bits is not None:
+                self._add_locked(self._bits, self._size, self._hashes, codes)
+                self.count += len(codes)
+
+    @staticmethod
+    def _note_irregular(irregular: set, codes) -> None:
+        irregular.update(code for code in codes if SHORT_CODE_RE.fullmatch(code) is None)
+
+    def _add_locked(self, bits: bytearray, size: int, hashes: int, codes) -> None:
+        for code in codes:
+            for position in self._positions(code, size, hashes):
+                bits[position >> 3] |= 1 << (position & 7)
+
+    def estimated_fp_rate(self) -> float:
+        """Доля ложных срабатываний по фактической заполненности битового массива"""
+        bits = self._bits
+        if bits is None or not self._size:
+            return 0.0
+        filled = int.from_bytes(bits, "little").bit_count() / self._size
+        return filled ** self._hashes
+
+    def build(self, batch_size: int = 10000) -> None:
+        """Собирает фильтр заново по всем кодам в БД; вызывается вне event loop"""
+        started = time.monotonic()
+        with self._lock:
+            self._pending = []
+        db = SessionLocal()
+        try:
+            total, max_id = db.execute(select(func.count(URL.id), func.max(URL.id))).one()
+            capacity = self.capacity or max(total * 2, 100000)
+            # Оптимальные размер и число хеш-функций для заданной емкости и доли ложных срабатываний
+            size = max(int(-capacity * math.log(self.fp_rate) / math.log(2) ** 2), 8)
+            hashes = max(int(round(size / capacity * math.log(2))), 1)
+            bits = bytearray((size + 7) // 8)
+            count = 0
+            irregular = set()
+            rows = db.execute(
+                select(URL.short_code).where(URL.id <= (max_id or 0)).execution_options(yield_per=batch_size))
+            for (code,) in rows:
+                if SHORT_CODE_RE.fullmatch(code) is None:
+                    irregular.add(code)
+                self._add_locked(bits, size, hashes, (code,))
+                count += 1
+        finally:
+            db.close()
+
+        with self._lock:
+            self._note_irregular(irregular, self._pending)
+            self._add_locked(bits, size, hashes, self._pending)
+            count += len(self._pending)
+            self._pending = None
+            self._bits, self._size, self._hashes = bits, size, hashes
+            self._irregular = irregular
+            self.count = count
+            self._watermarks = [(time.monotonic(), max_id or 0)]
+        if irregular:
+            logger.info("Кодов, не подходящих под %s: %s", SHORT_CODE_PATTERN, len(irregular))
+        logger.info("Фильтр коротких кодов собран: %s кодов, %.1f МБ, %s хеш-функций за %.1f с",
+                    count, len(bits) / 2 ** 20, hashes, time.monotonic() - started)
+
+    def sync(self) -> int:
+        """Добавляет коды, вставленные другими процессами; вызывается вне event loop"""
+        now = time.monotonic()
+        # Самая свежая отметка, которой уже больше lookback секунд
+        older = [max_id for recorded, max_id in self._watermarks if recorded <= now - self.lookback]
+        from_id = older[-1] if older else self._watermarks[0][1]
+        db = SessionLocal()
+        try:
+            rows = db.execute(select(URL.id, URL.short_code).where(URL.id > from_id)).all()
+        finally:
+            db.close()
+        codes = [row.short_code for row in rows]
+        read_replicas.pin("url", *codes)
+        with self._lock:
+            self._note_irregular(self._irregular, codes)
+            if self._pending is not None:
+                # Идет пересборка, которая могла не увидеть эти строки
+                self._pending.extend(codes)
+            self._add_locked(self._bits, self._size, self._hashes, codes)
+            max_id = max((row.id for row in rows), default=self._watermarks[-1][1])
+            self._watermarks = [
+                (recorded, value) for recorded, value in self._watermarks if recorded > now - self.lookback * 2
+            ] or self._watermarks[-1:]
+            self._watermarks.append((now, max(max_id, self._watermarks[-1][1])))
+        return len(rows)
+
+    async def _run(self) -> None:
+        while not self.ready:
+            try:
+                await asyncio.to_thread(self.build)
+            except Exception as e:
+                logger.error("Ошибка при сборке фильтра коротких кодов: %s", e)
+                await asyncio.sleep(self.sync_interval * 10)
+        last_check = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await asyncio.to_thread(self.sync)
+                if time.monotonic() - last_check < 60:
+                    continue
+                last_check = time.monotonic()
+                if await asyncio.to_thread(self.estimated_fp_rate) > self.fp_rate * 2:
+                    logger.info("Доля ложных срабатываний фильтра выросла до %.4f, пересобираем",
+                                self.estimated_fp_rate())
+                    await asyncio.to_thread(self.build)
+            except Exception as e:
+                logger.error("Ошибка при синхронизации фильтра коротких кодов: %s", e)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "codes": self.count,
+            "memory_bytes": len(self._bits) if self._bits is not None else 0,
+            "hash_functions": self._hashes,
+            "target_fp_rate": self.fp_rate,
+            "estimated_fp_rate": round(self.estimated_fp_rate(), 6),
+            "rejected_shape": self.rejected_shape,
+            "irregular_codes": len(self._irregular),
+            "rejected_filter": self.rejected_filter,
+            "passed": self.passed,
+        }
+
+
+def _short_code_filter_stats():
+    stats = short_code_filter.stats()
+    for key in ("codes", "memory_bytes", "estimated_fp_rate"):
+        yield (key,), stats[key]
+
+
+short_code_filter = ShortCodeFilter(
+    enabled=os.getenv("SHORT_CODE_FILTER", "true").lower() in ("1", "true", "yes"),
+    fp_rate=float(os.getenv("SHORT_CODE_FILTER_FP_RATE", "0.001")),
+    capacity=int(os.getenv("SHORT_CODE_FILTER_CAPACITY", "0")),
+    sync_interval=float(os.getenv("SHORT_CODE_FILTER_SYNC_INTERVAL", "1")),
+    lookback=float(os.getenv("CACHE_SYNC_LOOKBACK", "10")),
+)
+metrics.register(Gauge(
+    "shortener_short_code_filter", "Short-code Bloom filter size and estimated false-positive rate", ("value",),
+    callback=_short_code_filter_stats))
+
+
+# Путь к файлу таблицы редиректов; пустое значение отключает таблицу
+REDIRECT_TABLE_PATH = os.getenv("REDIRECT_TABLE_PATH", "")
+# Как часто процесс проверяет, не подменили ли файл, и как часто таблица пересобирается (0 — только вручную)
+REDIRECT_TABLE_RELOAD_INTERVAL = float(os.getenv("REDIRECT_TABLE_RELOAD_INTERVAL", "5"))
+REDIRECT_TABLE_REBUILD_INTERVAL = float(os.getenv("REDIRECT_TABLE_REBUILD_INTERVAL", "300"))
+redirect_table = RedirectTable(
+    REDIRECT_TABLE_PATH, margin=float(os.getenv("CACHE_SYNC_LOOKBACK", "10")))
+
+
+class UrlVerifier:
+    """
+    Асинхронная проверка доступности URL через общий пул соединений httpx.
+    Ограничивает общее число одновременных проверок и число проверок на один хост,
+    а результаты кэширует по URL (и недоступность — по хосту) на время TTL.
+    """
+
+    def __init__(self, timeout: float, max_concurrency: int, per_host_concurrency: int,
+                 cache_ttl: float, cache_size: int, allow_on_unexpected_error: bool, pool_shards: int = 1):
+        self.timeout = timeout
+        self.per_host_concurrency = per_host_concurrency
+        self.allow_on_unexpected_error = allow_on_unexpected_error
+        self.max_concurrency = max_concurrency
+        # Пул соединений httpcore выбирает соединение перебором всего пула, и с сотнями соединений
+        # это съедает процессор. Хосты распределяются по pool_shards клиентам по хешу, так что
+        # соединения с хостом по-прежнему переиспользуются, а каждый пул остается небольшим
+        self.pool_shards = max(pool_shards, 1)
+        self._clients: dict = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._host_semaphores: dict = {}
+        self._host_waiters: dict = {}
+        self.url_results = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self.host_failures = TTLCache(max_size=cache_size, ttl=cache_ttl)
+
+    def _get_client(self, host: str) -> httpx.AsyncClient:
+        shard = zlib.crc32(host.encode()) % self.pool_shards
+        client = self._clients.get(shard)
+        if client is None:
+            client = self._clients[shard] = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    # Общее число запросов ограничивает семафор, а хосты распределяются по пулам неравномерно.
+                    # Простаивающих соединений держим примерно столько, сколько пул использует одновременно
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=min(
+                        self.max_concurrency,
+                        math.ceil(self.max_concurrency / self.pool_shards) * self.per_host_concurrency),
+                ),
+            )
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return client
+
+    async def close(self) -> None:
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+
+    async def _probe(self, url: str, host: str) -> int:
+        """Возвращает HTTP-статус ответа на HEAD (или на GET, если сервер не поддерживает HEAD)"""
+        client = self._get_client(host)
+        host_semaphore = self._host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        self._host_waiters[host] = self._host_waiters.get(host, 0) + 1
+        try:
+            # Сначала место на хосте, потом общее: запросы к одному хосту, ждущие своей очереди,
+            # не должны занимать общие места и задерживать проверку других хостов
+            async with host_semaphore, self._semaphore:
+                response = await client.head(url)
+                if response.status_code in (405, 501):
+                    # Тело не читаем — нужен только статус
+                    async with client.stream("GET", url) as response:
+                        pass
+        finally:
+            # Семафоры хостов без ожидающих запросов удаляем, чтобы словарь не рос
+            self._host_waiters[host] -= 1
+            if not self._host_waiters[host]:
+                del self._host_waiters[host]
+                del self._host_semaphores[host]
+        logger.debug("Ответ от URL %s: статус %s", url, response.status_code)
+        return response.status_code
+
+    async def verify(self, url: str) -> bool:
+        """
+        Проверяет доступность URL
+        Возвращает True если URL доступен, False если нет
+        """
+        cached = self.url_results.get(url)
+        if cached is not None:
+            return cached
+        host = urlsplit(url).netloc.lower()
+        if self.host_failures.get(host):
+            return False
+
+        logger.debug("Проверка доступности URL: %s", url)
+        try:
+            result = await self._probe(url, host) < 400
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            logger.error("Хост %s недоступен при проверке URL %s: %s", host, url, e)
+            self.host_failures.set(host, True)
+            result = False
+        except httpx.HTTPError as e:
+            logger.error("Ошибка при проверке URL %s: %s", url, e)
+            result = False
+        except Exception as e:
+            logger.error("Неожиданная ошибка при проверке URL %s: %s", url, e)
+            # По умолчанию возвращаем True, чтобы не блокировать изменение ссылки
+            # при неожиданных ошибках проверки; результат не кэшируем
+            return self.allow_on_unexpected_error
+        self.url_results.set(url, result)
+        return result
+
+    async def status(self, url: str) -> Optional[int]:
+        """
+        HTTP-статус URL без кэша результатов: 0 — ответа нет, None — неожиданная ошибка.
+        Недоступный хост запоминается, и остальные его URL до истечения TTL не запрашиваются
+        """
+        host = urlsplit(url).netloc.lower()
+        if self.host_failures.get(host):
+            return 0
+        try:
+            return await self._probe(url, host)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            logger.info("Хост %s недоступен при проверке URL %s: %s", host, url, e)
+            self.host_failures.set(host, True)
+            return 0
+        except httpx.HTTPError as e:
+            logger.info("Ошибка при проверке URL %s: %s", url, e)
+            return 0
+        except Exception as e:
+            logger.error("Неожиданная ошибка при проверке URL %s: %s", url, e)
+            return None
+
+
+url_verifier = UrlVerifier(
+    timeout=float(os.getenv("VERIFY_URL_TIMEOUT", "5")),
+    max_concurrency=int(os.getenv("VERIFY_URL_MAX_CONCURRENCY", "50")),
+    per_host_concurrency=int(os.getenv("VERIFY_URL_PER_HOST_CONCURRENCY", "4")),
+    cache_ttl=float(os.getenv("VERIFY_URL_CACHE_TTL", "300")),
+    cache_size=int(os.getenv("VERIFY_URL_CACHE_SIZE", "10000")),
+    allow_on_unexpected_error=os.getenv("VERIFY_URL_ALLOW_ON_ERROR", "true").lower() in ("1", "true", "yes"),
+)
+
+
+async def verify_url(url: str) -> bool:
+    return await url_verifier.verify(url)
+
+class DomainRoutes:
+    """
+    Таблица маршрутизации host -> (redirect_url, код редиректа или None) для активных доменов.
+    Словарь никогда не изменяется на месте: каждое изменение собирает
+    новую копию и атомарно подменяет ссылку, поэтому чтение не требует блокировок.
+    """
+
+    def __init__(self):
+        self._routes: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, host: str) -> Optional[Tuple[str, Optional[int]]]:
+        return self._routes.get(host)
+
+    def load(self, db: Session) -> None:
+        """Полностью перестраивает таблицу по активным записям в БД"""
+        rows = db.query(Domain.domain, Domain.redirect_url, Domain.redirect_status) \
+            .filter(Domain.is_active == True).all()
+        routes = {row.domain: (row.redirect_url, row.redirect_status) for row in rows}
+        with self._lock:
+            self._routes = routes
+        logger.info("Загружено доменов в таблицу маршрутизации: %s", len(routes))
+
+    def apply(self, domain: "Domain") -> None:
+        """Обновляет маршрут для одного домена в соответствии с его состоянием"""
+        if domain.is_active:
+            self.set(domain.domain, domain.redirect_url, domain.redirect_status)
+        else:
+            self.remove(domain.domain)
+
+    def set(self, host: str, redirect_url: str, redirect_status: Optional[int] = None) -> None:
+        with self._lock:
+            routes = dict(self._routes)
+            routes[host] = (redirect_url, redirect_status)
+            self._routes = routes
+
+    def remove(self, host: str) -> None:
+        with self._lock:
+            if host not in self._routes:
+                return
+            routes = dict(self._routes)
+            del routes[host]
+            self._routes = routes
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+
+domain_routes = DomainRoutes()
+
+
+def dialect_insert(db_engine):
+    """insert() с поддержкой ON CONFLICT для текущей СУБД"""
+    if db_engine.dialect.name == "postgresql":
+        return postgresql.insert
+    if db_engine.dialect.name == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upsert is not supported for {db_engine.dialect.name}")
+
+
+def flush_clicks_job(db: Session, rows: List[dict], chunk_size: int) -> None:
+    """Прибавляет счетчики переходов к таблице clicks пакетными upsert'ами"""
+    upsert = dialect_insert(engine)
+    for part in chunked(rows, chunk_size):
+        stmt = upsert(Click).values(part)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Click.kind, Click.key, Click.bucket_start],
+            set_={"count": Click.count + stmt.excluded.count},
+        )
+        db.execute(stmt)
+    db.commit()
+
+
+class ClickAggregator:
+    """
+    Буфер переходов: счетчики (kind, key, начало интервала) копятся в памяти,
+    а фоновая задача периодически сбрасывает их в таблицу clicks пакетными upsert'ами.
+    Запись перехода — только инкремент в словаре, без обращений к БД.
+    """
+
+    # 4 параметра на строку — укладываемся в лимит параметров SQLite
+    FLUSH_CHUNK = 200
+
+    def __init__(self, enabled: bool, bucket_seconds: int, flush_interval: float, flush_threshold: int):
+        self.enabled = enabled
+        self.bucket_seconds = bucket_seconds
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending: dict = {}
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_rows = 0
+
+    def record(self, kind: str, key: str) -> None:
+        if not self.enabled:
+            return
+        bucket = int(time.time()) // self.bucket_seconds * self.bucket_seconds
+        item = (kind, key, bucket)
+        with self._lock:
+            self._pending[item] = self._pending.get(item, 0) + 1
+            size = len(self._pending)
+        if size >= self.flush_threshold and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending_for(self, kind: str, key: str) -> dict:
+        """Еще не записанные в БД счетчики по интервалам"""
+        with self._lock:
+            return {bucket: count for (k, name, bucket), count in self._pending.items() if k == kind and name == key}
+
+    def flush(self) -> int:
+        """Записывает накопленные счетчики в БД; вызывается вне event loop"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        rows = [
+            {"kind": kind, "key": key, "bucket_start": bucket, "count": count}
+            for (kind, key, bucket), count in pending.items()
+        ]
+        try:
+            run_write_sync(flush_clicks_job, rows, self.FLUSH_CHUNK)
+        except Exception as e:
+            # Возвращаем счетчики в буфер, чтобы не потерять их до следующей попытки
+            logger.error("Ошибка при записи статистики переходов: %s", e)
+            with self._lock:
+                for item, count in pending.items():
+                    self._pending[item] = self._pending.get(item, 0) + count
+            return 0
+        self.flushed_rows += len(rows)
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await asyncio.to_thread(self.flush)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+
+def cleanup_cache_invalidations_job(db: Session, before: float) -> None:
+    db.execute(delete(CacheInvalidation).where(CacheInvalidation.created_at < before))
+    db.commit()
+
+
+class CacheSync:
+    """
+    Согласованность кэшей между воркерами без внешнего брокера.
+    Обработчики изменений пишут ключи в таблицу cache_invalidations в той же транзакции,
+    а каждый процесс раз в poll_interval секунд читает новые записи и сбрасывает
+    у себя кэш ссылок и маршруты доменов. Задержка распространения — не больше
+    poll_interval плюс время запроса.
+    """
+
+    def __init__(self, enabled: bool, poll_interval: float, lookback: float, retention: float):
+        self.enabled = enabled
+        self.poll_interval = poll_interval
+        # Записи читаются с запасом по времени: транзакции могут фиксироваться не по порядку id
+        self.lookback = lookback
+        self.retention = retention
+        self._since = time.time()
+        self._seen: dict = {}
+        self._last_cleanup = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.applied = 0
+
+    def publish(self, db: Session, kind: str, *keys: Optional[str]) -> None:
+        """Добавляет записи в текущую транзакцию (фиксирует их вызывающий код) и направляет
+        чтение этих ключей на основную БД"""
+        read_replicas.pin(kind, *keys)
+        if kind == "url":
+            redirect_table.invalidate(*keys)
+            short_code_filter.add(*keys)
+        if not self.enabled:
+            return
+        now = time.time()
+        for key in dict.fromkeys(key for key in keys if key is not None):
+            db.add(CacheInvalidation(kind=kind, key=key, created_at=now))
+
+    def poll(self) -> int:
+        """Применяет новые записи журнала; вызывается вне event loop"""
+        started = time.time()
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(CacheInvalidation.id, CacheInvalidation.kind, CacheInvalidation.key, CacheInvalidation.created_at)
+                .where(CacheInvalidation.created_at >= self._since - self.lookback)
+                .order_by(CacheInvalidation.id)
+            ).all()
+            fresh = [row for row in rows if row.id not in self._seen]
+            domains = {row.key for row in fresh if row.kind == "domain"}
+            for row in fresh:
+                read_replicas.pin(row.kind, row.key)
+            changed_urls = [row.key for row in fresh if row.kind == "url"]
+            url_cache.invalidate(*changed_urls)
+            redirect_table.invalidate(*changed_urls)
+            # Переименованные в других процессах коды не видны синхронизации фильтра по id
+            short_code_filter.add(*changed_urls)
+            if domains:
+                for domain in db.query(Domain).filter(Domain.domain.in_(domains)).all():
+                    domain_routes.apply(domain)
+                    domains.discard(domain.domain)
+                # Удаленных из БД доменов больше нет — убираем их маршруты
+                for domain in domains:
+                    domain_routes.remove(domain)
+
+            for row in fresh:
+                self._seen[row.id] = row.created_at
+            self._since = started
+            horizon = started - self.lookback * 2
+            self._seen = {row_id: created_at for row_id, created_at in self._seen.items() if created_at >= horizon}
+
+        finally:
+            db.close()
+        if started - self._last_cleanup > self.retention:
+            run_write_sync(cleanup_cache_invalidations_job, started - self.retention)
+            self._last_cleanup = started
+        self.applied += len(fresh)
+        return len(fresh)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await asyncio.to_thread(self.poll)
+            except Exception as e:
+                logger.error("Ошибка при синхронизации кэшей: %s", e)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._since = time.time()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def archive_links_job(db: Session, batch_size: int, inactive_before: Optional[datetime]) -> int:
+    """
+    Переносит в urls_archive не больше batch_size истекших ссылок (или, если их нет,
+    неактивных с deactivated_at раньше inactive_before) и удаляет их из urls.
+    Одна короткая транзакция на порцию; в PostgreSQL строки берутся с SKIP LOCKED,
+    поэтому параллельные процессы разбирают разные порции
+    """
+    now = utc_now()
+    # Явное IS NOT NULL нужно, чтобы SQLite выбрал частичные индексы по этим колонкам
+    groups = [("expired", (URL.expires_at != None) & (URL.expires_at <= now))]
+    if inactive_before is not None:
+        groups.append(("inactive", (URL.is_active == False) & (URL.deactivated_at != None)
+                       & (URL.deactivated_at <= inactive_before)))
+
+    archived = []
+    for reason, condition in groups:
+        if len(archived) >= batch_size:
+            break
+        query = select(URL.id, URL.short_code).where(condition).order_by(URL.id).limit(batch_size - len(archived))
+        if db.get_bind().dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        rows = db.execute(query).all()
+        if not rows:
+            continue
+        ids = [row.id for row in rows]
+        db.execute(insert(URLArchive).from_select(
+            ["url_id", "original_url", "url_hash", "short_code", "created_at", "is_active",
+             "expires_at", "deactivated_at", "redirect_status", "archived_at", "reason"],
+            select(URL.id, URL.original_url, URL.url_hash, URL.short_code, URL.created_at, URL.is_active,
+                   URL.expires_at, URL.deactivated_at, URL.redirect_status, literal(now, DateTime), literal(reason))
+            .where(URL.id.in_(ids))
+        ))
+        db.execute(delete(URL).where(URL.id.in_(ids)))
+        # Статистика переходов уходит вместе со ссылкой: код может занять новая ссылка
+        db.execute(
+            update(Click.__table__)
+            .where(Click.kind == "url", Click.key == bindparam("code"))
+            .values(kind="archived", key=bindparam("url_id")),
+            [{"code": row.short_code, "url_id": str(row.id)} for row in rows],
+        )
+        archived.extend(row.short_code for row in rows)
+
+    if archived:
+        # Освободившиеся коды могут занять новые ссылки — сбрасываем их в кэшах
+        cache_sync.publish(db, "url", *archived)
+    db.commit()
+    url_cache.invalidate(*archived)
+    return len(archived)
+
+
+class LinkSweeper:
+    """
+    Фоновая очистка urls: истекшие и давно неактивные ссылки переносятся в архив
+    небольшими порциями с паузой между ними, чтобы не держать долгих блокировок
+    и не нагружать БД. Когда переносить нечего, проверка повторяется раз в interval секунд
+    """
+
+    def __init__(self, enabled: bool, interval: float, batch_size: int, pause: float, inactive_days: float):
+        self.enabled = enabled
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        # 0 — неактивные ссылки не архивируются
+        self.inactive_days = inactive_days
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+
+    def sweep_batch(self) -> int:
+        """Переносит одну порцию; вызывается вне event loop"""
+        inactive_before = utc_now() - timedelta(days=self.inactive_days) if self.inactive_days > 0 else None
+        archived = run_write_sync(archive_links_job, self.batch_size, inactive_before)
+        self.archived += archived
+        return archived
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                archived = await asyncio.to_thread(self.sweep_batch)
+            except Exception as e:
+                logger.error("Ошибка при переносе ссылок в архив: %s", e)
+                archived = 0
+            if archived:
+                logger.info("Перенесено в архив ссылок: %s", archived)
+            await asyncio.sleep(self.pause if archived >= self.batch_size else self.interval)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+link_sweeper = LinkSweeper(
+    enabled=os.getenv("LINK_SWEEPER", "true").lower() in ("1", "true", "yes"),
+    interval=float(os.getenv("LINK_SWEEP_INTERVAL", "60")),
+    batch_size=int(os.getenv("LINK_SWEEP_BATCH", "500")),
+    pause=float(os.getenv("LINK_SWEEP_PAUSE", "0.5")),
+    inactive_days=float(os.getenv("LINK_ARCHIVE_INACTIVE_DAYS", "90")),
+)
+
+# Что проверяет LinkHealthChecker: вид ссылки -> (модель, колонка с целевым URL)
+LINK_HEALTH_TARGETS = {
+    "url": (URL, URL.original_url),
+    "domain": (Domain, Domain.redirect_url),
+}
+
+
+def claim_link_health_job(db: Session, kind: str, after_id: int, batch_size: int, due_before: datetime,
+                          claimed_at: datetime, claimed_until: datetime) -> Tuple[Optional[int], List[Tuple[int, str]]]:
+    """
+    Берет следующую порцию активных ссылок с id больше after_id, которые не проверялись с due_before
+    и не забраны другим процессом, и отмечает их арендой до claimed_until. health_checked_at
+    ставит только store_link_health_job: если процесс упадет, не сохранив результат, ссылки
+    снова станут доступны по истечении аренды, а не через полный интервал.
+    Возвращает последний просмотренный id (None — ссылок больше нет) и забранные (id, целевой URL).
+    В PostgreSQL строки берутся с SKIP LOCKED, поэтому параллельные процессы разбирают разные порции
+    """
+    model, target = LINK_HEALTH_TARGETS[kind]
+    due = (
+        ((model.health_checked_at == None) | (model.health_checked_at <= due_before))
+        & ((model.health_claimed_until == None) | (model.health_claimed_until <= claimed_at))
+    )
+    query = (
+        select(model.id)
+        .where(model.is_active == True, model.id > after_id, due)
+        .order_by(model.id)
+        .limit(batch_size)
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    ids = db.execute(query).scalars().all()
+    if not ids:
+        db.commit()
+        return None, []
+    # Условие повторяется в UPDATE: в SQLite выборка идет вне транзакции записи,
+    # и ту же порцию мог успеть забрать другой процесс
+    rows = db.execute(
+        update(model).where(model.id.in_(ids), due)
+        .values(health_claimed_until=claimed_until)
+        .returning(model.id, target)
+    ).all()
+    db.commit()
+    return ids[-1], sorted((row_id, url) for row_id, url in rows)
+
+
+def store_link_health_job(db: Session, results: List[Tuple[str, int, int]], checked_at: datetime) -> None:
+    """Сохраняет результаты проверки (вид, id, статус) пакетным UPDATE по первичному ключу"""
+    for kind, (model, target) in LINK_HEALTH_TARGETS.items():
+        rows = [
+            {"id": row_id, "health_status": status, "health_checked_at": checked_at, "health_claimed_until": None}
+            for row_kind, row_id, status in results if row_kind == kind
+        ]
+        if rows:
+            db.execute(update(model), rows)
+    db.commit()
+
+
+class LinkHealthChecker:
+    """
+    Фоновая проверка целевых URL активных ссылок и доменов. Таблицы обходятся порциями
+    по id (keyset), адреса проверяются HEAD-запросами через отдельный UrlVerifier:
+    общее ограничение параллельности, ограничение на хост и переиспользование соединений.
+    Одинаковые адреса проверяются один раз. Пока проверяется одна порция, уже читается
+    следующая, так что медленные хосты не задерживают обход. Результат (HTTP-статус и время)
+    сохраняется у каждой ссылки.
+
+    Каждая ссылка проверяется раз в interval секунд на все процессы: порция забирается
+    арендой на claim_ttl секунд (claim_link_health_job), и другие процессы ее пропускают.
+    Ссылки, которые пора проверить, ищутся раз в poll_interval секунд
+    """
+
+    def __init__(self, verifier: UrlVerifier, enabled: bool, interval: float, poll_interval: float,
+                 batch_size: int, cache_size: int, cache_ttl: float, claim_ttl: float):
+        self.verifier = verifier
+        self.enabled = enabled
+        self.interval = interval
+        self.claim_ttl = claim_ttl
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        # Статусы недавно проверенных адресов: одинаковые URL в разных порциях не запрашиваются повторно
+        self._statuses = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self._flight = SingleFlight()
+        self._task: Optional[asyncio.Task] = None
+        self.checked = 0
+        self.broken = 0
+        self.sweeps = 0
+
+    def _claim(self, kind: str, after_id: int) -> Tuple[Optional[int], List[Tuple[int, str]]]:
+        """Забирает следующую порцию ссылок, которые пора проверить; вызывается вне event loop"""
+        claimed_at = utc_now()
+        args = (kind, after_id, self.batch_size, claimed_at - timedelta(seconds=self.interval), claimed_at,
+                claimed_at + timedelta(seconds=self.claim_ttl))
+        return run_write_sync(claim_link_health_job, *args)
+
+    def _store(self, results: List[Tuple[str, int, int]]) -> None:
+        checked_at = utc_now()
+        run_write_sync(store_link_health_job, results, checked_at)
+        self.checked += len(results)
+        self.broken += sum(1 for kind, row_id, status in results if status == 0 or status >= 400)
+
+    async def _status(self, url: str) -> Optional[int]:
+        status = self._statuses.get(url)
+        if status is None:
+            status = await self._flight.run(url, self.verifier.status, url)
+            if status is not None:
+                self._statuses.set(url, status)
+        return status
+
+    async def _check(self, kind: str, url: str, ids: List[int]) -> List[Tuple[str, int, int]]:
+        status = await self._status(url)
+        # Неожиданную ошибку не записываем: останется статус прошлой проверки
+        if status is None:
+            return []
+        return [(kind, row_id, status) for row_id in ids]
+
+    async def sweep(self) -> int:
+        """Обход ссылок и доменов, которые пора проверить; возвращает число проверенных ссылок"""
+        # В работе не больше двух порций адресов: память не растет, а хвост медленных проверок
+        # одной порции перекрывается проверками следующей
+        window = asyncio.Semaphore(self.batch_size * 2)
+        pending = set()
+        results: List[Tuple[str, int, int]] = []
+        checked = 0
+
+        def collect(task: asyncio.Task) -> None:
+            pending.discard(task)
+            window.release()
+            if not task.cancelled():
+                results.extend(task.result())
+
+        try:
+            for kind in LINK_HEALTH_TARGETS:
+                after_id = 0
+                while True:
+                    last_id, rows = await asyncio.to_thread(self._claim, kind, after_id)
+                    if last_id is None:
+                        break
+                    after_id = last_id
+                    ids_by_url: dict = {}
+                    for row_id, url in rows:
+                        # Фрагмент (#...) на сервер не отправляется — такие адреса проверяются один раз
+                        ids_by_url.setdefault(url.partition("#")[0], []).append(row_id)
+                    for url, ids in ids_by_url.items():
+                        await window.acquire()
+                        task = asyncio.ensure_future(self._check(kind, url, ids))
+                        pending.add(task)
+                        task.add_done_callback(collect)
+                    if len(results) >= self.batch_size:
+                        done, results = results, []
+                        await asyncio.to_thread(self._store, done)
+                        checked += len(done)
+            if pending:
+                await asyncio.wait(pending)
+            if results:
+                await asyncio.to_thread(self._store, results)
+                checked += len(results)
+        finally:
+            for task in list(pending):
+                task.cancel()
+        self.sweeps += 1
+        return checked
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                checked = await self.sweep()
+                if checked:
+                    logger.info("Проверка ссылок завершена: %s ссылок за %.0f с",
+                                checked, time.monotonic() - started)
+            except Exception as e:
+                logger.error("Ошибка при проверке ссылок: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.verifier.close()
+
+
+link_health_checker = LinkHealthChecker(
+    verifier=UrlVerifier(
+        timeout=float(os.getenv("LINK_HEALTH_TIMEOUT", "10")),
+        max_concurrency=int(os.getenv("LINK_HEALTH_MAX_CONCURRENCY", "100")),
+        per_host_concurrency=int(os.getenv("LINK_HEALTH_PER_HOST_CONCURRENCY", "2")),
+        cache_ttl=float(os.getenv("LINK_HEALTH_HOST_FAILURE_TTL", "600")),
+        cache_size=int(os.getenv("LINK_HEALTH_CACHE_SIZE", "100000")),
+        allow_on_unexpected_error=False,
+        pool_shards=int(os.getenv("LINK_HEALTH_POOL_SHARDS", "16")),
+    ),
+    enabled=os.getenv("LINK_HEALTH", "false").lower() in ("1", "true", "yes"),
+    interval=float(os.getenv("LINK_HEALTH_INTERVAL", "86400")),
+    poll_interval=float(os.getenv("LINK_HEALTH_POLL_INTERVAL", "60")),
+    batch_size=int(os.getenv("LINK_HEALTH_BATCH", "1000")),
+    cache_size=int(os.getenv("LINK_HEALTH_CACHE_SIZE", "100000")),
+    cache_ttl=float(os.getenv("LINK_HEALTH_CACHE_TTL", "3600")),
+    claim_ttl=float(os.getenv("LINK_HEALTH_CLAIM_TTL", "900")),
+)
+
+cache_sync = CacheSync(
+    enabled=os.getenv("CACHE_SYNC", "true").lower() in ("1", "true", "yes"),
+    poll_interval=float(os.getenv("CACHE_SYNC_INTERVAL", "1")),
+    lookback=float(os.getenv("CACHE_SYNC_LOOKBACK", "10")),
+    retention=float(os.getenv("CACHE_SYNC_RETENTION", "3600")),
+)
+
+click_aggregator = ClickAggregator(
+    enabled=os.getenv("CLICK_TRACKING", "true").lower() in ("1", "true", "yes"),
+    bucket_seconds=int(os.getenv("CLICK_BUCKET_SECONDS", "3600")),
+    flush_interval=float(os.getenv("CLICK_FLUSH_INTERVAL", "10")),
+    flush_threshold=int(os.getenv("CLICK_FLUSH_THRESHOLD", "5000")),
+)
+
+# Константа для разрешенного домена
+ALLOWED_DOCS_DOMAIN = "services.investingindigital.com"
+
+app = FastAPI(
+    title="URL Shortener API",
+    redoc_url=None,  # Отключаем ReDoc полностью
+    docs_url="/docs",  # Swagger UI будет доступен по /docs
+    openapi_url="/api/openapi.json",
+    root_path=os.getenv("ROOT_PATH", ""),
+)
+
+
+# Middleware для проверки доступа к документации
+# Группы маршрутов для метрик: шаблон пути -> группа
+ROUTE_GROUPS = {
+    "/{short_code}": "redirect",
+    "/": "root-domain",
+    "/shorten": "shorten",
+    "/shorten/batch": "shorten",
+}
+
+DOCS_PATHS = {"/docs", "/docs/oauth2-redirect", "/api/openapi.json"}
+
+
+def route_group(scope: dict) -> str:
+    # Запросы, обработанные быстрым путем, помечают группу сами
+    group = scope.get("route_group")
+    if group is not None:
+        return group
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    return ROUTE_GROUPS.get(route.path, "admin")
+
+
+def request_host(scope: dict) -> str:
+    """Домен из заголовка Host без порта"""
+    for name, value in scope["headers"]:
+        if name == b"host":
+            return value.decode("latin-1").split(':')[0]
+    return ""
+
+
+_static_get_paths: Optional[set] = None
+
+
+def static_get_paths(fastapi_app: FastAPI) -> set:
+    """Статические GET-пути приложения, которые нельзя принимать за короткий код"""
+    global _static_get_paths
+    if _static_get_paths is None:
+        _static_get_paths = {
+            route.path for route in fastapi_app.routes
+            if "GET" in (getattr(route, "methods", None) or ()) and "{" not in route.path
+        }
+    return _static_get_paths
+
+
+# Прокси (адреса или подсети через запятую), которым доверяем заголовок X-Forwarded-For
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("TRUSTED_PROXIES", "").split(",") if network.strip()
+]
+
+
+@lru_cache(maxsize=4096)
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(scope: dict) -> str:
+    """
+    Адрес клиента. Если соединение пришло от доверенного прокси, берется самый правый
+    адрес X-Forwarded-For, не принадлежащий доверенным прокси: левее него клиент
+    может подставить что угодно
+    """
+    client = scope.get("client")
+    address = client[0] if client else ""
+    if not TRUSTED_PROXIES or not is_trusted_proxy(address):
+        return address
+    hops = []
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            hops.extend(hop.strip() for hop in value.decode("latin-1").split(","))
+    for hop in reversed(hops):
+        if hop and not is_trusted_proxy(hop):
+            return hop
+    return address
+
+
+class TokenBucketLimiter:
+    """
+    Корзины токенов по ключу: rate токенов в секунду, не больше burst.
+    Корзина, простоявшая burst / rate секунд, снова полна, поэтому такие корзины
+    удаляются без потери информации. Вызывается только из event loop, блокировки не нужны
+    """
+
+    def __init__(self, rate: float, burst: float, max_buckets: int):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.idle = self.burst / rate
+        self.max_buckets = max_buckets
+        self._buckets: dict = {}
+        self._next_sweep = 0.0
+        self.limited = 0
+
+    def acquire(self, key: str, now: float) -> float:
+        """0 — запрос разрешен, иначе через сколько секунд появится токен"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if now >= self._next_sweep or len(self._buckets) >= self.max_buckets:
+                self._sweep(now)
+            self._buckets[key] = [self.burst - 1, now]
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        self.limited += 1
+        return (1 - tokens) / self.rate
+
+    def _sweep(self, now: float) -> None:
+        horizon = now - self.idle
+        buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[1] >= horizon}
+        if len(buckets) >= self.max_buckets:
+            # Все корзины активны: отбрасываем старшую половину, они начнут с полного запаса
+            buckets = dict(list(buckets.items())[len(buckets) // 2:])
+        self._buckets = buckets
+        self._next_sweep = now + max(self.idle, 1.0)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def parse_rate_limit(value: str) -> Optional[Tuple[float, float]]:
+    """'rate,burst' -> (rate, burst); пустое значение или 0 отключают лимит"""
+    if not value.strip():
+        return None
+    rate, _, burst = value.partition(",")
+    rate = float(rate)
+    if rate <= 0:
+        return None
+    return rate, float(burst) if burst.strip() else rate
+
+
+class RateLimiter:
+    """
+    Лимиты по группам маршрутов (redirect, create, admin) отдельно для IP клиента
+    и для API-ключа. Каждый запрос проверяется по одной корзине: запрос с известным ключом —
+    по корзине ключа (лимиты по IP рассчитаны на анонимных клиентов), остальные и группы
+    без лимита по ключу — по корзине IP. Отклоненный запрос токен не расходует
+    """
+
+    # Значения по умолчанию: "токенов в секунду,размер корзины"
+    DEFAULTS = {
+        ("redirect", "ip"): "50,100",
+        ("create", "ip"): "5,20",
+        ("admin", "ip"): "10,30",
+        ("redirect", "key"): "",
+        ("create", "key"): "50,200",
+        ("admin", "key"): "50,200",
+    }
+
+    def __init__(self, enabled: bool, max_buckets: int):
+        self.enabled = enabled
+        self.limiters = {}
+        for (group, scope_name), default in self.DEFAULTS.items():
+            prefix = "RATE_LIMIT_KEY_" if scope_name == "key" else "RATE_LIMIT_"
+            limit = parse_rate_limit(os.getenv(prefix + group.upper(), default))
+            if limit is not None:
+                self.limiters[(group, scope_name)] = TokenBucketLimiter(*limit, max_buckets=max_buckets)
+
+    def check(self, group: str, ip: str, key: Optional[str]) -> float:
+        """0 — запрос разрешен, иначе рекомендуемая пауза в секундах"""
+        limiter = self.limiters.get((group, "key")) if key is not None else None
+        if limiter is not None:
+            return limiter.acquire(key, time.monotonic())
+        limiter = self.limiters.get((group, "ip"))
+        if limiter is not None:
+            return limiter.acquire(ip, time.monotonic())
+        return 0.0
+
+    def stats(self):
+        for (group, scope_name), limiter in self.limiters.items():
+            yield (group, scope_name, "limited"), limiter.limited
+            yield (group, scope_name, "buckets"), len(limiter)
+
+
+rate_limiter = RateLimiter(
+    enabled=os.getenv("RATE_LIMIT", "false").lower() in ("1", "true", "yes"),
+    max_buckets=int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000")),
+)
+metrics.register(Gauge(
+    "shortener_rate_limit", "Rate-limited requests and live token buckets", ("group", "scope", "value"),
+    callback=rate_limiter.stats))
+
+
+class RateLimitMiddleware:
+    """
+    Чистый ASGI middleware ограничения частоты запросов. Стоит до быстрого пути
+    редиректов, поэтому лишние запросы отклоняются до кэша и БД
+    """
+
+    def __init__(self, app, fastapi_app: FastAPI):
+        self.app = app
+        self.fastapi_app = fastapi_app
+        self.api_key_header = API_KEY_NAME.lower().encode("latin-1")
+        # В памяти храним не сами ключи, а имя их уровня доступа
+        self.known_keys = {key: name for key, name in ((API_KEY, "full"), (CREATE_ONLY_API_KEY, "create-only")) if key}
+
+    def group(self, scope: dict) -> str:
+        method, path = scope["method"], scope["path"]
+        if method == "POST" and path in ("/shorten", "/shorten/batch"):
+            return "create"
+        if method in ("GET", "HEAD") and (
+                path == "/" or ("/" not in path[1:] and path not in static_get_paths(self.fastapi_app))):
+            return "redirect"
+        return "admin"
+
+    def api_key(self, scope: dict) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == self.api_key_header:
+                # Неизвестные ключи не получают своих корзин, иначе их перебор обходит лимит по IP
+                return self.known_keys.get(value.decode("latin-1"))
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = rate_limiter.check(self.group(scope), client_ip(scope), self.api_key(scope))
+        if retry_after:
+            scope["route_group"] = "rate-limited"
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Too many requests"},
+                headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# Код редиректа для ссылок и доменов без собственного redirect_status
+REDIRECT_DEFAULT_STATUS = int(os.getenv("REDIRECT_DEFAULT_STATUS", "302"))
+if REDIRECT_DEFAULT_STATUS not in (301, 302, 307, 308):
+    raise ValueError("REDIRECT_DEFAULT_STATUS must be one of 301, 302, 307, 308")
+# Сколько секунд браузеры (max-age) и CDN (s-maxage, пусто — как max-age) могут кэшировать редирект.
+# Это же верхняя граница того, сколько отключенная ссылка еще может открываться из кэшей
+REDIRECT_PERMANENT_MAX_AGE = int(os.getenv("REDIRECT_PERMANENT_MAX_AGE", "86400"))
+REDIRECT_TEMPORARY_MAX_AGE = int(os.getenv("REDIRECT_TEMPORARY_MAX_AGE", "0"))
+REDIRECT_SHARED_MAX_AGE = os.getenv("REDIRECT_SHARED_MAX_AGE", "")
+
+
+def redirect_cache_control(status: int) -> str:
+    max_age = REDIRECT_PERMANENT_MAX_AGE if status in PERMANENT_REDIRECT_STATUSES else REDIRECT_TEMPORARY_MAX_AGE
+    if max_age <= 0 and not REDIRECT_SHARED_MAX_AGE:
+        return "no-cache"
+    # Без явного max-age постоянный редирект браузер хранит сколько угодно
+    value = f"public, max-age={max(max_age, 0)}"
+    if REDIRECT_SHARED_MAX_AGE:
+        value += f", s-maxage={int(REDIRECT_SHARED_MAX_AGE)}"
+    return value
+
+
+REDIRECT_CACHE_CONTROL = {status: redirect_cache_control(status) for status in (301, 302, 307, 308)}
+
+
+def redirect_response(url: str, status: Optional[int]) -> RedirectResponse:
+    status = status or REDIRECT_DEFAULT_STATUS
+    return RedirectResponse(url=url, status_code=status, headers={"Cache-Control": REDIRECT_CACHE_CONTROL[status]})
+
+
+async def fetch_short_code(db: AsyncSession,
+                           short_code: str) -> Optional[Tuple[str, bool, Optional[float], Optional[int]]]:
+    row = (await db.execute(
+        select(URL.original_url, URL.is_active, URL.expires_at, URL.redirect_status)
+        .where(URL.short_code == short_code)
+    )).first()
+    if row is None:
+        return None
+    return row.original_url, row.is_active, utc_timestamp(row.expires_at), row.redirect_status
+
+
+async def resolve_short_code(short_code: str) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    Возвращает (целевой URL, код редиректа или None — по умолчанию) активной ссылки
+    через таблицу редиректов и кэш, или None
+    """
+    if not short_code_filter.might_exist(short_code):
+        return None
+
+    target = redirect_table.get(short_code)
+    if target is not None:
+        return target
+
+    cached = url_cache.get(short_code)
+    if cached is None:
+        # Промах на реплике перепроверяется на основной БД: ссылка могла быть только что создана
+        cached = await read_replicas.run(
+            fetch_short_code, short_code, kind="url", key=short_code, primary_on_none=True)
+        if cached is None:
+            return None
+        url_cache.set(short_code, cached)
+
+    original_url, is_active, expires_at, redirect_status = cached
+    if not is_active or (expires_at is not None and expires_at <= time.time()):
+        return None
+    return original_url, redirect_status
+
+
+class DocsAccessMiddleware:
+    """
+    Чистый ASGI middleware: закрывает документацию для посторонних доменов,
+    собирает метрики запросов и выборочно логирует их.
+    В отличие от @app.middleware("http") не создает отдельную задачу и не буферизует ответ.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        path = scope["path"]
+        sampled = log_sampled()
+        if sampled:
+            logger.info("Request to %s.", path)
+
+        if path in DOCS_PATHS and request_host(scope) != ALLOWED_DOCS_DOMAIN:
+            response = JSONResponse(
+                status_code=403,
+                content={"detail": "Access to API documentation is not allowed from this domain"}
+            )
+            await response(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            group = route_group(scope)
+            http_request_duration.observe(time.perf_counter() - started, group)
+            http_requests_total.inc(group, scope["method"], str(status))
+
+        if sampled:
+            logger.info("Completed request to %s.", path)
+
+
+class RedirectFastPathMiddleware:
+    """
+    Обрабатывает GET и HEAD /{short_code} и редиректы с корня домена до маршрутизации FastAPI,
+    CORS и разрешения зависимостей. Все остальное, а также промахи по корню домена
+    и CORS-запросы (с заголовком Origin), передаются приложению целиком.
+    HEAD отвечает теми же заголовками (тело отбрасывает сервер) и не считается переходом.
+    """
+
+    def __init__(self, app, fastapi_app: FastAPI):
+        self.app = app
+        self.fastapi_app = fastapi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") or \
+                any(name == b"origin" for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path == "/":
+            host = request_host(scope)
+            route = domain_routes.get(host)
+            if route is None:
+                await self.app(scope, receive, send)
+                return
+            scope["route_group"] = "root-domain"
+            if scope["method"] == "GET":
+                click_aggregator.record("domain", host)
+            await redirect_response(*route)(scope, receive, send)
+            return
+
+        short_code = path[1:]
+        if not short_code or "/" in short_code or path in static_get_paths(self.fastapi_app):
+            await self.app(scope, receive, send)
+            return
+
+        scope["route_group"] = "redirect"
+        target = await resolve_short_code(short_code)
+        if target is None:
+            response = JSONResponse(status_code=404, content={"detail": "URL not found"})
+        else:
+            if scope["method"] == "GET":
+                click_aggregator.record("url", short_code)
+            response = redirect_response(*target)
+        await response(scope, receive, send)
+
+
+# Настройка CORS
+from fastapi.middleware.cors import CORSMiddleware
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=os.getenv("ALLOWED_ORIGINS", "*").split(","),
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Middleware, добавленный позже, выполняется раньше: сначала проверка документации
+# и метрики, затем ограничение частоты, быстрый путь редиректов, и только потом CORS и FastAPI
+if os.getenv("REDIRECT_FAST_PATH", "true").lower() in ("1", "true", "yes"):
+    app.add_middleware(RedirectFastPathMiddleware, fastapi_app=app)
+if rate_limiter.enabled and rate_limiter.limiters:
+    app.add_middleware(RateLimitMiddleware, fastapi_app=app)
+app.add_middleware(DocsAccessMiddleware)
+
+# Константа для разрешенного домена
+ALLOWED_DOMAIN = "services.investingindigital.com"
+
+
+# Таблицы создаются при запуске, а не при импорте: alembic/env.py импортирует модели приложения
+@app.on_event("startup")
+def ensure_tables():
+    create_tables()
+
+
+@app.on_event("startup")
+def load_domain_routes():
+    db = SessionLocal()
+    try:
+        domain_routes.load(db)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def start_db_writer():
+    if db_writer is not None:
+        db_writer.start()
+
+
+@app.on_event("shutdown")
+def stop_db_writer():
+    if db_writer is not None:
+        db_writer.stop()
+
+
+@app.on_event("startup")
+async def start_cache_sync():
+    cache_sync.start()
+
+
+@app.on_event("shutdown")
+async def stop_cache_sync():
+    await cache_sync.stop()
+
+
+async def maintain_redirect_table() -> None:
+    """Периодически подхватывает новый файл таблицы и при необходимости пересобирает его"""
+    last_build_check = 0.0
+    while True:
+        try:
+            if REDIRECT_TABLE_REBUILD_INTERVAL > 0 and \
+                    time.monotonic() - last_build_check >= REDIRECT_TABLE_REBUILD_INTERVAL:
+                last_build_check = time.monotonic()
+                await asyncio.to_thread(redirect_table.try_compile, REDIRECT_TABLE_REBUILD_INTERVAL)
+            redirect_table.reload()
+        except Exception as e:
+            logger.error("Ошибка при обновлении таблицы редиректов: %s", e)
+        await asyncio.sleep(REDIRECT_TABLE_RELOAD_INTERVAL)
+
+
+redirect_table_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_redirect_table():
+    global redirect_table_task
+    if redirect_table.enabled:
+        redirect_table_task = asyncio.create_task(maintain_redirect_table())
+
+
+@app.on_event("shutdown")
+async def stop_redirect_table():
+    global redirect_table_task
+    if redirect_table_task is not None:
+        redirect_table_task.cancel()
+        try:
+            await redirect_table_task
+        except asyncio.CancelledError:
+            pass
+        redirect_table_task = None
+    redirect_table.close()
+
+
+@app.on_event("startup")
+async def start_short_code_filter():
+    short_code_filter.start()
+
+
+@app.on_event("shutdown")
+async def stop_short_code_filter():
+    await short_code_filter.stop()
+
+
+@app.on_event("startup")
+async def start_link_sweeper():
+    link_sweeper.start()
+
+
+@app.on_event("shutdown")
+async def stop_link_sweeper():
+    await link_sweeper.stop()
+
+
+@app.on_event("startup")
+async def start_link_health_checker():
+    link_health_checker.start()
+
+
+@app.on_event("shutdown")
+async def stop_link_health_checker():
+    await link_health_checker.stop()
+
+
+@app.on_event("startup")
+async def start_click_aggregator():
+    click_aggregator.start()
+
+
+@app.on_event("shutdown")
+async def stop_click_aggregator():
+    await click_aggregator.stop()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_engine.dispose()
+    await read_replicas.dispose()
+
+
+@app.on_event("shutdown")
+async def close_url_verifier():
+    await url_verifier.close()
+
+
+@app.api_route("/", methods=["GET", "HEAD"])
+async def root(request: Request):
+    # Получаем домен из заголовка Host
+    host = request.headers.get('host', '').split(':')[0]
+
+    # Ищем домен в таблице маршрутизации, загруженной из БД при старте
+    route = domain_routes.get(host)
+
+    # Если домен найден, делаем редирект
+    if route:
+        if request.method == "GET":
+            click_aggregator.record("domain", host)
+        return redirect_response(*route)
+
+    # Если домен не найден, показываем приветственное сообщение
+    return {"message": "Welcome to URL Shortener API"}
+
+
+async def fetch_active_domains(db: AsyncSession) -> List[Domain]:
+    return (await db.execute(select(Domain).where(Domain.is_active == True))).scalars().all()
 
 
 @app.get("/domains", response_model=List[DomainResponse])
 async def list_domains(
         request: Request,
-        db: Session = Depends(get_db),
         authenticated: bool = Depends(verify_api_key)
 ):
     # Получаем домен из заголовка Host
@@ -293,16 +3040,10 @@ async def list_domains(
             detail="Access to domains list is not allowed from this domain"
         )
 
-    domains = db.query(Domain).filter(Domain.is_active == True).all()
-    return domains
+    return await read_replicas.run(fetch_active_domains, kind="domain")
 
 
-@app.post("/domains", response_model=DomainResponse)
-async def create_domain(
-        domain: DomainCreate,
-        db: Session = Depends(get_db),
-        authenticated: bool = Depends(verify_api_key)
-):
+def create_domain_job(db: Session, domain: DomainCreate) -> DomainResponse:
     # Проверяем, существует ли уже такой домен
     existing_domain = db.query(Domain).filter(Domain.domain == domain.domain).first()
     if existing_domain:
@@ -315,16 +3056,19 @@ async def create_domain(
     db_domain = Domain(
         domain=domain.domain,
         redirect_url=str(domain.redirect_url),
-        created_at=datetime.utcnow().isoformat(),
-        is_active=True
+        created_at=utc_now(),
+        is_active=True,
+        redirect_status=domain.redirect_status
     )
 
     try:
         db.add(db_domain)
+        cache_sync.publish(db, "domain", db_domain.domain)
         db.commit()
         db.refresh(db_domain)
+        domain_routes.apply(db_domain)
     except Exception as e:
-        logger.error(f"Database error: {str(e)}")
+        logger.error("Database error: %s", e)
         db.rollback()
         raise HTTPException(
             status_code=500,
@@ -336,54 +3080,150 @@ async def create_domain(
         domain=db_domain.domain,
         redirect_url=db_domain.redirect_url,
         created_at=db_domain.created_at,
-        is_active=db_domain.is_active
+        is_active=db_domain.is_active,
+        redirect_status=db_domain.redirect_status
     )
 
 
-@app.delete("/domains/{domain_id}")
-async def delete_domain(
-        domain_id: int,
+@app.post("/domains", response_model=DomainResponse)
+async def create_domain(
+        domain: DomainCreate,
         db: Session = Depends(get_db),
         authenticated: bool = Depends(verify_api_key)
 ):
+    return await run_write(db, create_domain_job, domain)
+
+
+def delete_domain_by_id_job(db: Session, domain_id: int) -> dict:
     domain = db.query(Domain).filter(Domain.id == domain_id).first()
     if not domain:
         raise HTTPException(status_code=404, detail="Domain not found")
 
     domain.is_active = False
+    cache_sync.publish(db, "domain", domain.domain)
     db.commit()
+    domain_routes.remove(domain.domain)
     return {"status": "success"}
 
 
-@app.delete("/domains/{domain}", response_model=DomainResponse)
+@app.delete("/domains/{domain_id}")
 async def delete_domain(
-        domain: str,
-        api_key: str = Security(api_key_header),
-        db: Session = Depends(get_db)
+        domain_id: int,
+        db: Session = Depends(get_db),
+        authenticated: bool = Depends(verify_api_key)
 ):
-    verify_api_key(api_key)
+    return await run_write(db, delete_domain_by_id_job, domain_id)
 
+
+def delete_domain_by_name_job(db: Session, domain: str) -> DomainResponse:
     # Проверяем существование домена
     domain_record = db.query(Domain).filter(Domain.domain == domain).first()
     if not domain_record:
         raise HTTPException(status_code=404, detail="Domain not found")
 
+    # Ответ собираем до удаления: после фиксации объект уже нельзя прочитать
+    response = DomainResponse(
+        id=domain_record.id,
+        domain=domain_record.domain,
+        redirect_url=domain_record.redirect_url,
+        created_at=domain_record.created_at,
+        is_active=domain_record.is_active,
+        redirect_status=domain_record.redirect_status
+    )
+
     # Удаляем домен
     db.delete(domain_record)
+    cache_sync.publish(db, "domain", domain)
     db.commit()
+    domain_routes.remove(domain)
 
-    return domain_record
+    return response
 
 
-@app.post("/shorten", response_model=URLResponse)
-async def create_short_url(
-        url: URLCreate,
-        db: Session = Depends(get_db),
-        authenticated: bool = Depends(
-            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=False))
+@app.delete("/domains/{domain}", response_model=DomainResponse)
+async def delete_domain(
+        domain: str,
+        api_key: str = Security(api_key_header),
+        db: Session = Depends(get_db)
 ):
+    verify_api_key(api_key)
+    return await run_write(db, delete_domain_by_name_job, domain)
+
+
+def live_url_response(url: URLCreate, row) -> URLResponse:
+    return URLResponse(
+        target_url=url.target_url,
+        short_code=row.short_code,
+        created_at=row.created_at,
+        is_active=row.is_active,
+        expires_at=row.expires_at,
+        redirect_status=row.redirect_status
+    )
+
+
+def insert_or_get_live_url(db: Session, url: URLCreate, original_url: str, url_hash: bytes) -> Optional[URLResponse]:
+    """
+    Основной путь /shorten без пользовательского кода. Действующая ссылка на тот же URL
+    находится одним SELECT по url_hash — без выделения кода и без записи. Иначе новая ссылка
+    вставляется INSERT ... ON CONFLICT (url_hash) DO NOTHING RETURNING: одновременные запросы
+    с одним URL не падают на IntegrityError — проигравший перечитывает строку победителя.
+    Возвращает None, если по хешу лежит неактивная, истекшая или чужая (коллизия хеша) ссылка:
+    такие случаи разбирает полный путь create_short_url_job
+    """
+    def find_live():
+        row = db.execute(
+            select(URL.original_url, URL.short_code, URL.created_at, URL.is_active, URL.expires_at,
+                   URL.redirect_status)
+            .where(URL.url_hash == url_hash)
+        ).first()
+        if row is None:
+            return None
+        if (row.original_url != original_url or not row.is_active
+                or (row.expires_at is not None and row.expires_at <= utc_now())):
+            return False
+        return row
+
+    row = find_live()
+    if row is False:
+        return None
+    if row is not None:
+        return live_url_response(url, row)
+
+    for attempt in range(CODE_INSERT_ATTEMPTS):
+        short_code = code_allocator.allocate(db)
+        statement = dialect_insert(engine)(URL).values(
+            original_url=original_url,
+            url_hash=url_hash,
+            short_code=short_code,
+            created_at=utc_now(),
+            is_active=True,
+            expires_at=to_utc(url.expires_at),
+            redirect_status=url.redirect_status
+        ).on_conflict_do_nothing(
+            index_elements=[URL.url_hash]
+        ).returning(URL.short_code, URL.created_at, URL.is_active, URL.expires_at, URL.redirect_status)
+        short_code_filter.add(short_code)
+        try:
+            row = db.execute(statement).first()
+            db.commit()
+        except IntegrityError as db_error:
+            db.rollback()
+            # Совпадение хеша обрабатывает ON CONFLICT — значит, код занят старой или пользовательской ссылкой
+            logger.warning("Выданный код %s уже занят, берем следующий: %s", short_code, db_error)
+            code_allocator.retries += 1
+            continue
+        if row is not None:
+            return live_url_response(url, row)
+        # Тот же URL успел вставить параллельный запрос
+        code_allocator.release(short_code)
+        row = find_live()
+        return live_url_response(url, row) if row else None
+    raise HTTPException(status_code=500, detail="Не удалось выделить свободный короткий код")
+
+
+def create_short_url_job(db: Session, url: URLCreate) -> URLResponse:
     try:
-        logger.info(f"Получен запрос на сокращение URL: {url.target_url}")
+        logger.debug("Получен запрос на сокращение URL: %s", url.target_url)
 
         # Проверяем длину URL и обрезаем если необходимо
         original_url_str = str(url.target_url)
@@ -391,38 +3231,59 @@ async def create_short_url(
 
         if len(original_url_str) > max_url_length:
             logger.warning(
-                f"Длина URL превышает {max_url_length} символов (фактическая длина: {len(original_url_str)}). URL будет обрезан.")
+                "Длина URL превышает %s символов (фактическая длина: %s). URL будет обрезан.",
+                max_url_length, len(original_url_str))
             original_url_str = original_url_str[:max_url_length]
 
         # Создаем хеш URL
         url_hash = get_url_hash(original_url_str)
-        logger.info(f"Создан хеш: {url_hash}")
+        logger.debug("Создан хеш: %s", url_hash.hex())
+
+        if url.custom_code is None:
+            created = insert_or_get_live_url(db, url, original_url_str, url_hash)
+            if created is not None:
+                return created
 
         # Проверяем, существует ли уже активный URL с таким хешем
         existing_url = db.query(URL).filter(
             URL.url_hash == url_hash
         ).first()
 
+        # Хеш совпал с другим URL — не возвращаем чужой код
+        if existing_url and existing_url.original_url != original_url_str:
+            logger.error("Коллизия хеша %s для URL %s", url_hash.hex(), original_url_str)
+            raise HTTPException(status_code=409, detail="URL hash collision, the URL cannot be shortened")
+
         if existing_url:
-            logger.info(
-                f"Найдена существующая ссылка с хешем {url_hash}, код: {existing_url.short_code}, активна: {existing_url.is_active}")
+            logger.debug(
+                "Найдена существующая ссылка с хешем %s, код: %s, активна: %s",
+                url_hash.hex(), existing_url.short_code, existing_url.is_active)
 
-            # Если ссылка неактивна, активируем её
-            if not existing_url.is_active:
-                logger.info(f"Активируем неактивную ссылку")
+            # Если ссылка неактивна или истекла, активируем её с запрошенным сроком действия.
+            # Срок действующей ссылки не меняем: ее код могли получить и другие клиенты
+            expired = existing_url.expires_at is not None and existing_url.expires_at <= utc_now()
+            if not existing_url.is_active or expired:
+                logger.debug("Активируем неактивную ссылку")
                 existing_url.is_active = True
+                existing_url.expires_at = to_utc(url.expires_at)
+                existing_url.redirect_status = url.redirect_status
+                existing_url.deactivated_at = None
+                cache_sync.publish(db, "url", existing_url.short_code)
                 db.commit()
                 db.refresh(existing_url)
+                url_cache.invalidate(existing_url.short_code)
 
             return URLResponse(
                 target_url=url.target_url,
                 short_code=existing_url.short_code,
                 created_at=existing_url.created_at,
-                is_active=existing_url.is_active
+                is_active=existing_url.is_active,
+                expires_at=existing_url.expires_at,
+                redirect_status=existing_url.redirect_status
             )
 
         if url.custom_code:
-            logger.info(f"Запрошен пользовательский код: {url.custom_code}")
+            logger.debug("Запрошен пользовательский код: %s", url.custom_code)
             # Проверяем, не занят ли запрошенный код активной ссылкой
             existing_code = db.query(URL).filter(
                 URL.short_code == url.custom_code,
@@ -430,7 +3291,7 @@ async def create_short_url(
             ).first()
 
             if existing_code:
-                logger.warning(f"Пользовательский код {url.custom_code} уже занят активной ссылкой")
+                logger.warning("Пользовательский код %s уже занят активной ссылкой", url.custom_code)
                 raise HTTPException(
                     status_code=400,
                     detail="This custom code is already taken by an active URL"
@@ -443,67 +3304,66 @@ async def create_short_url(
             ).first()
 
             if inactive_code:
-                logger.info(f"Найдена неактивная ссылка с кодом {url.custom_code}, удаляем её")
+                logger.info("Найдена неактивная ссылка с кодом %s, удаляем её", url.custom_code)
                 db.delete(inactive_code)
+                cache_sync.publish(db, "url", url.custom_code)
                 db.commit()
+                url_cache.invalidate(url.custom_code)
 
             short_code = url.custom_code
         else:
-            logger.info("Генерируем случайный код")
-            # Генерируем уникальный код
-            while True:
-                short_code = create_random_code()
-                logger.debug(f"Сгенерирован код: {short_code}")
-                # Проверяем, не существует ли уже активный код
-                exists = db.query(URL).filter(
-                    URL.short_code == short_code,
-                    URL.is_active == True
-                ).first()
-                if not exists:
-                    # Если код занят неактивной ссылкой, удаляем её
-                    inactive_code = db.query(URL).filter(
-                        URL.short_code == short_code,
-                        URL.is_active == False
-                    ).first()
-                    if inactive_code:
-                        logger.info(f"Найдена неактивная ссылка с кодом {short_code}, удаляем её")
-                        db.delete(inactive_code)
-                        db.commit()
-                    break
+            short_code = None
 
-        logger.info(f"Создаем новую запись в БД с кодом {short_code}")
+        logger.debug("Создаем новую запись в БД с кодом %s", short_code)
         # Создаем новую запись в БД
-        try:
-            db_url = URL(
-                original_url=original_url_str,  # Используем обрезанный URL если необходимо
-                url_hash=url_hash,
-                short_code=short_code,
-                created_at=datetime.now().isoformat(),
-                is_active=True
-            )
-            db.add(db_url)
-            db.commit()
-            db.refresh(db_url)
-            logger.info(f"Запись успешно создана в БД")
-        except IntegrityError as db_error:
-            db.rollback()
-            logger.error(f"Ошибка уникальности при создании short_code или url_hash: {str(db_error)}")
-            raise HTTPException(status_code=400, detail="Короткий код уже существует или этот URL уже добавлен ранее")
-        except Exception as db_error:
-            logger.error(f"Ошибка при работе с БД: {str(db_error)}")
-            db.rollback()
-            raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(db_error)}")
+        for attempt in range(CODE_INSERT_ATTEMPTS):
+            if url.custom_code is None:
+                short_code = code_allocator.allocate(db)
+            try:
+                db_url = URL(
+                    original_url=original_url_str,  # Используем обрезанный URL если необходимо
+                    url_hash=url_hash,
+                    short_code=short_code,
+                    created_at=utc_now(),
+                    is_active=True,
+                    expires_at=to_utc(url.expires_at),
+                    redirect_status=url.redirect_status
+                )
+                db.add(db_url)
+                short_code_filter.add(short_code)
+                db.commit()
+                db.refresh(db_url)
+                logger.debug("Запись успешно создана в БД")
+                break
+            except IntegrityError as db_error:
+                db.rollback()
+                logger.error("Ошибка уникальности при создании short_code или url_hash: %s", db_error)
+                # Выданный код уже занят старой или пользовательской ссылкой — берем следующий
+                code_taken = db.query(URL.id).filter(URL.short_code == short_code).first() is not None
+                hash_taken = db.query(URL.id).filter(URL.url_hash == url_hash).first() is not None
+                if url.custom_code is None and code_taken and not hash_taken:
+                    code_allocator.retries += 1
+                    continue
+                raise HTTPException(status_code=400, detail="Короткий код уже существует или этот URL уже добавлен ранее")
+            except Exception as db_error:
+                logger.error("Ошибка при работе с БД: %s", db_error)
+                db.rollback()
+                raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(db_error)}")
+        else:
+            raise HTTPException(status_code=500, detail="Не удалось выделить свободный короткий код")
 
         return URLResponse(
             target_url=url.target_url,  # Возвращаем исходный URL
             short_code=short_code,
             created_at=db_url.created_at,
-            is_active=db_url.is_active
+            is_active=db_url.is_active,
+            expires_at=db_url.expires_at,
+            redirect_status=db_url.redirect_status
         )
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.error(f"Ошибка при обработке URL {url.target_url}: {str(e)}")
+        logger.error("Ошибка при обработке URL %s: %s", url.target_url, e)
         # Перехватываем все исключения и возвращаем более информативную ошибку
         raise HTTPException(
             status_code=500,
@@ -511,13 +3371,732 @@ async def create_short_url(
         )
 
 
-@app.get("/{short_code}")
-async def redirect_to_url(short_code: str, db: Session = Depends(get_db)):
-    db_url = db.query(URL).filter(URL.short_code == short_code).first()
-    if db_url is None or not db_url.is_active:
+shorten_single_flight = SingleFlight()
+
+
+@app.post("/shorten", response_model=URLResponse)
+async def create_short_url(
+        url: URLCreate,
+        authenticated: bool = Depends(
+            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=False))
+):
+    # Одинаковые одновременные запросы выполняются один раз и получают один код
+    key = (str(url.target_url), url.custom_code, url.expires_at, url.redirect_status)
+    return await shorten_single_flight.run(key, run_write_in_session, create_short_url_job, url)
+
+
+# Максимальное количество URL в одном пакетном запросе
+SHORTEN_BATCH_MAX = int(os.getenv("SHORTEN_BATCH_MAX", "10000"))
+
+
+def create_short_urls_batch_job(db: Session, urls: List[URLCreate]) -> List[URLBatchResult]:
+    max_url_length = 2048
+    results = [URLBatchResult(index=i, target_url=str(item.target_url)) for i, item in enumerate(urls)]
+    original_urls = [str(item.target_url)[:max_url_length] for item in urls]
+    hashes = [get_url_hash(u) for u in original_urls]
+
+    # Все существующие записи по хешам — одним запросом на порцию
+    existing = {}
+    for part in chunked(list(set(hashes)), BATCH_QUERY_CHUNK):
+        for row in db.execute(
+                select(URL.url_hash, URL.original_url, URL.short_code, URL.created_at, URL.is_active, URL.expires_at,
+                       URL.redirect_status)
+                .where(URL.url_hash.in_(part))
+        ):
+            existing[row.url_hash] = row
+
+    # Хеш совпал, а URL другой — такие элементы отклоняем, чтобы не вернуть чужой код
+    collisions = {
+        url_hash for url_hash, original_url in zip(hashes, original_urls)
+        if url_hash in existing and existing[url_hash].original_url != original_url
+    }
+
+    # Неактивные и истекшие найденные ссылки активируем, как и в /shorten, с запрошенными
+    # сроком действия и кодом редиректа: одним UPDATE на каждое встречающееся сочетание.
+    # Повторы одного URL в пакете получают ту же ссылку, что и первый элемент, с его параметрами
+    now = utc_now()
+    expiry_by_hash = {}
+    status_by_hash = {}
+    for item, url_hash in zip(urls, hashes):
+        if url_hash not in expiry_by_hash:
+            expiry_by_hash[url_hash] = to_utc(item.expires_at)
+            status_by_hash[url_hash] = item.redirect_status
+    reactivate_by_values = {}
+    for url_hash, row in existing.items():
+        expired = row.expires_at is not None and row.expires_at <= now
+        if (not row.is_active or expired) and url_hash not in collisions:
+            values = (expiry_by_hash[url_hash], status_by_hash[url_hash])
+            reactivate_by_values.setdefault(values, []).append(row.short_code)
+    reactivate = [code for codes in reactivate_by_values.values() for code in codes]
+
+    def apply_reactivation():
+        for (expires_at, redirect_status), codes in reactivate_by_values.items():
+            for part in chunked(codes, BATCH_QUERY_CHUNK):
+                db.execute(update(URL).where(URL.short_code.in_(part)).values(
+                    is_active=True, expires_at=expires_at, redirect_status=redirect_status, deactivated_at=None))
+
+    apply_reactivation()
+
+    # Проверяем пользовательские коды одним запросом
+    custom_codes = {item.custom_code for item, h in zip(urls, hashes) if item.custom_code and h not in existing}
+    taken_codes = {}
+    for part in chunked(list(custom_codes), BATCH_QUERY_CHUNK):
+        for row in db.execute(select(URL.short_code, URL.is_active).where(URL.short_code.in_(part))):
+            taken_codes[row.short_code] = row.is_active
+
+    # Пользовательские коды, занятые неактивными ссылками, освобождаем
+    freed = [code for code, is_active in taken_codes.items() if not is_active]
+    for part in chunked(freed, BATCH_QUERY_CHUNK):
+        db.execute(delete(URL).where(URL.short_code.in_(part), URL.is_active == False))
+
+    new_rows = {}  # url_hash -> строка для вставки
+    pending = []  # (индекс, url_hash) для элементов без готового кода
+    used_codes = set(code for code, is_active in taken_codes.items() if is_active)
+    created_at = utc_now()
+
+    for i, (item, url_hash) in enumerate(zip(urls, hashes)):
+        result = results[i]
+        if url_hash in collisions:
+            result.error = "URL hash collision, the URL cannot be shortened"
+            continue
+        if url_hash in existing:
+            row = existing[url_hash]
+            result.short_code = row.short_code
+            result.created_at = row.created_at
+            result.is_active = True
+            reactivated = row.short_code in reactivate
+            result.expires_at = expiry_by_hash[url_hash] if reactivated else row.expires_at
+            result.redirect_status = status_by_hash[url_hash] if reactivated else row.redirect_status
+            continue
+        if url_hash in new_rows:
+            # Дубликат внутри пакета получает тот же код
+            pending.append((i, url_hash))
+            continue
+        if item.custom_code:
+            if item.custom_code in used_codes:
+                result.error = "This custom code is already taken by an active URL"
+                continue
+            used_codes.add(item.custom_code)
+            new_rows[url_hash] = {
+                "original_url": original_urls[i],
+                "url_hash": url_hash,
+                "short_code": item.custom_code,
+                "created_at": created_at,
+                "is_active": True,
+                "expires_at": expiry_by_hash[url_hash],
+                "redirect_status": status_by_hash[url_hash],
+            }
+        else:
+            new_rows[url_hash] = {
+                "original_url": original_urls[i],
+                "url_hash": url_hash,
+                "short_code": None,
+                "created_at": created_at,
+                "is_active": True,
+                "expires_at": expiry_by_hash[url_hash],
+                "redirect_status": status_by_hash[url_hash],
+            }
+        pending.append((i, url_hash))
+
+    # Коды для новых ссылок выделяем пачкой, без проверочных запросов
+    need_code = [row for row in new_rows.values() if row["short_code"] is None]
+    if need_code:
+        for row, code in zip(need_code, code_allocator.allocate_many(db, len(need_code))):
+            row["short_code"] = code
+
+    failed = set()
+    adopted = {}  # url_hash -> действующая ссылка, которую параллельный запрос создал раньше нас
+    short_code_filter.add(*(row["short_code"] for row in new_rows.values()))
+    try:
+        if new_rows:
+            db.execute(insert(URL), list(new_rows.values()))
+        cache_sync.publish(db, "url", *reactivate, *freed)
+        db.commit()
+    except IntegrityError:
+        # Гонка с параллельными запросами: повторяем вставку поштучно в savepoint'ах
+        db.rollback()
+        logger.warning("Конфликт уникальности при пакетной вставке, переходим к поштучной вставке")
+        apply_reactivation()
+        for part in chunked(freed, BATCH_QUERY_CHUNK):
+            db.execute(delete(URL).where(URL.short_code.in_(part), URL.is_active == False))
+        for url_hash, row in new_rows.items():
+            for attempt in range(CODE_INSERT_ATTEMPTS):
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(URL), [row])
+                    break
+                except IntegrityError:
+                    live = db.execute(
+                        select(URL.original_url, URL.short_code, URL.created_at, URL.is_active, URL.expires_at,
+                               URL.redirect_status)
+                        .where(URL.url_hash == url_hash)
+                    ).first()
+                    if live is not None:
+                        # Конфликт по хешу: тот же URL уже добавлен параллельным запросом
+                        if row["short_code"] not in custom_codes:
+                            code_allocator.release(row["short_code"])
+                        if (live.original_url == row["original_url"] and live.is_active
+                                and (live.expires_at is None or live.expires_at > utc_now())):
+                            adopted[url_hash] = live
+                        else:
+                            failed.add(url_hash)
+                        break
+                    if row["short_code"] in custom_codes:
+                        failed.add(url_hash)
+                        break
+                    # Выданный код занят — пробуем следующий
+                    code_allocator.retries += 1
+                    row["short_code"] = code_allocator.allocate(db)
+                    short_code_filter.add(row["short_code"])
+            else:
+                failed.add(url_hash)
+        cache_sync.publish(db, "url", *reactivate, *freed)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Ошибка при пакетной вставке: %s", e)
+        raise HTTPException(status_code=500, detail=f"Внутренняя ошибка сервера: {str(e)}")
+
+    url_cache.invalidate(*reactivate, *freed)
+
+    for i, url_hash in pending:
+        result = results[i]
+        if url_hash not in new_rows:
+            continue
+        if url_hash in failed:
+            result.error = "Короткий код уже существует или этот URL уже добавлен ранее"
+            continue
+        if url_hash in adopted:
+            live = adopted[url_hash]
+            result.short_code = live.short_code
+            result.created_at = live.created_at
+            result.is_active = True
+            result.expires_at = live.expires_at
+            result.redirect_status = live.redirect_status
+            continue
+        row = new_rows[url_hash]
+        result.short_code = row["short_code"]
+        result.created_at = row["created_at"]
+        result.is_active = True
+        result.expires_at = row["expires_at"]
+        result.redirect_status = row["redirect_status"]
+
+    return results
+
+
+@app.post("/shorten/batch", response_model=List[URLBatchResult])
+async def create_short_urls_batch(
+        urls: List[URLCreate],
+        db: Session = Depends(get_db),
+        authenticated: bool = Depends(
+            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=False))
+):
+    """
+    Пакетное сокращение URL: один запрос на поиск существующих хешей,
+    массовое выделение кодов и вставка в одной транзакции.
+    Ошибки возвращаются по каждому элементу, а не для всего пакета.
+    """
+    if len(urls) > SHORTEN_BATCH_MAX:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch size exceeds the limit of {SHORTEN_BATCH_MAX} URLs"
+        )
+
+    return await run_write(db, create_short_urls_batch_job, urls, offload=True)
+
+
+# Количество записей импорта, обрабатываемых одной транзакцией
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Сколько отклоненных записей эндпоинт импорта возвращает в ответе (остальные только считаются)
+IMPORT_ERRORS_LIMIT = int(os.getenv("IMPORT_ERRORS_LIMIT", "1000"))
+IMPORT_FORMATS = ("ndjson", "csv")
+
+
+class ImportParser:
+    """
+    Разбирает источник импорта построчно: NDJSON (объект на строку) или CSV с заголовком.
+    Поля: target_url, custom_code, created_at, is_active. Записи нумеруются с 1
+    в порядке следования — по этому номеру продолжается прерванный импорт
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f"Unsupported import format: {fmt}")
+        self.fmt = fmt
+        self.header: Optional[List[str]] = None
+        self.record_no = 0
+
+    def parse(self, line: str) -> Optional[Tuple[int, Optional[URLImportRecord], Optional[str]]]:
+        """Возвращает (номер, запись, None), (номер, None, ошибка) или None для пустой строки и заголовка"""
+        line = line.strip().lstrip("\ufeff")
+        if not line:
+            return None
+        if self.fmt == "csv" and self.header is None:
+            self.header = [name.strip() for name in next(csv.reader([line]))]
+            return None
+
+        self.record_no += 1
+        try:
+            if self.fmt == "ndjson":
+                data = json.loads(line)
+                if not isinstance(data, dict):
+                    raise ValueError("Expected a JSON object")
+            else:
+                data = dict(zip(self.header, next(csv.reader([line]))))
+            data = {key: value for key, value in data.items() if value not in ("", None)}
+            record = URLImportRecord(**data)
+            record.created_at = to_utc(record.created_at)
+            if len(str(record.target_url)) > URL.original_url.type.length:
+                raise ValueError(f"target_url is longer than {URL.original_url.type.length} characters")
+        except (ValueError, TypeError, ValidationError) as e:
+            return self.record_no, None, " ".join(str(e).split())
+        return self.record_no, record, None
+
+
+def import_urls_job(db: Session, records: List[Tuple[int, URLImportRecord]]) -> dict:
+    """
+    Вставляет порцию импортируемых записей одной транзакцией.
+    URL, уже известные по url_hash (в БД или раньше в этой же порции), не дублируются;
+    записи с занятым пользовательским кодом отклоняются. Возвращает счетчики
+    и список (номер записи, ошибка)
+    """
+    original_urls = [str(record.target_url) for _, record in records]
+    hashes = [get_url_hash(u) for u in original_urls]
+
+    existing = {}
+    for part in chunked(list(set(hashes)), BATCH_QUERY_CHUNK):
+        for row in db.execute(select(URL.url_hash, URL.original_url).where(URL.url_hash.in_(part))):
+            existing[row.url_hash] = row.original_url
+
+    custom_codes = {record.custom_code for _, record in records if record.custom_code}
+    taken_codes = set()
+    for part in chunked(list(custom_codes), BATCH_QUERY_CHUNK):
+        taken_codes.update(db.execute(select(URL.short_code).where(URL.short_code.in_(part))).scalars())
+
+    errors = []
+    existing_count = 0
+    new_rows = {}  # url_hash -> (номер записи, строка для вставки)
+    created_at = utc_now()
+    for (record_no, record), original_url, url_hash in zip(records, original_urls, hashes):
+        if url_hash in existing or url_hash in new_rows:
+            known_url = existing[url_hash] if url_hash in existing else new_rows[url_hash][1]["original_url"]
+            if known_url != original_url:
+                errors.append((record_no, "URL hash collision, the URL cannot be shortened"))
+            else:
+                existing_count += 1
+            continue
+        if record.custom_code:
+            if record.custom_code in taken_codes:
+                errors.append((record_no, "This custom code is already taken"))
+                continue
+            taken_codes.add(record.custom_code)
+        new_rows[url_hash] = (record_no, {
+            "original_url": original_url,
+            "url_hash": url_hash,
+            "short_code": record.custom_code,
+            "created_at": record.created_at or created_at,
+            "is_active": record.is_active,
+            "expires_at": to_utc(record.expires_at),
+            "redirect_status": record.redirect_status,
+            # Отсчет для архивации отключенных ссылок идет с момента импорта
+            "deactivated_at": None if record.is_active else created_at,
+        })
+
+    need_code = [row for _, row in new_rows.values() if row["short_code"] is None]
+    if need_code:
+        for row, code in zip(need_code, code_allocator.allocate_many(db, len(need_code))):
+            row["short_code"] = code
+
+    inserted = len(new_rows)
+    short_code_filter.add(*(row["short_code"] for _, row in new_rows.values()))
+    try:
+        if new_rows:
+            # Многострочный INSERT: SQLAlchemy собирает executemany в VALUES (...), (...)
+            db.execute(insert(URL), [row for _, row in new_rows.values()])
+        db.commit()
+    except IntegrityError:
+        # Параллельная запись заняла хеш или код — повторяем поштучно в savepoint'ах
+        db.rollback()
+        logger.warning("Конфликт уникальности при импорте, переходим к поштучной вставке")
+        inserted = 0
+        for record_no, row in new_rows.values():
+            for attempt in range(CODE_INSERT_ATTEMPTS):
+                try:
+                    with db.begin_nested():
+                        db.execute(insert(URL), [row])
+                    inserted += 1
+                    break
+                except IntegrityError:
+                    known_url = db.execute(
+                        select(URL.original_url).where(URL.url_hash == row["url_hash"])).scalar()
+                    if known_url is not None:
+                        # Конфликт по хешу: тот же URL уже добавлен параллельной записью
+                        if row["short_code"] not in custom_codes:
+                            code_allocator.release(row["short_code"])
+                        if known_url == row["original_url"]:
+                            existing_count += 1
+                        else:
+                            errors.append((record_no, "URL hash collision, the URL cannot be shortened"))
+                        break
+                    if row["short_code"] in custom_codes:
+                        errors.append((record_no, "Short code already exists or this URL was already added"))
+                        break
+                    # Выданный код занят — пробуем следующий
+                    code_allocator.retries += 1
+                    row["short_code"] = code_allocator.allocate(db)
+                    short_code_filter.add(row["short_code"])
+            else:
+                errors.append((record_no, "Short code already exists or this URL was already added"))
+        db.commit()
+
+    errors.sort()
+    return {"inserted": inserted, "existing": existing_count, "errors": errors}
+
+
+@app.post("/urls/import")
+async def import_urls(
+        request: Request,
+        format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+        skip: int = Query(0, ge=0),
+        db: Session = Depends(get_db),
+        authenticated: bool = Depends(
+            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=True))
+):
+    """
+    Потоковый импорт ссылок из тела запроса (NDJSON или CSV с заголовком).
+    Тело читается по мере поступления и записывается порциями по IMPORT_CHUNK_SIZE,
+    поэтому размер файла не ограничен памятью. Ответ содержит счетчики и отклоненные записи;
+    после обрыва импорт продолжается повторной загрузкой того же файла с skip=processed
+    """
+    parser = ImportParser(format)
+    totals = {"processed": skip, "inserted": 0, "existing": 0, "failed": 0}
+    errors = []
+    chunk = []
+
+    def reject(record_no: int, error: str) -> None:
+        totals["failed"] += 1
+        if len(errors) < IMPORT_ERRORS_LIMIT:
+            errors.append({"record": record_no, "error": error})
+
+    async def flush() -> None:
+        result = await run_write(db, import_urls_job, chunk, offload=True)
+        totals["inserted"] += result["inserted"]
+        totals["existing"] += result["existing"]
+        for record_no, error in result["errors"]:
+            reject(record_no, error)
+        totals["processed"] = chunk[-1][0]
+        chunk.clear()
+
+    async def lines():
+        buffer = b""
+        async for data in request.stream():
+            buffer += data
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                yield line
+        yield buffer
+
+    async for line in lines():
+        parsed = parser.parse(line.decode("utf-8", errors="replace"))
+        if parsed is None or parsed[0] <= skip:
+            continue
+        record_no, record, error = parsed
+        if error is not None:
+            reject(record_no, error)
+            continue
+        chunk.append((record_no, record))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await flush()
+    if chunk:
+        await flush()
+    totals["processed"] = max(totals["processed"], parser.record_no)
+
+    errors.sort(key=lambda item: item["record"])
+    logger.info("Импорт завершен: %s", totals)
+    return {**totals, "errors": errors}
+
+
+def import_urls_file(path: str, fmt: str, errors_path: str, checkpoint_path: str,
+                     chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """
+    Импорт из файла для командной строки. Отклоненные записи дописываются в errors_path
+    (NDJSON), после каждой зафиксированной порции номер последней записи сохраняется
+    в checkpoint_path. Повторный запуск с тем же checkpoint продолжает с места остановки;
+    повтор уже вставленной порции безопасен — такие URL находятся по url_hash
+    """
+    totals = {"processed": 0, "inserted": 0, "existing": 0, "failed": 0}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get("source") != os.path.abspath(path):
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to {checkpoint.get('source')}")
+        totals.update(checkpoint["totals"])
+        logger.info("Продолжаем импорт после записи %s", totals["processed"])
+    skip = totals["processed"]
+
+    def save_checkpoint() -> None:
+        temporary_path = checkpoint_path + ".tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump({"source": os.path.abspath(path), "totals": totals}, checkpoint_file)
+        os.replace(temporary_path, checkpoint_path)
+
+    started = time.monotonic()
+    parser = ImportParser(fmt)
+    chunk = []
+    with open(path, encoding="utf-8", errors="replace") as source, open(errors_path, "a") as errors_file:
+        def reject(record_no: int, error: str) -> None:
+            totals["failed"] += 1
+            errors_file.write(json.dumps({"record": record_no, "error": error}, ensure_ascii=False) + "\n")
+
+        def flush(last_record_no: int) -> None:
+            if chunk:
+                db = SessionLocal()
+                try:
+                    result = import_urls_job(db, chunk)
+                finally:
+                    db.close()
+                totals["inserted"] += result["inserted"]
+                totals["existing"] += result["existing"]
+                for record_no, error in result["errors"]:
+                    reject(record_no, error)
+                chunk.clear()
+            totals["processed"] = last_record_no
+            errors_file.flush()
+            save_checkpoint()
+            elapsed = time.monotonic() - started
+            logger.info(
+                "Импорт: обработано %s (вставлено %s, уже были %s, отклонено %s), %.0f записей/с",
+                totals["processed"], totals["inserted"], totals["existing"], totals["failed"],
+                (totals["processed"] - skip) / elapsed if elapsed else 0.0)
+
+        for line in source:
+            parsed = parser.parse(line)
+            if parsed is None or parsed[0] <= skip:
+                continue
+            record_no, record, error = parsed
+            if error is not None:
+                reject(record_no, error)
+            else:
+                chunk.append((record_no, record))
+            if len(chunk) >= chunk_size:
+                flush(record_no)
+        if parser.record_no > totals["processed"]:
+            flush(parser.record_no)
+    return totals
+
+
+def _app_stats():
+    yield ("url_cache", "hits"), url_cache.hits
+    yield ("url_cache", "misses"), url_cache.misses
+    yield ("url_cache", "evictions"), url_cache.evictions
+    yield ("code_allocator", "retries"), code_allocator.retries
+    yield ("shorten", "coalesced"), shorten_single_flight.coalesced
+    yield ("link_sweeper", "archived"), link_sweeper.archived
+    yield ("link_health", "checked"), link_health_checker.checked
+    yield ("link_health", "broken"), link_health_checker.broken
+    yield ("redirect_table", "hits"), redirect_table.hits
+    yield ("redirect_table", "misses"), redirect_table.misses
+    yield ("short_code_filter", "rejected_shape"), short_code_filter.rejected_shape
+    yield ("short_code_filter", "rejected_filter"), short_code_filter.rejected_filter
+    yield ("short_code_filter", "passed"), short_code_filter.passed
+
+
+metrics.register(Gauge(
+    "shortener_internal_events_total", "Cache and short-code allocator counters", ("component", "event"),
+    callback=_app_stats, type_name="counter"))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request, api_key: str = Security(api_key_header)):
+    # Доступ как к документации: с разрешенного домена или с полным API ключом
+    host = request.headers.get('host', '').split(':')[0]
+    if host != ALLOWED_DOCS_DOMAIN and api_key != API_KEY:
+        raise HTTPException(status_code=403, detail="Access to metrics is not allowed")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats(authenticated: bool = Depends(verify_api_key)):
+    return {
+        **url_cache.stats(),
+        "redirect_table": redirect_table.stats(),
+        "short_code_filter": short_code_filter.stats(),
+    }
+
+
+# Размер страницы GET /urls и размер порции строк, забираемой из курсора при экспорте
+URL_LIST_MAX_LIMIT = int(os.getenv("URL_LIST_MAX_LIMIT", "1000"))
+URL_EXPORT_BATCH = int(os.getenv("URL_EXPORT_BATCH", "5000"))
+
+
+def range_bound(value: Union[datetime, date, None]) -> Optional[datetime]:
+    """Граница диапазона created_at: дата без времени означает начало суток UTC"""
+    if value is None or isinstance(value, datetime):
+        return to_utc(value)
+    return datetime(value.year, value.month, value.day)
+
+
+def url_list_query(after_id: int, is_active: Optional[bool], created_from: Union[datetime, date, None],
+                   created_to: Union[datetime, date, None]):
+    """Выборка колонок ссылок (без ORM-объектов) в порядке id, начиная после after_id"""
+    query = select(URL.id, URL.original_url, URL.short_code, URL.created_at, URL.is_active, URL.expires_at,
+                   URL.redirect_status) \
+        .where(URL.id > after_id).order_by(URL.id)
+    if is_active is not None:
+        query = query.where(URL.is_active == is_active)
+    if created_from is not None:
+        query = query.where(URL.created_at >= range_bound(created_from))
+    if created_to is not None:
+        query = query.where(URL.created_at < range_bound(created_to))
+    return query
+
+
+@app.get("/urls", response_model=URLListResponse)
+async def list_urls(
+        after_id: int = 0,
+        limit: int = Query(100, ge=1, le=URL_LIST_MAX_LIMIT),
+        is_active: Optional[bool] = None,
+        created_from: Union[datetime, date, None] = None,
+        created_to: Union[datetime, date, None] = None,
+        db: AsyncSession = Depends(get_async_db),
+        authenticated: bool = Depends(
+            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=True))
+):
+    """
+    Постраничный список ссылок. Пагинация по ключу: вместо OFFSET передается
+    after_id из предыдущего ответа, поэтому стоимость страницы не растет с ее номером.
+    created_from/created_to — полуинтервал [from, to) в ISO-формате, время без зоны считается UTC
+    """
+    rows = (await db.execute(
+        url_list_query(after_id, is_active, created_from, created_to).limit(limit + 1)
+    )).all()
+    items = [
+        URLListItem(id=row.id, target_url=row.original_url, short_code=row.short_code,
+                    created_at=row.created_at, is_active=row.is_active,
+                    expires_at=row.expires_at, redirect_status=row.redirect_status)
+        for row in rows[:limit]
+    ]
+    next_after_id = items[-1].id if len(rows) > limit else None
+    return URLListResponse(items=items, next_after_id=next_after_id)
+
+
+@app.get("/links/broken", response_model=BrokenLinkListResponse)
+async def list_broken_links(
+        kind: Literal["url", "domain"] = "url",
+        after_id: int = 0,
+        limit: int = Query(100, ge=1, le=URL_LIST_MAX_LIMIT),
+        db: AsyncSession = Depends(get_async_db),
+        authenticated: bool = Depends(
+            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=True))
+):
+    """
+    Активные ссылки (kind=url) или домены (kind=domain), чей целевой URL при последней
+    фоновой проверке не ответил или вернул статус 400 и выше. Пагинация по after_id, как в GET /urls
+    """
+    model, target = LINK_HEALTH_TARGETS[kind]
+    key = URL.short_code if kind == "url" else Domain.domain
+    # Условие совпадает с условием частичного индекса ix_urls_health_broken
+    broken = (model.health_status == 0) | (model.health_status >= 400)
+    rows = (await db.execute(
+        select(model.id, key.label("key"), target.label("target_url"), model.health_status, model.health_checked_at)
+        .where(broken, model.id > after_id, model.is_active == True)
+        .order_by(model.id)
+        .limit(limit + 1)
+    )).all()
+    items = [
+        BrokenLinkItem(id=row.id, key=row.key, target_url=row.target_url, health_status=row.health_status,
+                       health_checked_at=row.health_checked_at)
+        for row in rows[:limit]
+    ]
+    next_after_id = items[-1].id if len(rows) > limit else None
+    return BrokenLinkListResponse(items=items, next_after_id=next_after_id)
+
+
+@app.get("/urls/export")
+async def export_urls(
+        after_id: int = 0,
+        is_active: Optional[bool] = None,
+        created_from: Union[datetime, date, None] = None,
+        created_to: Union[datetime, date, None] = None,
+        authenticated: bool = Depends(
+            lambda api_key=Security(api_key_header): verify_api_key(api_key, require_full_access=True))
+):
+    """
+    Выгрузка всех подходящих ссылок в NDJSON (по объекту на строку).
+    Строки читаются серверным курсором порциями по URL_EXPORT_BATCH и сразу отдаются
+    клиенту, так что память не зависит от размера таблицы. Прерванную выгрузку можно
+    продолжить с after_id, равным id последней полученной строки
+    """
+    query = url_list_query(after_id, is_active, created_from, created_to) \
+        .execution_options(yield_per=URL_EXPORT_BATCH)
+
+    async def generate():
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query)
+            async for rows in result.partitions():
+                yield "".join(
+                    json.dumps({
+                        "id": row.id,
+                        "target_url": row.original_url,
+                        "short_code": row.short_code,
+                        "created_at": row.created_at.isoformat(),
+                        "is_active": row.is_active,
+                        "expires_at": isoformat_or_none(row.expires_at),
+                        "redirect_status": row.redirect_status,
+                    }, ensure_ascii=False) + "\n"
+                    for row in rows
+                )
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.api_route("/{short_code}", methods=["GET", "HEAD"])
+async def redirect_to_url(short_code: str, request: Request):
+    target = await resolve_short_code(short_code)
+    if target is None:
         raise HTTPException(status_code=404, detail="URL not found")
 
-    return RedirectResponse(url=db_url.original_url, status_code=302)
+    if request.method == "GET":
+        click_aggregator.record("url", short_code)
+    return redirect_response(*target)
+
+
+@app.get("/urls/{short_code}/stats", response_model=URLStatsResponse)
+async def url_stats(
+        short_code: str,
+        db: AsyncSession = Depends(get_async_db),
+        authenticated: bool = Depends(verify_api_key)
+):
+    kind, key = "url", short_code
+    exists = (await db.execute(select(URL.id).where(URL.short_code == short_code))).first()
+    if exists is None:
+        # Ссылка могла быть перенесена в архив — тогда статистика последней из них
+        archived = (await db.execute(
+            select(URLArchive.url_id).where(URLArchive.short_code == short_code)
+            .order_by(URLArchive.archived_at.desc(), URLArchive.id.desc()).limit(1)
+        )).first()
+        if archived is None:
+            raise HTTPException(status_code=404, detail="URL not found")
+        kind, key = "archived", str(archived.url_id)
+
+    rows = await db.execute(
+        select(Click.bucket_start, Click.count)
+        .where(Click.kind == kind, Click.key == key)
+        .order_by(Click.bucket_start)
+    )
+    counts = {row.bucket_start: row.count for row in rows}
+    # Добавляем переходы, которые еще не успели записаться в БД
+    for bucket, count in click_aggregator.pending_for(kind, key).items():
+        counts[bucket] = counts.get(bucket, 0) + count
+
+    return URLStatsResponse(
+        short_code=short_code,
+        total_clicks=sum(counts.values()),
+        buckets=[
+            ClickBucket(bucket_start=datetime.utcfromtimestamp(bucket).isoformat(), count=count)
+            for bucket, count in sorted(counts.items())
+        ],
+    )
 
 
 @app.get("/api/test")
@@ -525,13 +4104,7 @@ async def test_api_key(authenticated: bool = Depends(verify_api_key)):
     return {"message": "API key is valid"}
 
 
-@app.put("/urls/{short_code}", response_model=URLResponse)
-async def update_url(
-        short_code: str,
-        url_update: URLUpdate,
-        db: Session = Depends(get_db),
-        authenticated: bool = Depends(verify_api_key)
-):
+def update_url_job(db: Session, short_code: str, url_update: URLUpdate, target_available: bool) -> URLResponse:
     # Проверяем существование URL
     db_url = db.query(URL).filter(URL.short_code == short_code).first()
     if not db_url:
@@ -539,14 +4112,16 @@ async def update_url(
 
     # Обновляем поля, если они предоставлены
     if url_update.target_url is not None:
-        # Проверяем доступность нового URL
-        if not verify_url(str(url_update.target_url)):
+        # Доступность нового URL проверяется до записи, вне транзакции
+        if not target_available:
             raise HTTPException(
                 status_code=400,
                 detail="New URL is not accessible or invalid"
             )
         db_url.original_url = str(url_update.target_url)
         db_url.url_hash = get_url_hash(str(url_update.target_url))
+        # Результат проверки относился к прежнему адресу
+        db_url.health_status = db_url.health_checked_at = None
 
     if url_update.short_code is not None:
         # Проверяем, не занят ли новый код
@@ -569,8 +4144,17 @@ async def update_url(
         db_url.short_code = url_update.short_code
 
     if url_update.is_active is not None:
+        if db_url.is_active != url_update.is_active:
+            db_url.deactivated_at = None if url_update.is_active else utc_now()
         db_url.is_active = url_update.is_active
 
+    if "expires_at" in url_update.model_fields_set:
+        db_url.expires_at = to_utc(url_update.expires_at)
+
+    if "redirect_status" in url_update.model_fields_set:
+        db_url.redirect_status = url_update.redirect_status
+
+    cache_sync.publish(db, "url", short_code, url_update.short_code)
     try:
         db.commit()
         db.refresh(db_url)
@@ -580,40 +4164,62 @@ async def update_url(
             status_code=400,
             detail=f"Could not update URL: {str(e)}"
         )
+    finally:
+        # Сбрасываем и старый, и новый код, чтобы изменения сразу вступили в силу
+        url_cache.invalidate(short_code, url_update.short_code)
 
     return URLResponse(
         target_url=db_url.original_url,
         short_code=db_url.short_code,
         created_at=db_url.created_at,
-        is_active=db_url.is_active
+        is_active=db_url.is_active,
+        expires_at=db_url.expires_at,
+        redirect_status=db_url.redirect_status
     )
 
 
-@app.delete("/urls/{short_code}")
-async def delete_url(
+@app.put("/urls/{short_code}", response_model=URLResponse)
+async def update_url(
         short_code: str,
+        url_update: URLUpdate,
         db: Session = Depends(get_db),
         authenticated: bool = Depends(verify_api_key)
 ):
+    # Проверяем доступность нового URL заранее: сетевой запрос не должен занимать writer
+    target_available = True
+    if url_update.target_url is not None:
+        target_available = await verify_url(str(url_update.target_url))
+    return await run_write(db, update_url_job, short_code, url_update, target_available)
+
+
+def delete_url_job(db: Session, short_code: str) -> dict:
     # Проверяем существование URL
     db_url = db.query(URL).filter(URL.short_code == short_code).first()
     if not db_url:
         raise HTTPException(status_code=404, detail="URL not found")
 
-    # Помечаем URL как неактивный вместо физического удаления
+    # Помечаем URL как неактивный вместо физического удаления;
+    # через LINK_ARCHIVE_INACTIVE_DAYS фоновая очистка перенесет его в архив
+    if db_url.is_active:
+        db_url.deactivated_at = utc_now()
     db_url.is_active = False
+    cache_sync.publish(db, "url", short_code)
     db.commit()
+    url_cache.invalidate(short_code)
 
     return {"message": "URL successfully deactivated"}
 
 
-@app.put("/domains/{domain_id}", response_model=DomainResponse)
-async def update_domain(
-        domain_id: int,
-        domain_update: DomainUpdate,
+@app.delete("/urls/{short_code}")
+async def delete_url(
+        short_code: str,
         db: Session = Depends(get_db),
         authenticated: bool = Depends(verify_api_key)
 ):
+    return await run_write(db, delete_url_job, short_code)
+
+
+def update_domain_job(db: Session, domain_id: int, domain_update: DomainUpdate) -> DomainResponse:
     # Проверяем существование домена
     db_domain = db.query(Domain).filter(Domain.id == domain_id).first()
     if not db_domain:
@@ -622,17 +4228,65 @@ async def update_domain(
     # Обновляем поля, если они предоставлены
     if domain_update.redirect_url is not None:
         db_domain.redirect_url = str(domain_update.redirect_url)
+        db_domain.health_status = db_domain.health_checked_at = None
 
     if domain_update.is_active is not None:
         db_domain.is_active = domain_update.is_active
 
+    if "redirect_status" in domain_update.model_fields_set:
+        db_domain.redirect_status = domain_update.redirect_status
+
+    cache_sync.publish(db, "domain", db_domain.domain)
     db.commit()
     db.refresh(db_domain)
+    domain_routes.apply(db_domain)
 
     return DomainResponse(
         domain=db_domain.domain,
         redirect_url=db_domain.redirect_url,
         id=db_domain.id,
         created_at=db_domain.created_at,
-        is_active=db_domain.is_active
+        is_active=db_domain.is_active,
+        redirect_status=db_domain.redirect_status
     )
+
+
+@app.put("/domains/{domain_id}", response_model=DomainResponse)
+async def update_domain(
+        domain_id: int,
+        domain_update: DomainUpdate,
+        db: Session = Depends(get_db),
+        authenticated: bool = Depends(verify_api_key)
+):
+    return await run_write(db, update_domain_job, domain_id, domain_update)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Импорт ссылок из NDJSON или CSV")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+    import_command = subcommands.add_parser("import", help="Импортировать ссылки из файла")
+    import_command.add_argument("path", help="Файл NDJSON или CSV с заголовком")
+    import_command.add_argument("--format", choices=IMPORT_FORMATS,
+                                help="Формат файла; по умолчанию определяется по расширению")
+    import_command.add_argument("--errors", help="Файл для отклоненных записей (по умолчанию <path>.errors.ndjson)")
+    import_command.add_argument("--checkpoint", help="Файл контрольной точки (по умолчанию <path>.checkpoint)")
+    import_command.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    compile_command = subcommands.add_parser(
+        "compile-redirects", help="Собрать файл таблицы редиректов из активных ссылок")
+    compile_command.add_argument("--path", default=REDIRECT_TABLE_PATH or "./data/redirects.bin")
+    args = arg_parser.parse_args()
+
+    create_tables()
+    if args.command == "compile-redirects":
+        print(json.dumps({"path": args.path, "urls": RedirectTable.compile(args.path)}))
+    else:
+        import_format = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+        result = import_urls_file(
+            args.path, import_format,
+            errors_path=args.errors or args.path + ".errors.ndjson",
+            checkpoint_path=args.checkpoint or args.path + ".checkpoint",
+            chunk_size=args.chunk_size,
+        )
+        print(json.dumps(result))
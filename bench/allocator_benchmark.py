@@ -0,0 +1,92 @@
+"""
+Бенчмарк задержки создания ссылки в зависимости от размера таблицы urls.
+
+Сравнивает RandomCodeAllocator (случайный код + проверочный запрос) и
+SequenceCodeAllocator (блоки номеров из счетчика). Таблица во временной
+SQLite базе заполняется до каждого из размеров, после чего измеряется
+выделение кода + INSERT + COMMIT для одной ссылки.
+
+Запуск:
+    python bench/allocator_benchmark.py --sizes 10000,100000,1000000 --creates 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="Размеры таблицы через запятую")
+    parser.add_argument("--creates", type=int, default=2000, help="Сколько ссылок создавать на каждом шаге")
+    parser.add_argument("--database-url", default=None, help="По умолчанию — временный файл SQLite")
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        args.database_url = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("API_KEY", "bench")
+
+    from sqlalchemy import insert
+    from app import main as app_main
+
+    app_main.create_tables()
+    allocators = {
+        "random": app_main.RandomCodeAllocator(),
+        "sequence": app_main.SequenceCodeAllocator(key=b"bench", block_size=100),
+    }
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    db = app_main.SessionLocal()
+    seeded = 0
+    serial = 0
+
+    print(f"{'rows':>10} {'allocator':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'retries':>8}")
+    for size in sizes:
+        # Дозаполняем таблицу случайными кодами, как у старых ссылок
+        while seeded < size:
+            batch = min(50000, size - seeded)
+            rows = []
+            for _ in range(batch):
+                serial += 1
+                rows.append({
+                    "original_url": f"https://seed.example.com/{serial}",
+                    "url_hash": app_main.get_url_hash(f"https://seed.example.com/{serial}"),
+                    "short_code": app_main.encode_code(random.randrange(app_main.CODE_SPACE)),
+                    "created_at": datetime(2024, 1, 1),
+                    "is_active": True,
+                })
+            db.execute(insert(app_main.URL).prefix_with("OR IGNORE" if "sqlite" in args.database_url else ""), rows)
+            db.commit()
+            seeded += batch
+
+        for name, allocator in allocators.items():
+            allocator.retries = 0
+            timings = []
+            for _ in range(args.creates):
+                serial += 1
+                started = time.perf_counter()
+                code = allocator.allocate(db)
+                db.execute(insert(app_main.URL), [{
+                    "original_url": f"https://bench.example.com/{serial}",
+                    "url_hash": app_main.get_url_hash(f"https://bench.example.com/{serial}"),
+                    "short_code": code,
+                    "created_at": datetime(2024, 1, 1),
+                    "is_active": True,
+                }])
+                db.commit()
+                timings.append((time.perf_counter() - started) * 1000)
+            seeded += args.creates
+            quantiles = statistics.quantiles(timings, n=100)
+            print(f"{size:>10} {name:>10} {quantiles[49]:>8.3f} {quantiles[94]:>8.3f} {quantiles[98]:>8.3f} {allocator.retries:>8}")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Бенчмарк фоновой проверки ссылок (LinkHealthChecker) на локальных заглушечных серверах.
+
+Во временной SQLite базе создаются ссылки на несколько локальных "хостов" (заглушки на
+разных портах, отвечают на HEAD с заданной задержкой, часть адресов — 404). Затем
+выполняется один полный обход, и выводятся скорость проверки, оценка времени обхода
+миллиона ссылок и число запросов, дошедших до заглушек (дубликаты адресов не запрашиваются).
+
+Запуск:
+    python bench/link_health_benchmark.py --links 100000 --hosts 200 --latency 0.05
+    python bench/link_health_benchmark.py --links 100000 --concurrency 200 --per-host 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubServers:
+    """
+    HTTP/1.1 заглушки с keep-alive в отдельном процессе, чтобы они не делили
+    процессор и GIL с проверяющим процессом
+    """
+
+    def __init__(self, hosts: int, latency: float, broken_every: int):
+        self.hosts = hosts
+        self.latency = latency
+        self.broken_every = broken_every
+        self.ports = []
+        self._requests = multiprocessing.Value("q", 0)
+        self._process = None
+
+    @property
+    def requests(self) -> int:
+        return self._requests.value
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1]
+                with self._requests.get_lock():
+                    self._requests.value += 1
+                await asyncio.sleep(self.latency)
+                broken = self.broken_every and int(path.rsplit(b"/", 1)[1]) % self.broken_every == 0
+                status = b"404 Not Found" if broken else b"200 OK"
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, ports_pipe):
+        ports = []
+        for _ in range(self.hosts):
+            server = await asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=1024)
+            ports.append(server.sockets[0].getsockname()[1])
+        ports_pipe.send(ports)
+        await asyncio.Event().wait()
+
+    def _run(self, ports_pipe) -> None:
+        asyncio.run(self._serve(ports_pipe))
+
+    def start(self) -> None:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(target=self._run, args=(sender,), daemon=True)
+        self._process.start()
+        self.ports = receiver.recv()
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=100000, help="Сколько ссылок проверить")
+    parser.add_argument("--hosts", type=int, default=200, help="Сколько разных хостов (портов заглушки)")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="Доля ссылок на уже встречавшиеся адреса")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа заглушки, секунды")
+    parser.add_argument("--broken-every", type=int, default=50, help="Каждый N-й адрес отвечает 404 (0 — ни один)")
+    parser.add_argument("--concurrency", type=int, default=100, help="LINK_HEALTH_MAX_CONCURRENCY")
+    parser.add_argument("--per-host", type=int, default=2, help="LINK_HEALTH_PER_HOST_CONCURRENCY")
+    parser.add_argument("--batch-size", type=int, default=1000, help="LINK_HEALTH_BATCH")
+    args = parser.parse_args()
+
+    # Процесс заглушек запускается до импорта приложения, которое при импорте поднимает потоки
+    stubs = StubServers(args.hosts, args.latency, args.broken_every)
+    stubs.start()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+    os.environ.setdefault("API_KEY", "bench")
+    os.environ["LINK_HEALTH_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ["LINK_HEALTH_PER_HOST_CONCURRENCY"] = str(args.per_host)
+    os.environ["LINK_HEALTH_BATCH"] = str(args.batch_size)
+
+    from sqlalchemy import insert
+    from app import main as app_main
+
+    app_main.create_tables()
+    # Ссылки вперемешку по хостам. Одинаковый URL у двух ссылок невозможен (url_hash уникален),
+    # поэтому повторы отличаются фрагментом: на сервер он не отправляется, и адрес проверяется один раз
+    unique = max(int(args.links * (1 - args.duplicates)), 1)
+    db = app_main.SessionLocal()
+    for start in range(0, args.links, 50000):
+        rows = []
+        for i in range(start, min(start + 50000, args.links)):
+            target = i if i < unique else i % unique
+            original_url = f"http://127.0.0.1:{stubs.ports[target % args.hosts]}/page/{target}"
+            if i >= unique:
+                original_url += f"#dup{i}"
+            rows.append({
+                "original_url": original_url,
+                "url_hash": app_main.get_url_hash(original_url),
+                "short_code": app_main.encode_code(i),
+                "created_at": datetime(2024, 1, 1),
+                "is_active": True,
+            })
+        db.execute(insert(app_main.URL), rows)
+        db.commit()
+    db.close()
+
+    checker = app_main.link_health_checker
+
+    async def sweep():
+        try:
+            return await checker.sweep()
+        finally:
+            await checker.verifier.close()
+
+    started = time.perf_counter()
+    checked = asyncio.run(sweep())
+    elapsed = time.perf_counter() - started
+    stubs.stop()
+
+    rate = checked / elapsed if elapsed else 0.0
+    print(f"links checked:       {checked}")
+    print(f"broken:              {checker.broken}")
+    print(f"stub requests:       {stubs.requests}")
+    print(f"elapsed:             {elapsed:.1f} s")
+    print(f"links per second:    {rate:.0f}")
+    print(f"1M links projected:  {1_000_000 / rate / 3600:.2f} h" if rate else "1M links projected: n/a")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Нагрузочный бенчмарк и проверка регрессий.
+
+Создает одноразовую базу (SQLite во временной папке или переданный --database-url),
+заполняет ее ссылками и доменами, запускает `uvicorn app.main:app` отдельным процессом
+и гоняет смешанную нагрузку (redirect / root / shorten / update) с заданной
+конкурентностью. По каждому маршруту выводит пропускную способность и p50/p95/p99.
+
+Запуск:
+    python bench/load_benchmark.py --urls 100000 --domains 100 --concurrency 64 --duration 30 \\
+        --output results.json
+
+Сравнение с сохраненным результатом (код выхода 1 при регрессии):
+    python bench/load_benchmark.py --baseline baseline.json --max-throughput-drop 0.10 \\
+        --max-latency-increase 0.20
+
+Внимание: --database-url должен указывать на одноразовую базу — таблицы будут заполнены тестовыми данными.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+API_KEY = "bench-key"
+ROUTES = ("redirect", "root", "shorten", "update")
+# Статусы, которые считаются успешными для каждого маршрута
+EXPECTED_STATUS = {
+    "redirect": {302},
+    "root": {302},
+    "shorten": {200},
+    "update": {200},
+}
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route in mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_database(env: dict, urls: int, domains: int):
+    """Заполняет базу через модели приложения и возвращает (коды, домены)"""
+    os.environ.update(env)
+    from sqlalchemy import insert
+    from app import main as app_main
+
+    app_main.create_tables()
+    codes = []
+    db = app_main.SessionLocal()
+    try:
+        created_at = datetime(2024, 1, 1)
+        batch = []
+        for i in range(urls):
+            original_url = f"https://seed.example.com/page/{i}"
+            code = app_main.encode_code(app_main.scramble_code_index(i, b"bench-seed"))
+            codes.append(code)
+            batch.append({
+                "original_url": original_url,
+                "url_hash": app_main.get_url_hash(original_url),
+                "short_code": code,
+                "created_at": created_at,
+                "is_active": True,
+            })
+            if len(batch) == 10000:
+                db.execute(insert(app_main.URL), batch)
+                batch = []
+        if batch:
+            db.execute(insert(app_main.URL), batch)
+
+        hosts = [f"bench-{i}.example.org" for i in range(domains)]
+        if hosts:
+            db.execute(insert(app_main.Domain), [
+                {"domain": host, "redirect_url": f"https://{host}/landing", "created_at": created_at, "is_active": True}
+                for host in hosts
+            ])
+        db.commit()
+    finally:
+        db.close()
+    return codes, hosts
+
+
+def start_server(env: dict, port: int, workers: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port), "--no-access-log", "--log-level", "warning",
+    ]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command, cwd=ROOT_DIR, env={**os.environ, **env})
+
+
+async def wait_for_server(base_url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get("/api/test", headers={"X-API-Key": API_KEY})
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+async def run_load(base_url: str, codes: list, hosts: list, mix: dict, concurrency: int,
+                   duration: float, warmup: float) -> dict:
+    latencies = {route: [] for route in ROUTES}
+    errors = {route: 0 for route in ROUTES}
+    routes = [route for route in ROUTES if mix.get(route)]
+    if not hosts and "root" in routes:
+        routes.remove("root")
+    weights = [mix[route] for route in routes]
+    counter = iter(range(10 ** 12))
+    headers = {"X-API-Key": API_KEY}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        async def request(route: str) -> httpx.Response:
+            if route == "redirect":
+                return await client.get(f"/{random.choice(codes)}")
+            if route == "root":
+                return await client.get("/", headers={"host": random.choice(hosts)})
+            if route == "shorten":
+                return await client.post(
+                    "/shorten", headers=headers,
+                    json={"target_url": f"https://bench.example.com/new/{os.getpid()}/{next(counter)}"})
+            return await client.put(f"/urls/{random.choice(codes)}", headers=headers, json={"is_active": True})
+
+        async def worker(record_after: float, stop_at: float) -> None:
+            while True:
+                route = random.choices(routes, weights)[0]
+                started = time.perf_counter()
+                if started >= stop_at:
+                    return
+                try:
+                    response = await request(route)
+                    ok = response.status_code in EXPECTED_STATUS[route]
+                except httpx.HTTPError:
+                    ok = False
+                finished = time.perf_counter()
+                if started < record_after:
+                    continue
+                if ok:
+                    latencies[route].append(finished - started)
+                else:
+                    errors[route] += 1
+
+        now = time.perf_counter()
+        record_after = now + warmup
+        stop_at = record_after + duration
+        await asyncio.gather(*(worker(record_after, stop_at) for _ in range(concurrency)))
+
+    report = {}
+    for route in routes:
+        values = sorted(latencies[route])
+        if len(values) >= 2:
+            quantiles = statistics.quantiles(values, n=100)
+            p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+        else:
+            p50 = p95 = p99 = values[0] if values else 0.0
+        report[route] = {
+            "requests": len(values),
+            "errors": errors[route],
+            "throughput_rps": round(len(values) / duration, 2),
+            "p50_ms": round(p50 * 1000, 3),
+            "p95_ms": round(p95 * 1000, 3),
+            "p99_ms": round(p99 * 1000, 3),
+        }
+    return report
+
+
+def compare(results: dict, baseline: dict, max_throughput_drop: float, max_latency_increase: float) -> list:
+    """Возвращает список найденных регрессий относительно baseline"""
+    problems = []
+    for route, current in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        if not previous:
+            continue
+        if previous["throughput_rps"] and \
+                current["throughput_rps"] < previous["throughput_rps"] * (1 - max_throughput_drop):
+            problems.append(
+                f"{route}: throughput {current['throughput_rps']} rps < baseline {previous['throughput_rps']} rps")
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if previous[key] and current[key] > previous[key] * (1 + max_latency_increase):
+                problems.append(f"{route}: {key} {current[key]} > baseline {previous[key]}")
+        if current["errors"] > previous["errors"]:
+            problems.append(f"{route}: errors {current['errors']} > baseline {previous['errors']}")
+    return problems
+
+
+def print_report(results: dict) -> None:
+    print(f"{'route':>10} {'requests':>9} {'errors':>7} {'rps':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, row in results["routes"].items():
+        print(f"{route:>10} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>10} "
+              f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=None, help="Одноразовая база; по умолчанию временный SQLite")
+    parser.add_argument("--urls", type=int, default=10000, help="Сколько ссылок создать перед запуском")
+    parser.add_argument("--domains", type=int, default=100, help="Сколько доменов создать перед запуском")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("redirect=80,root=10,shorten=8,update=2"),
+                        help="Доли маршрутов в нагрузке")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="Длительность замера, секунд")
+    parser.add_argument("--warmup", type=float, default=3, help="Прогрев перед замером, секунд")
+    parser.add_argument("--workers", type=int, default=1, help="Количество процессов uvicorn")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Куда сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON с результатами прошлого запуска для сравнения")
+    parser.add_argument("--max-throughput-drop", type=float, default=0.10,
+                        help="Допустимое падение пропускной способности (доля)")
+    parser.add_argument("--max-latency-increase", type=float, default=0.20,
+                        help="Допустимый рост p50/p95/p99 (доля)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='shortener-bench-')}/bench.db"
+    env = {
+        "DATABASE_URL": database_url,
+        "API_KEY": API_KEY,
+        "CREATE_ONLY_API_KEY": API_KEY,
+        "LOG_LEVEL": "WARNING",
+        "LOG_SAMPLE_RATE": "0",
+    }
+
+    print(f"Seeding {args.urls} URLs and {args.domains} domains into {database_url}")
+    codes, hosts = seed_database(env, args.urls, args.domains)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(env, port, args.workers)
+    try:
+        asyncio.run(wait_for_server(base_url))
+        routes = asyncio.run(run_load(
+            base_url, codes, hosts, args.mix, args.concurrency, args.duration, args.warmup))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    results = {
+        "meta": {
+            "database": database_url.split("://")[0],
+            "urls": args.urls,
+            "domains": args.domains,
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "workers": args.workers,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "routes": routes,
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        problems = compare(results, baseline, args.max_throughput_drop, args.max_latency_increase)
+        if problems:
+            print("Regressions compared to baseline:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("No regressions compared to baseline")
+
+
+if __name__ == "__main__":
+    main()
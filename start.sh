@@ -4,6 +4,6 @@
 echo "Running database migrations..."
 alembic upgrade head
 
-# Запускаем приложение
-echo "Starting FastAPI application..."
-uvicorn main:app --host 0.0.0.0 --port 8000
+# Запускаем приложение; количество процессов задается WEB_CONCURRENCY
+echo "Starting FastAPI application with ${WEB_CONCURRENCY:-1} worker(s)..."
+uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${WEB_CONCURRENCY:-1}"
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Приложение читает настройки при импорте, поэтому окружение задается до него
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='shortener-tests-')}/test.db")
+os.environ.setdefault("API_KEY", "test-key")
+os.environ.setdefault("CREATE_ONLY_API_KEY", "test-create-key")
+os.environ.setdefault("LINK_SWEEPER", "false")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+API_HEADERS = {"X-API-Key": os.environ["API_KEY"]}
+
+
+@pytest.fixture(scope="session")
+def app_main():
+    from app import main
+    # Таблицы приложение создает при запуске; тестам без client они нужны сразу
+    main.create_tables()
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app_main):
+    from fastapi.testclient import TestClient
+    with TestClient(app_main.app) as test_client:
+        yield test_client
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import API_HEADERS
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+
+
+@pytest.mark.parametrize("url, sync_url, async_url", [
+    ("sqlite:///./data/app.db", "sqlite:///./data/app.db", "sqlite+aiosqlite:///./data/app.db"),
+    ("sqlite+aiosqlite:///./data/app.db", "sqlite:///./data/app.db", "sqlite+aiosqlite:///./data/app.db"),
+    ("postgresql://user:secret@db/app", "postgresql+psycopg2://user:secret@db/app",
+     "postgresql+asyncpg://user:secret@db/app"),
+    ("postgresql+asyncpg://user:secret@db/app?ssl=require", "postgresql+psycopg2://user:secret@db/app?ssl=require",
+     "postgresql+asyncpg://user:secret@db/app?ssl=require"),
+])
+def test_driver_is_derived_from_database_url(app_main, url, sync_url, async_url):
+    assert app_main.get_sync_database_url(url) == sync_url
+    assert app_main.get_async_database_url(url) == async_url
+
+
+@contextmanager
+def statements_by_engine(app_main):
+    statements = {"sync": [], "async": []}
+    listeners = [(app_main.engine, statements["sync"]), (app_main.async_engine.sync_engine, statements["async"])]
+
+    def recorder(target):
+        def record(conn, cursor, statement, parameters, context, executemany):
+            target.append(statement)
+        return record
+
+    registered = [(engine, recorder(target)) for engine, target in listeners]
+    for engine, record in registered:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for engine, record in registered:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+def test_redirect_reads_through_async_engine(app_main, client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/async-read"}, headers=API_HEADERS)
+    short_code = response.json()["short_code"]
+    app_main.url_cache.clear()
+
+    with statements_by_engine(app_main) as statements:
+        response = client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code in REDIRECT_STATUSES
+    assert statements["sync"] == []
+    assert any("FROM urls" in statement for statement in statements["async"])
+
+
+def test_domain_list_reads_through_async_engine(app_main, client):
+    with statements_by_engine(app_main) as statements:
+        response = client.get("/domains", headers={**API_HEADERS, "Host": app_main.ALLOWED_DOMAIN})
+    assert response.status_code == 200, response.text
+    assert statements["sync"] == []
+    assert any("FROM domains" in statement for statement in statements["async"])
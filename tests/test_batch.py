@@ -0,0 +1,45 @@
+from conftest import API_HEADERS
+
+
+def test_duplicates_in_batch_use_first_item(client):
+    response = client.post("/shorten/batch", json=[
+        {"target_url": "https://example.com/batch-dup", "redirect_status": 301},
+        {"target_url": "https://example.com/batch-dup", "redirect_status": 307,
+         "expires_at": "2999-01-01T00:00:00Z"},
+    ], headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    first, second = response.json()
+    assert first["short_code"] == second["short_code"]
+    assert first["redirect_status"] == second["redirect_status"] == 301
+    assert first["expires_at"] is None and second["expires_at"] is None
+
+
+def test_hash_conflict_returns_existing_link(app_main, monkeypatch):
+    """Параллельный запрос успел вставить тот же URL — пакет возвращает его ссылку, а не новый код"""
+    target_url = "https://example.com/batch-race"
+    allocate_many = app_main.code_allocator.allocate_many
+
+    def allocate_and_race(db, count):
+        codes = allocate_many(db, count)
+        other = app_main.SessionLocal()
+        try:
+            other.add(app_main.URL(original_url=target_url, url_hash=app_main.get_url_hash(target_url),
+                                   short_code="race01", created_at=app_main.utc_now(), is_active=True))
+            other.commit()
+        finally:
+            other.close()
+        return codes
+
+    monkeypatch.setattr(app_main.code_allocator, "allocate_many", allocate_and_race)
+    db = app_main.SessionLocal()
+    try:
+        results = app_main.create_short_urls_batch_job(db, [
+            app_main.URLCreate(target_url=target_url),
+            app_main.URLCreate(target_url="https://example.com/batch-race-other"),
+        ])
+    finally:
+        db.close()
+
+    assert results[0].error is None
+    assert results[0].short_code == "race01"
+    assert results[1].error is None and results[1].short_code not in (None, "race01")
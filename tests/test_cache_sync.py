@@ -0,0 +1,81 @@
+import itertools
+import time
+
+import pytest
+
+from conftest import API_HEADERS
+
+urls = (f"https://example.com/sync-{i}" for i in itertools.count())
+
+
+@pytest.fixture
+def sync(app_main):
+    """Синхронизация кэшей этого процесса; изменения в тестах делает «другой воркер» напрямую в БД"""
+    sync = app_main.CacheSync(enabled=True, poll_interval=60, lookback=10, retention=3600)
+    # Записи, оставленные предыдущими тестами, применяются заранее
+    sync.poll()
+    return sync
+
+
+@pytest.fixture
+def other_worker(app_main):
+    db = app_main.SessionLocal()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def short_code(client):
+    response = client.post("/shorten", json={"target_url": next(urls)}, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()["short_code"]
+
+
+def test_poll_drops_links_changed_by_other_worker(app_main, client, short_code, sync, other_worker):
+    assert client.get(f"/{short_code}", follow_redirects=False).status_code in (301, 302, 307, 308)
+    assert app_main.url_cache.get(short_code) is not None
+
+    url = other_worker.query(app_main.URL).filter(app_main.URL.short_code == short_code).one()
+    url.is_active = False
+    sync.publish(other_worker, "url", short_code)
+    other_worker.commit()
+
+    assert sync.poll() == 1
+    assert app_main.url_cache.get(short_code) is None
+    assert client.get(f"/{short_code}", follow_redirects=False).status_code == 404
+
+
+def test_poll_applies_domain_changes(app_main, client, sync, other_worker):
+    response = client.post("/domains", json={"domain": "sync.example", "redirect_url": "https://example.com/a"},
+                           headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+
+    domain = other_worker.query(app_main.Domain).filter(app_main.Domain.domain == "sync.example").one()
+    domain.redirect_url = "https://example.com/b"
+    sync.publish(other_worker, "domain", "sync.example")
+    other_worker.commit()
+    sync.poll()
+    assert app_main.domain_routes.get("sync.example")[0] == "https://example.com/b"
+
+    other_worker.delete(domain)
+    sync.publish(other_worker, "domain", "sync.example")
+    other_worker.commit()
+    sync.poll()
+    assert app_main.domain_routes.get("sync.example") is None
+
+
+def test_entries_are_applied_once(short_code, sync, other_worker):
+    sync.publish(other_worker, "url", short_code)
+    other_worker.commit()
+    assert sync.poll() == 1
+    assert sync.poll() == 0
+
+
+def test_old_entries_are_cleaned_up_on_first_poll(app_main, other_worker, short_code):
+    old = app_main.CacheInvalidation(kind="url", key=short_code, created_at=time.time() - 7200)
+    other_worker.add(old)
+    other_worker.commit()
+    old_id = old.id
+    app_main.CacheSync(enabled=True, poll_interval=60, lookback=10, retention=3600).poll()
+    other_worker.expire_all()
+    assert other_worker.get(app_main.CacheInvalidation, old_id) is None
@@ -0,0 +1,68 @@
+import itertools
+
+import pytest
+
+from conftest import API_HEADERS
+
+urls = (f"https://example.com/clicks-{i}" for i in itertools.count())
+
+
+@pytest.fixture
+def short_code(client):
+    response = client.post("/shorten", json={"target_url": next(urls)}, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()["short_code"]
+
+
+def get_stats(client, short_code):
+    response = client.get(f"/urls/{short_code}/stats", headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def click(client, short_code, times=1, method="GET"):
+    for _ in range(times):
+        client.request(method, f"/{short_code}", follow_redirects=False)
+
+
+def test_redirects_are_counted_before_flush(client, short_code):
+    click(client, short_code, times=3)
+    stats = get_stats(client, short_code)
+    assert stats["total_clicks"] == 3
+    assert sum(bucket["count"] for bucket in stats["buckets"]) == 3
+
+
+def test_head_requests_are_not_counted(client, short_code):
+    click(client, short_code, times=2, method="HEAD")
+    assert get_stats(client, short_code)["total_clicks"] == 0
+
+
+def test_flushes_add_up_in_database(app_main, client, short_code):
+    click(client, short_code, times=2)
+    app_main.click_aggregator.flush()
+    assert app_main.click_aggregator.pending_for("url", short_code) == {}
+
+    click(client, short_code, times=3)
+    app_main.click_aggregator.flush()
+    stats = get_stats(client, short_code)
+    assert stats["total_clicks"] == 5
+    assert len(stats["buckets"]) == 1
+
+
+def test_failed_flush_keeps_counters(app_main, client, short_code, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("database is locked")
+
+    click(client, short_code, times=2)
+    monkeypatch.setattr(app_main, "run_write_sync", fail)
+    assert app_main.click_aggregator.flush() == 0
+    assert sum(app_main.click_aggregator.pending_for("url", short_code).values()) == 2
+
+    monkeypatch.undo()
+    app_main.click_aggregator.flush()
+    assert get_stats(client, short_code)["total_clicks"] == 2
+
+
+def test_unknown_code_has_no_stats(client):
+    response = client.get("/urls/nosuchcode/stats", headers=API_HEADERS)
+    assert response.status_code == 404
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import select
+
+from conftest import API_HEADERS
+
+
+def sequence_value(app_main) -> int:
+    db = app_main.SessionLocal()
+    try:
+        return db.execute(
+            select(app_main.CodeSequence.next_value)
+            .where(app_main.CodeSequence.name == app_main.SequenceCodeAllocator.SEQUENCE_NAME)
+        ).scalar() or 0
+    finally:
+        db.close()
+
+
+def test_block_survives_rolled_back_writer_job(app_main, client, monkeypatch):
+    """Откат задания writer после резерва блока не должен возвращать счетчик назад"""
+    assert app_main.db_writer is not None and app_main.db_writer.running
+    allocator = app_main.SequenceCodeAllocator(key=b"regression", block_size=3)
+    monkeypatch.setattr(app_main, "code_allocator", allocator)
+
+    # Первый код следующего блока уже занят старой ссылкой: вставка откатывает SAVEPOINT задания
+    taken = app_main.encode_code(app_main.scramble_code_index(sequence_value(app_main), allocator.key))
+    db = app_main.SessionLocal()
+    legacy_url = "https://legacy.example/taken"
+    db.add(app_main.URL(original_url=legacy_url, url_hash=app_main.get_url_hash(legacy_url),
+                        short_code=taken, created_at=app_main.utc_now(), is_active=True))
+    db.commit()
+    db.close()
+
+    codes = []
+    for i in range(8):
+        response = client.post("/shorten", json={"target_url": f"https://example.com/block/{i}"}, headers=API_HEADERS)
+        assert response.status_code == 200, response.text
+        codes.append(response.json()["short_code"])
+
+    assert len(set(codes)) == len(codes)
+    assert taken not in codes
+    # Счетчик в БД покрывает все выданные номера: после перезапуска они не выдадутся снова
+    assert sequence_value(app_main) >= allocator._end
+
+
+def test_released_code_is_reused(app_main):
+    allocator = app_main.SequenceCodeAllocator(key=b"release", block_size=10)
+    db = app_main.SessionLocal()
+    try:
+        first = allocator.allocate(db)
+        allocator.release(first)
+        assert allocator.allocate(db) == first
+        assert allocator.allocate(db) != first
+    finally:
+        db.close()
+
+
+def test_allocator_without_allocate_many_cannot_be_created(app_main):
+    class Incomplete(app_main.CodeAllocator):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
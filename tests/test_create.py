@@ -0,0 +1,79 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from conftest import API_HEADERS
+
+
+@contextmanager
+def statements(app_main):
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        # Резерв блока кодов пишет в code_sequences — считаем только запросы к urls
+        words = statement.split()
+        if "urls" in words:
+            executed.append(words[0].upper())
+
+    event.listen(app_main.engine, "before_cursor_execute", record)
+    try:
+        yield executed
+    finally:
+        event.remove(app_main.engine, "before_cursor_execute", record)
+
+
+def test_new_url_is_one_select_and_one_insert(app_main, client):
+    with statements(app_main) as executed:
+        response = client.post("/shorten", json={"target_url": "https://example.com/upsert-new"},
+                               headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert executed.count("INSERT") == 1
+    assert "UPDATE" not in executed
+
+
+def test_duplicate_reads_existing_link_without_allocating(app_main, client, monkeypatch):
+    first = client.post("/shorten", json={"target_url": "https://example.com/upsert-dup"}, headers=API_HEADERS)
+    assert first.status_code == 200, first.text
+
+    def no_allocation(db):
+        raise AssertionError("код выделен для уже существующей ссылки")
+
+    monkeypatch.setattr(app_main.code_allocator, "allocate", no_allocation)
+    with statements(app_main) as executed:
+        second = client.post("/shorten", json={"target_url": "https://example.com/upsert-dup"},
+                             headers=API_HEADERS)
+    assert second.status_code == 200, second.text
+    assert second.json()["short_code"] == first.json()["short_code"]
+    # Повтор — только чтение: ни INSERT, ни UPDATE
+    assert "INSERT" not in executed and "UPDATE" not in executed
+
+
+def test_concurrent_identical_requests_are_coalesced(app_main, client, monkeypatch):
+    create_short_url_job = app_main.create_short_url_job
+    calls = []
+
+    def slow_job(db, url):
+        calls.append(url)
+        time.sleep(0.3)
+        return create_short_url_job(db, url)
+
+    monkeypatch.setattr(app_main, "create_short_url_job", slow_job)
+    coalesced = app_main.shorten_single_flight.coalesced
+    responses = []
+
+    def post():
+        responses.append(client.post("/shorten", json={"target_url": "https://example.com/coalesced"},
+                                     headers=API_HEADERS))
+
+    threads = [threading.Thread(target=post) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [response.status_code for response in responses] == [200] * 5
+    assert len({response.json()["short_code"] for response in responses}) == 1
+    assert len(calls) == 1
+    assert app_main.shorten_single_flight.coalesced == coalesced + 4
@@ -0,0 +1,91 @@
+import itertools
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import API_HEADERS
+
+WELCOME = {"message": "Welcome to URL Shortener API"}
+REDIRECT_STATUSES = (301, 302, 307, 308)
+
+domain_names = (f"routes-{i}.example" for i in itertools.count())
+
+
+@contextmanager
+def no_queries(app_main):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = (app_main.engine, app_main.async_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+    assert statements == []
+
+
+@pytest.fixture
+def domain(client):
+    response = client.post("/domains", json={"domain": next(domain_names), "redirect_url": "https://example.com/home"},
+                           headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def get_root(client, host):
+    return client.get("/", headers={"Host": host}, follow_redirects=False)
+
+
+def test_root_redirect_uses_routing_table(app_main, client, domain):
+    with no_queries(app_main):
+        response = get_root(client, domain["domain"])
+    assert response.status_code in REDIRECT_STATUSES
+    assert response.headers["location"] == "https://example.com/home"
+
+
+def test_unknown_host_gets_welcome_without_database(app_main, client):
+    with no_queries(app_main):
+        response = get_root(client, "unknown.example")
+    assert response.status_code == 200
+    assert response.json() == WELCOME
+
+
+def test_update_changes_route(client, domain):
+    response = client.put(f"/domains/{domain['id']}", json={"redirect_url": "https://example.com/moved"},
+                          headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert get_root(client, domain["domain"]).headers["location"] == "https://example.com/moved"
+
+    client.put(f"/domains/{domain['id']}", json={"is_active": False}, headers=API_HEADERS)
+    assert get_root(client, domain["domain"]).json() == WELCOME
+
+
+def test_deleted_domain_falls_through_to_welcome(client, domain):
+    assert client.delete(f"/domains/{domain['id']}", headers=API_HEADERS).status_code == 200
+    assert get_root(client, domain["domain"]).json() == WELCOME
+
+
+def test_domain_deleted_by_name_falls_through_to_welcome(app_main, client, domain):
+    # DELETE /domains/{domain} перекрыт маршрутом с числовым id, поэтому задание вызывается напрямую
+    db = app_main.SessionLocal()
+    try:
+        app_main.delete_domain_by_name_job(db, domain["domain"])
+    finally:
+        db.close()
+    assert get_root(client, domain["domain"]).json() == WELCOME
+
+
+def test_routes_reload_from_database(app_main, client, domain):
+    app_main.domain_routes.remove(domain["domain"])
+    db = app_main.SessionLocal()
+    try:
+        app_main.domain_routes.load(db)
+    finally:
+        db.close()
+    assert get_root(client, domain["domain"]).headers["location"] == "https://example.com/home"
@@ -0,0 +1,67 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from conftest import API_HEADERS
+
+
+def test_create_with_past_expiry_is_rejected(client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/expired-on-arrival",
+                                             "expires_at": "2000-01-01T00:00:00Z"}, headers=API_HEADERS)
+    assert response.status_code == 422
+
+
+def test_update_with_past_expiry_is_rejected(client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/update-expiry"}, headers=API_HEADERS)
+    short_code = response.json()["short_code"]
+    response = client.put(f"/urls/{short_code}", json={"expires_at": "2000-01-01T00:00:00Z"}, headers=API_HEADERS)
+    assert response.status_code == 422
+    # Явный null по-прежнему снимает срок действия
+    response = client.put(f"/urls/{short_code}", json={"expires_at": None}, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+
+
+def test_expires_at_is_serialized_like_created_at(client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/expiry-format",
+                                             "expires_at": "2999-01-01T03:00:00+03:00"}, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    # Оба поля — время в UTC без зоны в одном формате
+    assert body["expires_at"] == "2999-01-01T00:00:00"
+    assert datetime.fromisoformat(body["created_at"]).tzinfo is None
+
+
+def test_imported_inactive_link_gets_deactivated_at(app_main, client):
+    body = json.dumps({"target_url": "https://example.com/imported-inactive", "is_active": False})
+    response = client.post("/urls/import", content=body, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    db = app_main.SessionLocal()
+    try:
+        deactivated_at = db.execute(
+            select(app_main.URL.deactivated_at)
+            .where(app_main.URL.original_url == "https://example.com/imported-inactive")
+        ).scalar_one()
+    finally:
+        db.close()
+    assert deactivated_at is not None
+
+
+def test_archived_link_keeps_click_stats(app_main, client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/to-archive"}, headers=API_HEADERS)
+    short_code = response.json()["short_code"]
+
+    db = app_main.SessionLocal()
+    try:
+        db.add(app_main.Click(kind="url", key=short_code, bucket_start=3600, count=7))
+        db.execute(update(app_main.URL).where(app_main.URL.short_code == short_code)
+                   .values(expires_at=app_main.utc_now() - timedelta(seconds=1)))
+        db.commit()
+        while app_main.archive_links_job(db, 100, None):
+            pass
+    finally:
+        db.close()
+
+    response = client.get(f"/urls/{short_code}/stats", headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert response.json()["total_clicks"] == 7
@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+from conftest import API_HEADERS
+
+
+def test_import_without_writer_runs_off_the_event_loop(app_main, client, monkeypatch):
+    # Без SQLite writer (как на PostgreSQL) порции импорта выполняются в отдельном потоке
+    monkeypatch.setattr(app_main, "db_writer", None)
+    import_urls_job = app_main.import_urls_job
+    on_loop = []
+
+    def recording_job(db, records):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return import_urls_job(db, records)
+
+    monkeypatch.setattr(app_main, "import_urls_job", recording_job)
+    body = "\n".join(json.dumps({"target_url": f"https://example.com/import/{i}"}) for i in range(5))
+    response = client.post("/urls/import", content=body, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert response.json()["inserted"] == 5
+    assert on_loop == [False]
+
+
+def test_concurrent_insert_of_same_url_counts_as_existing(app_main, monkeypatch):
+    """Параллельная запись успела вставить тот же URL — запись считается существующей, а не ошибкой"""
+    target_url = "https://example.com/import-race"
+    allocate_many = app_main.code_allocator.allocate_many
+    retries = app_main.code_allocator.retries
+
+    def allocate_and_race(db, count):
+        codes = allocate_many(db, count)
+        other = app_main.SessionLocal()
+        try:
+            other.add(app_main.URL(original_url=target_url, url_hash=app_main.get_url_hash(target_url),
+                                   short_code="irace1", created_at=app_main.utc_now(), is_active=True))
+            other.commit()
+        finally:
+            other.close()
+        return codes
+
+    monkeypatch.setattr(app_main.code_allocator, "allocate_many", allocate_and_race)
+    records = [
+        (1, app_main.URLImportRecord(target_url=target_url)),
+        (2, app_main.URLImportRecord(target_url="https://example.com/import-race-other")),
+    ]
+    db = app_main.SessionLocal()
+    try:
+        result = app_main.import_urls_job(db, records)
+    finally:
+        db.close()
+
+    assert result == {"inserted": 1, "existing": 1, "errors": []}
+    assert app_main.code_allocator.retries == retries
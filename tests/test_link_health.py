@@ -0,0 +1,98 @@
+import asyncio
+from collections import Counter
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+
+class CountingVerifier:
+    """Вместо HTTP-запросов считает проверки каждого адреса"""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def status(self, url: str) -> int:
+        self.calls[url] += 1
+        await asyncio.sleep(0.001)
+        return 200
+
+    async def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def verifiers():
+    return [CountingVerifier(), CountingVerifier()]
+
+
+@pytest.fixture
+def checkers(app_main, verifiers):
+    """Проверки двух процессов, разбирающих одну базу"""
+    return [
+        app_main.LinkHealthChecker(verifier=verifier, enabled=True, interval=3600, poll_interval=60,
+                                   batch_size=5, cache_size=0, cache_ttl=0, claim_ttl=600)
+        for verifier in verifiers
+    ]
+
+
+def test_each_link_checked_once_across_workers(app_main, verifiers, checkers):
+    db = app_main.SessionLocal()
+    try:
+        for i in range(23):
+            url = f"https://health.example/{i}"
+            db.add(app_main.URL(original_url=url, url_hash=app_main.get_url_hash(url),
+                                short_code=f"hc{i}", created_at=app_main.utc_now(), is_active=True))
+        db.commit()
+        active = db.execute(select(app_main.URL.original_url).where(app_main.URL.is_active == True)).scalars().all()
+    finally:
+        db.close()
+
+    async def sweep_concurrently():
+        return await asyncio.gather(*(checker.sweep() for checker in checkers))
+
+    checked = asyncio.run(sweep_concurrently())
+    calls = verifiers[0].calls + verifiers[1].calls
+    # Одни и те же ссылки не проверяются двумя процессами
+    assert set(calls) >= {url.partition("#")[0] for url in active}
+    assert max(calls.values()) == 1
+    assert sum(checked) >= 23
+
+    # До истечения интервала проверять нечего
+    assert asyncio.run(checkers[0].sweep()) == 0
+
+
+def test_claim_from_crashed_sweep_expires_after_lease(app_main):
+    db = app_main.SessionLocal()
+    try:
+        after_id = db.execute(select(func.max(app_main.URL.id))).scalar() or 0
+        for i in range(3):
+            url = f"https://lease.example/{i}"
+            db.add(app_main.URL(original_url=url, url_hash=app_main.get_url_hash(url),
+                                short_code=f"ls{i}", created_at=app_main.utc_now(), is_active=True))
+        db.commit()
+
+        now = app_main.utc_now()
+        due_before = now - timedelta(hours=1)
+
+        def claim(at):
+            return app_main.claim_link_health_job(db, "url", after_id, 100, due_before, at,
+                                                  at + timedelta(seconds=600))[1]
+
+        claimed = claim(now)
+        assert [url for row_id, url in claimed] == [f"https://lease.example/{i}" for i in range(3)]
+        # Процесс упал, не сохранив результат: до истечения аренды ссылки никто не берет,
+        # а health_checked_at не заполнен — после аренды их заберет другой процесс
+        assert claim(now + timedelta(seconds=1)) == []
+        checked_at = db.execute(select(app_main.URL.health_checked_at).where(app_main.URL.id > after_id)).scalars()
+        assert set(checked_at) == {None}
+        reclaimed = claim(now + timedelta(seconds=601))
+        assert reclaimed == claimed
+
+        app_main.store_link_health_job(db, [("url", row_id, 200) for row_id, url in reclaimed], now)
+        rows = db.execute(select(app_main.URL.health_checked_at, app_main.URL.health_claimed_until)
+                          .where(app_main.URL.id > after_id)).all()
+        assert rows == [(now, None)] * 3
+        assert claim(now + timedelta(seconds=1200)) == []
+    finally:
+        db.close()
@@ -0,0 +1,38 @@
+import argparse
+
+import pytest
+
+from bench import load_benchmark
+
+
+def route(rps=100.0, p50=1.0, p95=2.0, p99=3.0, errors=0):
+    return {"requests": int(rps * 10), "errors": errors, "throughput_rps": rps,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+
+
+@pytest.fixture
+def baseline():
+    return {"routes": {"redirect": route(), "shorten": route(rps=50.0, p50=5.0, p95=10.0, p99=20.0)}}
+
+
+def compare(results, baseline):
+    return load_benchmark.compare({"routes": results}, baseline, max_throughput_drop=0.10, max_latency_increase=0.20)
+
+
+def test_changes_within_thresholds_pass(baseline):
+    assert compare({"redirect": route(rps=91.0, p50=1.1, p95=2.3, p99=3.5), "root": route(rps=1.0)}, baseline) == []
+
+
+def test_throughput_drop_is_a_regression(baseline):
+    assert compare({"redirect": route(rps=89.0)}, baseline) == ["redirect: throughput 89.0 rps < baseline 100.0 rps"]
+
+
+def test_latency_and_errors_are_regressions(baseline):
+    problems = compare({"shorten": route(rps=50.0, p50=5.0, p95=10.0, p99=24.5, errors=1)}, baseline)
+    assert problems == ["shorten: p99_ms 24.5 > baseline 20.0", "shorten: errors 1 > baseline 0"]
+
+
+def test_mix_parsing():
+    assert load_benchmark.parse_mix("redirect=80,shorten=20") == {"redirect": 80.0, "shorten": 20.0}
+    with pytest.raises(argparse.ArgumentTypeError):
+        load_benchmark.parse_mix("redirect=80,delete=20")
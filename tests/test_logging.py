@@ -0,0 +1,57 @@
+import logging
+import queue
+
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture
+def sample_rate(app_main, monkeypatch):
+    def set_rate(rate):
+        monkeypatch.setattr(app_main, "LOG_SAMPLE_RATE", rate)
+    return set_rate
+
+
+def request_logs(caplog):
+    return [record for record in caplog.records if record.getMessage().startswith("Request to")]
+
+
+@pytest.mark.parametrize("rate, level, expected", [
+    (0, logging.INFO, False),
+    (1, logging.INFO, True),
+    (1, logging.WARNING, False),
+])
+def test_sampling_follows_rate_and_level(app_main, sample_rate, rate, level, expected):
+    sample_rate(rate)
+    previous = app_main.logger.level
+    app_main.logger.setLevel(level)
+    try:
+        assert app_main.log_sampled() is expected
+    finally:
+        app_main.logger.setLevel(previous)
+
+
+@pytest.mark.parametrize("rate, logged", [(0, 0), (1, 1)])
+def test_request_log_is_sampled(client, sample_rate, caplog, rate, logged):
+    sample_rate(rate)
+    with caplog.at_level(logging.INFO, logger="app.main"):
+        client.get("/")
+    assert len(request_logs(caplog)) == logged
+
+
+def test_records_are_queued_unformatted(app_main):
+    records = queue.SimpleQueue()
+    handler = app_main.DeferredQueueHandler(records)
+    record = logging.LogRecord("app.main", logging.INFO, __file__, 1, "Redirect %s -> %s", ("abc", "x"), None)
+    handler.emit(record)
+
+    queued = records.get_nowait()
+    assert queued is record
+    assert (queued.msg, queued.args) == ("Redirect %s -> %s", ("abc", "x"))
+    assert not hasattr(queued, "message")
+
+
+def test_pool_debug_listeners_are_off_by_default(app_main):
+    assert not app_main.DB_POOL_DEBUG
+    assert not event.contains(app_main.engine.pool, "checkout", app_main.on_checkout)
+    assert not event.contains(app_main.engine.pool, "checkin", app_main.on_checkin)
@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import API_HEADERS
+
+
+@pytest.fixture
+def registry(app_main):
+    return app_main.MetricsRegistry()
+
+
+def scrape(client):
+    response = client.get("/metrics", headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.text
+
+
+def sample(text, series):
+    for line in text.splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_counter_and_gauge_format(app_main, registry):
+    counter = registry.register(app_main.Counter("requests_total", "Requests", ("route", "status")))
+    registry.register(app_main.Gauge("cache_entries", "Entries", ("cache",), callback=lambda: [(("url",), 3)]))
+    counter.inc("redirect", "302")
+    counter.inc("redirect", "302", amount=2)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{route="redirect",status="302"} 3',
+        "# HELP cache_entries Entries",
+        "# TYPE cache_entries gauge",
+        'cache_entries{cache="url"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(app_main, registry):
+    histogram = registry.register(app_main.Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, "redirect")
+
+    assert registry.render().splitlines()[2:] == [
+        'latency_seconds_bucket{route="redirect",le="0.1"} 1',
+        'latency_seconds_bucket{route="redirect",le="1.0"} 3',
+        'latency_seconds_bucket{route="redirect",le="+Inf"} 4',
+        'latency_seconds_sum{route="redirect"} 4.25',
+        'latency_seconds_count{route="redirect"} 4',
+    ]
+
+
+@pytest.mark.parametrize("headers, status", [
+    ({}, 403),
+    ({"X-API-Key": "wrong"}, 403),
+    (API_HEADERS, 200),
+    ({"Host": "services.investingindigital.com"}, 200),
+])
+def test_metrics_access(client, headers, status):
+    response = client.get("/metrics", headers=headers)
+    assert response.status_code == status
+    if status == 200:
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+
+def test_requests_are_counted_by_route_group(client):
+    series = 'shortener_http_requests_total{route="redirect",method="GET",status="404"}'
+    before = sample(scrape(client), series)
+    client.get("/nosuchcode", follow_redirects=False)
+    client.get("/nosuchcode", follow_redirects=False)
+
+    text = scrape(client)
+    assert sample(text, series) == before + 2
+    assert "# TYPE shortener_http_request_duration_seconds histogram" in text
+    assert 'shortener_http_request_duration_seconds_count{route="redirect"}' in text
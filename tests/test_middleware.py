@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from conftest import API_HEADERS
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+DOCS_HOST = "services.investingindigital.com"
+
+
+class InnerApp:
+    """ASGI-приложение за middleware: запоминает, какие запросы до него дошли"""
+
+    def __init__(self):
+        self.paths = []
+
+    async def __call__(self, scope, receive, send):
+        self.paths.append(scope["path"])
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+@pytest.fixture
+def inner():
+    return InnerApp()
+
+
+@pytest.fixture
+def fast_path(app_main, inner):
+    return app_main.RedirectFastPathMiddleware(inner, app_main.app)
+
+
+def call(middleware, path, method="GET", headers=()):
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+             "headers": [(b"host", b"testserver"), *headers]}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return messages[0]["status"], dict(messages[0]["headers"])
+
+
+@pytest.fixture
+def short_code(client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/fast-path"}, headers=API_HEADERS)
+    return response.json()["short_code"]
+
+
+@pytest.mark.parametrize("path", ["/docs", "/api/openapi.json"])
+def test_docs_are_closed_to_other_hosts(client, path):
+    response = client.get(path)
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Access to API documentation is not allowed from this domain"}
+    assert client.get(path, headers={"Host": DOCS_HOST}).status_code == 200
+
+
+def test_redirect_is_answered_before_the_app(fast_path, inner, short_code):
+    status, headers = call(fast_path, f"/{short_code}")
+    assert status in REDIRECT_STATUSES
+    assert headers[b"location"] == b"https://example.com/fast-path"
+    assert call(fast_path, "/nosuchcode")[0] == 404
+    assert inner.paths == []
+
+
+@pytest.mark.parametrize("path, method, headers", [
+    ("/metrics", "GET", ()),
+    ("/urls/abc/stats", "GET", ()),
+    ("/abc123", "POST", ()),
+    ("/abc123", "GET", ((b"origin", b"https://example.com"),)),
+    ("/", "GET", ()),
+])
+def test_other_requests_pass_through(fast_path, inner, path, method, headers):
+    assert call(fast_path, path, method, headers)[0] == 204
+    assert inner.paths == [path]
+
+
+def test_static_routes_are_not_taken_for_short_codes(client):
+    assert client.get("/api/test", headers=API_HEADERS).json() == {"message": "API key is valid"}
@@ -0,0 +1,114 @@
+import hashlib
+import os
+
+import pytest
+import sqlalchemy as sa
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from alembic.script import ScriptDirectory
+
+from bench.schema_benchmark import ROOT_DIR, migrate
+
+BEFORE = "f2b7c1d4e839"
+CREATED_AT = "a3c8e5f1b207"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    yield engine
+    engine.dispose()
+
+
+def run(engine, revision, direction="upgrade"):
+    """Выполняет одну ревизию в своей транзакции, как env.py"""
+    # Модули ревизий загружаются заново, поэтому они видят текущее окружение
+    script = ScriptDirectory.from_config(Config(os.path.join(ROOT_DIR, "alembic.ini")))
+    with engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={"transaction_per_migration": True})
+        with Operations.context(context):
+            with context.begin_transaction(_per_migration=True):
+                getattr(script.get_revision(revision).module, direction)()
+
+
+def seed(engine, created_at="2024-01-02T03:04:05.123456"):
+    with engine.begin() as connection:
+        for i in range(3):
+            original_url = f"https://example.com/{i}"
+            connection.execute(sa.text(
+                "INSERT INTO urls (original_url, url_hash, short_code, created_at, is_active) "
+                "VALUES (:url, :hash, :code, :created_at, 1)"
+            ), {"url": original_url, "hash": hashlib.sha256(original_url.encode()).digest(), "code": f"code{i}",
+                "created_at": created_at})
+        connection.execute(sa.text(
+            "INSERT INTO domains (domain, redirect_url, created_at, is_active) "
+            "VALUES ('example.org', 'https://example.org/', :created_at, 1)"
+        ), {"created_at": created_at})
+
+
+def created_at(engine, table):
+    with engine.connect() as connection:
+        return connection.execute(sa.text(f"SELECT created_at FROM {table} ORDER BY id")).scalars().all()
+
+
+def column_type(engine, table, column):
+    return {item["name"]: item["type"] for item in sa.inspect(engine).get_columns(table)}[column]
+
+
+def test_local_created_at_is_converted_to_utc(engine, monkeypatch):
+    monkeypatch.setenv("CREATED_AT_LEGACY_TZ", "Europe/Moscow")
+    migrate(engine, BEFORE)
+    seed(engine)
+    run(engine, CREATED_AT)
+
+    assert isinstance(column_type(engine, "urls", "created_at"), sa.DateTime)
+    assert created_at(engine, "urls") == ["2024-01-02 00:04:05.123456"] * 3
+    # Домены писали время в UTC
+    assert created_at(engine, "domains") == ["2024-01-02 03:04:05.123456"]
+
+
+def test_downgrade_restores_local_strings(engine, monkeypatch):
+    monkeypatch.setenv("CREATED_AT_LEGACY_TZ", "Europe/Moscow")
+    migrate(engine, BEFORE)
+    seed(engine)
+    run(engine, CREATED_AT)
+    run(engine, CREATED_AT, "downgrade")
+    assert created_at(engine, "urls") == ["2024-01-02T03:04:05.123456"] * 3
+    assert created_at(engine, "domains") == ["2024-01-02T03:04:05.123456"]
+
+
+def test_legacy_zone_is_required_for_existing_rows(engine, monkeypatch):
+    monkeypatch.delenv("CREATED_AT_LEGACY_TZ", raising=False)
+    migrate(engine, BEFORE)
+    seed(engine)
+    with pytest.raises(RuntimeError, match="CREATED_AT_LEGACY_TZ"):
+        run(engine, CREATED_AT)
+    assert not isinstance(column_type(engine, "urls", "created_at"), sa.DateTime)
+
+
+def test_empty_database_does_not_need_legacy_zone(engine, monkeypatch):
+    monkeypatch.delenv("CREATED_AT_LEGACY_TZ", raising=False)
+    migrate(engine, BEFORE)
+    run(engine, CREATED_AT)
+    assert isinstance(column_type(engine, "urls", "created_at"), sa.DateTime)
+
+
+def test_interrupted_backfill_keeps_converted_rows(engine, monkeypatch):
+    monkeypatch.setenv("CREATED_AT_LEGACY_TZ", "UTC")
+    migrate(engine, BEFORE)
+    seed(engine)
+    # Состояние после прерванного запуска: колонка добавлена, первая строка уже заполнена
+    with engine.begin() as connection:
+        connection.execute(sa.text("ALTER TABLE urls ADD COLUMN created_at_new DATETIME"))
+        connection.execute(sa.text("UPDATE urls SET created_at_new = '2000-01-01 00:00:00.000000' WHERE id = 1"))
+    run(engine, CREATED_AT)
+    assert created_at(engine, "urls") == ["2000-01-01 00:00:00.000000"] + ["2024-01-02 03:04:05.123456"] * 2
+
+
+def test_migrated_schema_matches_models(app_main, engine, monkeypatch):
+    monkeypatch.setenv("CREATED_AT_LEGACY_TZ", "UTC")
+    migrate(engine, "heads")
+    with engine.connect() as connection:
+        assert compare_metadata(MigrationContext.configure(connection), app_main.Base.metadata) == []
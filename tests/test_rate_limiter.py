@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.fixture
+def limiter(app_main, monkeypatch, request):
+    """Ограничитель с лимитами из параметра теста (переменные окружения RATE_LIMIT_*)"""
+    for name, value in request.param.items():
+        monkeypatch.setenv(name, value)
+    return app_main.RateLimiter(enabled=True, max_buckets=1000)
+
+
+@pytest.mark.parametrize("limiter", [{"RATE_LIMIT_CREATE": "1,2", "RATE_LIMIT_KEY_CREATE": "100,50"}], indirect=True)
+def test_keyed_client_is_not_capped_by_ip_limit(limiter):
+    assert all(limiter.check("create", "10.0.0.1", "full") == 0 for _ in range(50))
+    assert limiter.check("create", "10.0.0.1", "full") > 0
+    # Запросы с ключом не расходуют корзину IP
+    assert limiter.check("create", "10.0.0.1", None) == 0
+
+
+@pytest.mark.parametrize("limiter", [{"RATE_LIMIT_CREATE": "1,3", "RATE_LIMIT_KEY_CREATE": "100,2"}], indirect=True)
+def test_denied_request_does_not_charge_other_bucket(limiter):
+    assert limiter.check("create", "10.0.0.2", "full") == 0
+    assert limiter.check("create", "10.0.0.2", "full") == 0
+    assert limiter.check("create", "10.0.0.2", "full") > 0
+    assert all(limiter.check("create", "10.0.0.2", None) == 0 for _ in range(3))
+    assert limiter.check("create", "10.0.0.2", None) > 0
+
+
+@pytest.mark.parametrize("limiter", [{"RATE_LIMIT_REDIRECT": "1,2", "RATE_LIMIT_KEY_REDIRECT": ""}], indirect=True)
+def test_ip_limit_applies_when_group_has_no_key_limit(limiter):
+    assert limiter.check("redirect", "10.0.0.3", "full") == 0
+    assert limiter.check("redirect", "10.0.0.3", "full") == 0
+    assert limiter.check("redirect", "10.0.0.3", "full") > 0
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+@pytest.fixture
+def replicas(app_main, tmp_path):
+    replicas = app_main.ReadReplicas([f"sqlite:///{tmp_path}/replica.db"], retry_interval=30, max_lag=5)
+    yield replicas
+    asyncio.run(replicas.dispose())
+
+
+def reads_from(replicas, outcome):
+    """Чтение, которое запоминает, с какой БД его выполнили, и возвращает outcome(метка БД)"""
+    targets = []
+    replica_engine = replicas.replicas[0]["engine"].sync_engine
+
+    async def read(db):
+        target = "replica" if db.bind.sync_engine is replica_engine else "primary"
+        targets.append(target)
+        return outcome(target)
+
+    return read, targets
+
+
+@pytest.mark.parametrize("timeout", ["statement", "pool"])
+def test_replica_timeout_falls_back_to_primary(replicas, timeout):
+    error = asyncio.TimeoutError() if timeout == "statement" else PoolTimeoutError("QueuePool limit reached")
+
+    def outcome(target):
+        if target == "replica":
+            raise error
+        return "row"
+
+    read, targets = reads_from(replicas, outcome)
+    assert asyncio.run(replicas.run(read, kind="url", key="abc123")) == "row"
+    assert targets == ["replica", "primary"]
+    assert replicas.failovers == 1
+    assert replicas.replicas[0]["down_until"] > 0
+
+
+def test_replica_miss_rechecks_primary_only_after_recent_writes(replicas):
+    read, targets = reads_from(replicas, lambda target: None)
+    assert asyncio.run(replicas.run(read, kind="url", key="abc123", primary_on_none=True)) is None
+    assert targets == ["replica"]
+
+    # Запись другой ссылки: отстающая реплика может не знать и о других новых кодах
+    replicas.pin("url", "zzz999")
+    targets.clear()
+    asyncio.run(replicas.run(read, kind="url", key="abc123", primary_on_none=True))
+    assert targets == ["replica", "primary"]
+
+    # Сам записанный ключ сразу читается с основной БД
+    targets.clear()
+    asyncio.run(replicas.run(read, kind="url", key="zzz999", primary_on_none=True))
+    assert targets == ["primary"]
@@ -0,0 +1,84 @@
+import itertools
+
+import pytest
+
+from conftest import API_HEADERS
+
+urls = (f"https://example.com/status-{i}" for i in itertools.count())
+domain_names = (f"status-{i}.example" for i in itertools.count())
+
+
+@pytest.fixture
+def link(client):
+    def create(**fields):
+        response = client.post("/shorten", json={"target_url": next(urls), **fields}, headers=API_HEADERS)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
+
+
+def follow(client, short_code, method="GET"):
+    return client.request(method, f"/{short_code}", follow_redirects=False)
+
+
+def test_default_status_is_temporary_and_not_cached(link, client):
+    created = link()
+    assert created["redirect_status"] is None
+    response = follow(client, created["short_code"])
+    assert response.status_code == 302
+    assert response.headers["cache-control"] == "no-cache"
+
+
+def test_permanent_status_is_cacheable(link, client):
+    created = link(redirect_status=301)
+    assert created["redirect_status"] == 301
+    response = follow(client, created["short_code"])
+    assert response.status_code == 301
+    assert response.headers["cache-control"] == "public, max-age=86400"
+
+
+def test_update_sets_and_resets_status(link, client):
+    short_code = link()["short_code"]
+    response = client.put(f"/urls/{short_code}", json={"redirect_status": 308}, headers=API_HEADERS)
+    assert response.json()["redirect_status"] == 308
+    assert follow(client, short_code).status_code == 308
+
+    response = client.put(f"/urls/{short_code}", json={"redirect_status": None}, headers=API_HEADERS)
+    assert response.json()["redirect_status"] is None
+    assert follow(client, short_code).status_code == 302
+
+
+def test_unsupported_status_is_rejected(client):
+    response = client.post("/shorten", json={"target_url": next(urls), "redirect_status": 303}, headers=API_HEADERS)
+    assert response.status_code == 422
+
+
+def test_head_matches_get_without_body(link, client):
+    short_code = link(redirect_status=307)["short_code"]
+    get, head = follow(client, short_code), follow(client, short_code, "HEAD")
+    assert head.status_code == get.status_code == 307
+    for header in ("location", "cache-control"):
+        assert head.headers[header] == get.headers[header]
+    assert head.content == b""
+
+
+def test_domain_root_uses_domain_status(client):
+    domain = next(domain_names)
+    response = client.post("/domains", json={"domain": domain, "redirect_url": "https://example.com/home",
+                                             "redirect_status": 308}, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    for method in ("GET", "HEAD"):
+        response = client.request(method, "/", headers={"Host": domain}, follow_redirects=False)
+        assert response.status_code == 308
+        assert response.headers["cache-control"] == "public, max-age=86400"
+
+
+@pytest.mark.parametrize("shared_max_age, status, expected", [
+    ("", 302, "no-cache"),
+    ("", 308, "public, max-age=86400"),
+    ("60", 307, "public, max-age=0, s-maxage=60"),
+    ("60", 301, "public, max-age=86400, s-maxage=60"),
+])
+def test_cache_control_policy(app_main, monkeypatch, shared_max_age, status, expected):
+    monkeypatch.setattr(app_main, "REDIRECT_SHARED_MAX_AGE", shared_max_age)
+    assert app_main.redirect_cache_control(status) == expected
@@ -0,0 +1,97 @@
+import os
+import time
+from datetime import timedelta
+
+import pytest
+
+from conftest import API_HEADERS
+
+
+@pytest.fixture
+def table(app_main, tmp_path):
+    table = app_main.RedirectTable(str(tmp_path / "redirects.bin"), margin=0)
+    yield table
+    table.close()
+
+
+def build(table):
+    table.compile(table.path)
+    assert table.reload()
+
+
+def shorten(client, **fields):
+    body = {"target_url": f"https://example.com/table-{os.urandom(4).hex()}", **fields}
+    response = client.post("/shorten", json=body, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()["short_code"], body["target_url"]
+
+
+def test_lookup_returns_target_and_status(client, table):
+    code, target_url = shorten(client)
+    permanent_code, permanent_url = shorten(client, redirect_status=301)
+    build(table)
+    assert table.get(code) == (target_url, None)
+    assert table.get(permanent_code) == (permanent_url, 301)
+    assert table.get("zzzzzz") is None
+    assert table.get("much-too-long") is None
+
+
+def test_inactive_links_are_not_compiled(client, table):
+    code, _ = shorten(client)
+    client.put(f"/urls/{code}", json={"is_active": False}, headers=API_HEADERS)
+    build(table)
+    assert table.get(code) is None
+
+
+def test_expiry_is_checked_on_lookup(app_main, client, table):
+    code, target_url = shorten(client)
+    db = app_main.SessionLocal()
+    try:
+        db.query(app_main.URL).filter(app_main.URL.short_code == code) \
+            .update({"expires_at": app_main.utc_now() + timedelta(seconds=0.3)})
+        db.commit()
+    finally:
+        db.close()
+    build(table)
+    assert table.get(code) == (target_url, None)
+    time.sleep(0.4)
+    assert table.get(code) is None
+
+
+def test_changed_codes_are_skipped_until_next_build(client, table):
+    code, target_url = shorten(client)
+    build(table)
+    table.invalidate(code)
+    assert table.get(code) is None
+    assert table.stats()["dirty"] == 1
+
+    build(table)
+    assert table.get(code) == (target_url, None)
+    assert table.stats()["dirty"] == 0
+
+
+def test_reload_only_picks_up_replaced_file(table):
+    assert not table.reload()
+    build(table)
+    assert not table.reload()
+    build(table)
+
+
+def test_foreign_file_is_rejected(table):
+    with open(table.path, "wb") as table_file:
+        table_file.write(bytes(64))
+    assert not table.reload()
+    assert table.built_at is None
+
+
+def test_redirect_is_served_from_table(app_main, client, table, monkeypatch):
+    code, target_url = shorten(client)
+    build(table)
+    monkeypatch.setattr(app_main, "redirect_table", table)
+    app_main.url_cache.clear()
+
+    response = client.get(f"/{code}", follow_redirects=False)
+    assert response.headers["location"] == target_url
+    assert table.hits == 1
+    # Запрос в БД заполнил бы кэш ссылок
+    assert app_main.url_cache.get(code) is None
@@ -0,0 +1,85 @@
+import time
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import API_HEADERS
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+
+
+def insert_url(app_main, short_code: str, original_url: str) -> None:
+    """Ссылка, созданная в обход этого процесса (другой процесс или импорт из командной строки)"""
+    db = app_main.SessionLocal()
+    try:
+        db.add(app_main.URL(original_url=original_url, url_hash=app_main.get_url_hash(original_url),
+                            short_code=short_code, created_at=app_main.utc_now(), is_active=True))
+        db.commit()
+    finally:
+        db.close()
+
+
+@contextmanager
+def urls_queries(app_main):
+    """Собирает запросы к таблице urls через оба движка"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if " urls" in statement:
+            statements.append(statement)
+
+    engines = (app_main.engine, app_main.async_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def code_filter(app_main, client):
+    code_filter = app_main.short_code_filter
+    deadline = time.monotonic() + 10
+    while not code_filter.ready and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert code_filter.ready
+    return code_filter
+
+
+def test_misses_do_not_touch_database(app_main, client, code_filter):
+    with urls_queries(app_main) as statements:
+        for path in ("/favicon.ico", "/robots.txt", "/zzzzzz", "/" + "a" * 40):
+            assert client.get(path, follow_redirects=False).status_code == 404
+    assert statements == []
+    assert code_filter.rejected_shape >= 3
+
+
+def test_code_from_other_process_resolves_after_sync(app_main, client, code_filter):
+    insert_url(app_main, "xproc1", "https://example.com/other-process")
+    code_filter.sync()
+    response = client.get("/xproc1", follow_redirects=False)
+    assert response.status_code in REDIRECT_STATUSES
+    assert response.headers["location"] == "https://example.com/other-process"
+
+
+def test_irregular_codes_in_database_stay_reachable(app_main, client, code_filter):
+    insert_url(app_main, "old.1", "https://example.com/legacy-shape")
+    code_filter.build()
+    assert code_filter.might_exist("old.1")
+    # Остальные строки той же формы по-прежнему отсекаются
+    assert not code_filter.might_exist("old.2")
+
+
+def test_irregular_custom_code_keeps_shape_check_for_others(app_main, client, code_filter):
+    response = client.post("/shorten", json={"target_url": "https://example.com/custom-shape",
+                                             "custom_code": "a.b"}, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert response.json()["short_code"] == "a.b"
+    assert client.get("/a.b", follow_redirects=False).status_code in REDIRECT_STATUSES
+
+    rejected = code_filter.rejected_shape
+    assert client.get("/robots.txt", follow_redirects=False).status_code == 404
+    assert code_filter.rejected_shape == rejected + 1
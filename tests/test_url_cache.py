@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from conftest import API_HEADERS
+
+REDIRECT_STATUSES = (301, 302, 307, 308)
+
+
+@pytest.fixture
+def cache(app_main):
+    return app_main.TTLCache(max_size=2, ttl=60)
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_entry_expires_after_ttl(cache):
+    cache.ttl = 0.05
+    cache.set("a", 1)
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+
+def test_invalidate_drops_entry(cache):
+    cache.set("a", 1)
+    cache.invalidate("a", None)
+    assert cache.get("a") is None
+
+
+def test_repeated_redirect_is_served_from_cache(app_main, client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/cached"}, headers=API_HEADERS)
+    short_code = response.json()["short_code"]
+    assert client.get(f"/{short_code}", follow_redirects=False).status_code in REDIRECT_STATUSES
+    hits = app_main.url_cache.hits
+    response = client.get(f"/{short_code}", follow_redirects=False)
+    assert response.headers["location"] == "https://example.com/cached"
+    assert app_main.url_cache.hits == hits + 1
+
+
+@pytest.mark.parametrize("change", ["deactivate", "delete"])
+def test_changed_link_stops_redirecting_immediately(client, change):
+    target_url = f"https://example.com/cached-{change}"
+    response = client.post("/shorten", json={"target_url": target_url}, headers=API_HEADERS)
+    short_code = response.json()["short_code"]
+    assert client.get(f"/{short_code}", follow_redirects=False).status_code in REDIRECT_STATUSES
+
+    if change == "deactivate":
+        response = client.put(f"/urls/{short_code}", json={"is_active": False}, headers=API_HEADERS)
+    else:
+        response = client.delete(f"/urls/{short_code}", headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert client.get(f"/{short_code}", follow_redirects=False).status_code == 404
+
+
+def test_reused_custom_code_redirects_to_new_target(client):
+    response = client.post("/shorten", json={"target_url": "https://example.com/reuse-old", "custom_code": "reuse1"},
+                           headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    client.put("/urls/reuse1", json={"is_active": False}, headers=API_HEADERS)
+    # Неактивная ссылка попадает в кэш
+    assert client.get("/reuse1", follow_redirects=False).status_code == 404
+
+    response = client.post("/shorten", json={"target_url": "https://example.com/reuse-new", "custom_code": "reuse1"},
+                           headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    response = client.get("/reuse1", follow_redirects=False)
+    assert response.status_code in REDIRECT_STATUSES
+    assert response.headers["location"] == "https://example.com/reuse-new"
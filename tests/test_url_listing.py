@@ -0,0 +1,86 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from conftest import API_HEADERS
+
+
+@pytest.fixture
+def links(app_main, client):
+    """Пять ссылок, созданных 1–5 января 2001 года; ссылка от 3 января неактивна"""
+    codes = []
+    for day in range(1, 6):
+        response = client.post("/shorten", json={"target_url": f"https://example.com/listing-{os.urandom(4).hex()}"},
+                               headers=API_HEADERS)
+        assert response.status_code == 200, response.text
+        codes.append(response.json()["short_code"])
+
+    db = app_main.SessionLocal()
+    try:
+        rows = db.query(app_main.URL).filter(app_main.URL.short_code.in_(codes)).order_by(app_main.URL.id).all()
+        for day, row in enumerate(rows, start=1):
+            row.created_at = datetime(2001, 1, day)
+            row.is_active = day != 3
+        db.commit()
+        return [(row.id, row.short_code) for row in rows]
+    finally:
+        db.close()
+
+
+def list_page(client, **params):
+    response = client.get("/urls", params=params, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def export(client, **params):
+    response = client.get("/urls/export", params=params, headers=API_HEADERS)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_pages_follow_next_after_id(client, links):
+    after_id, seen = links[0][0] - 1, []
+    while after_id is not None:
+        page = list_page(client, after_id=after_id, limit=2, created_to="2001-01-06")
+        assert len(page["items"]) <= 2
+        seen += [(item["id"], item["short_code"]) for item in page["items"]]
+        after_id = page["next_after_id"]
+    assert seen == links
+
+
+@pytest.mark.parametrize("params, days", [
+    ({"is_active": "false"}, [3]),
+    ({"is_active": "true"}, [1, 2, 4, 5]),
+    ({"created_from": "2001-01-02", "created_to": "2001-01-04"}, [2, 3]),
+    ({"created_from": "2001-01-04T00:00:00+03:00"}, [4, 5]),
+])
+def test_filters(client, links, params, days):
+    page = list_page(client, after_id=links[0][0] - 1, limit=1000, **{"created_to": "2001-01-06", **params})
+    assert [item["short_code"] for item in page["items"]] == [links[day - 1][1] for day in days]
+    assert page["next_after_id"] is None
+
+
+def test_export_streams_all_matching_rows(client, links):
+    rows = export(client, after_id=links[0][0] - 1, created_to="2001-01-06")
+    assert [(row["id"], row["short_code"]) for row in rows] == links
+    assert rows[0]["created_at"] == "2001-01-01T00:00:00"
+    assert [row["is_active"] for row in rows] == [True, True, False, True, True]
+
+
+def test_export_resumes_after_id(client, links):
+    rows = export(client, after_id=links[2][0], created_to="2001-01-06")
+    assert [row["short_code"] for row in rows] == [code for _, code in links[3:]]
+
+
+@pytest.mark.parametrize("path", ["/urls", "/urls/export"])
+def test_listing_requires_full_access(client, path):
+    assert client.get(path, headers={"X-API-Key": os.environ["CREATE_ONLY_API_KEY"]}).status_code == 403
+
+
+def test_page_size_is_limited(app_main, client):
+    response = client.get("/urls", params={"limit": app_main.URL_LIST_MAX_LIMIT + 1}, headers=API_HEADERS)
+    assert response.status_code == 422
@@ -0,0 +1,93 @@
+import asyncio
+from collections import Counter
+
+import httpx
+import pytest
+
+
+class FakeTargets:
+    """Отвечает на запросы проверки вместо сети и считает их"""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.in_flight = Counter()
+        self.max_in_flight = Counter()
+        self.status = 200
+        self.error = None
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.requests[request.method, str(request.url)] += 1
+        self.in_flight[host] += 1
+        self.max_in_flight[host] = max(self.max_in_flight[host], self.in_flight[host])
+        try:
+            await asyncio.sleep(0.01)
+            if self.error is not None:
+                raise self.error
+            if request.method == "HEAD" and request.url.path == "/no-head":
+                return httpx.Response(405)
+            return httpx.Response(self.status)
+        finally:
+            self.in_flight[host] -= 1
+
+
+@pytest.fixture
+def targets():
+    return FakeTargets()
+
+
+@pytest.fixture
+def verifier(app_main, targets):
+    verifier = app_main.UrlVerifier(timeout=1, max_concurrency=4, per_host_concurrency=2, cache_ttl=60,
+                                    cache_size=100, allow_on_unexpected_error=True)
+    verifier._clients[0] = httpx.AsyncClient(transport=httpx.MockTransport(targets.handle))
+    yield verifier
+    asyncio.run(verifier.close())
+
+
+def test_result_is_cached_per_url(verifier, targets):
+    async def verify_twice():
+        return [await verifier.verify("https://a.example/page") for _ in range(2)]
+
+    assert asyncio.run(verify_twice()) == [True, True]
+    assert targets.requests == {("HEAD", "https://a.example/page"): 1}
+
+
+def test_falls_back_to_get_when_head_is_not_allowed(verifier, targets):
+    assert asyncio.run(verifier.verify("https://a.example/no-head"))
+    assert set(targets.requests) == {("HEAD", "https://a.example/no-head"), ("GET", "https://a.example/no-head")}
+
+
+def test_error_status_is_unavailable(verifier, targets):
+    targets.status = 404
+    assert not asyncio.run(verifier.verify("https://a.example/missing"))
+
+
+def test_concurrency_is_limited_per_host(verifier, targets):
+    async def verify_many():
+        urls = [f"https://{host}.example/{i}" for host in ("a", "b", "c") for i in range(6)]
+        return await asyncio.gather(*(verifier.verify(url) for url in urls))
+
+    assert all(asyncio.run(verify_many()))
+    assert max(targets.max_in_flight.values()) == 2
+    assert sum(targets.requests.values()) == 18
+
+
+def test_unreachable_host_is_not_probed_again(verifier, targets):
+    targets.error = httpx.ConnectError("connection refused")
+
+    async def verify_same_host():
+        return [await verifier.verify("https://down.example/1"), await verifier.verify("https://down.example/2")]
+
+    assert asyncio.run(verify_same_host()) == [False, False]
+    assert sum(targets.requests.values()) == 1
+
+
+@pytest.mark.parametrize("allow", [True, False])
+def test_unexpected_error_result_is_configurable_and_not_cached(verifier, targets, allow):
+    verifier.allow_on_unexpected_error = allow
+    targets.error = RuntimeError("unexpected")
+    assert asyncio.run(verifier.verify("https://a.example/flaky")) is allow
+
+    targets.error = None
+    assert asyncio.run(verifier.verify("https://a.example/flaky")) is True